@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Benchmark: fit and predict time of each model engine by rows and thread budget
+
+Usage:
+    python benchmarks/bench_model_engines.py [max_rows] [threads]
+
+Fits every engine on RA features of a random walk of 10,000 rows and
+up to ``max_rows`` rows (default 1,000,000, growing tenfold), on one thread
+and on ``threads`` threads (default: available cores). The random forest
+is skipped above MODEL_AUTO_FOREST_MAX_ROWS rows, where "auto" no longer
+picks it, unless --all is given.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MODEL_AUTO_FOREST_MAX_ROWS, MODEL_PARAMS, RA_FEATURES, available_cores, encode_ra_features, fit_model
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--all"]
+    max_rows = int(args[0]) if args else 1_000_000
+    threads = int(args[1]) if len(args) > 1 else available_cores()
+    rng = np.random.default_rng(42)
+
+    rows = 10_000
+    print(f"{'rows':>10} {'engine':<24} {'threads':>7} {'fit s':>8} {'predict s':>10}")
+    while rows <= max_rows:
+        df = encode_ra_features(pd.DataFrame({"value": rng.normal(size=rows).cumsum()}))
+        X = df[list(RA_FEATURES)].fillna(0).to_numpy(dtype=np.float32)
+        y = X[:, 0] * 0.8 + 0.1
+        for engine in MODEL_PARAMS:
+            if engine == "random_forest" and rows > MODEL_AUTO_FOREST_MAX_ROWS and "--all" not in sys.argv:
+                continue
+            for budget in sorted({1, threads}):
+                model, info = fit_model(engine, X, y, budget, None)
+                started = time.perf_counter()
+                model.predict(X)
+                predict_seconds = time.perf_counter() - started
+                print(f"{rows:>10,} {engine:<24} {budget:>7} {info['fit_seconds']:>8.2f} {predict_seconds:>10.2f}")
+        rows *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark: wide RA encoding in one 2-D pass vs. encode_ra_features per column
+
+Usage:
+    python benchmarks/bench_ra_encoding.py [rows] [columns]
+
+Defaults to 1,000,000 x 50, which needs several GB of RAM; pass smaller
+sizes on constrained machines.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import encode_ra_features, encode_ra_matrix, RA_FEATURES
+
+
+def per_column(df: pd.DataFrame) -> pd.DataFrame:
+    """Baseline: the single-column encoder applied to each column in turn"""
+    parts = []
+    for col in df.columns:
+        encoded = encode_ra_features(df[[col]])
+        parts.append(encoded[list(RA_FEATURES)].add_suffix(f"_{col}"))
+    return pd.concat(parts, axis=1)
+
+
+def measure(label: str, fn, df: pd.DataFrame):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn(df)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed:8.2f} s   peak {peak / 1024 ** 2:9.1f} MiB")
+    return result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    cols = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame(rng.normal(size=(rows, cols)), columns=[f"c{i}" for i in range(cols)])
+    print(f"{rows:,} rows x {cols} columns")
+    
+    baseline = measure("encode_ra_features/column", per_column, df)
+    del baseline
+    measure("encode_ra_matrix float64", encode_ra_matrix, df)
+    measure("encode_ra_matrix float32", lambda frame: encode_ra_matrix(frame, dtype=np.float32), df)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark: run catalogue listings over a large number of indexed runs
+
+Usage:
+    python benchmarks/bench_run_catalogue.py [runs] [database]
+
+Defaults to 1,000,000 synthetic runs in a temporary database. Filling it
+takes a couple of minutes; pass an existing database path to reuse it.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as service
+from main import RunCatalogue
+
+
+QUERIES = {
+    "newest": {},
+    "deployed": {"deployed": True},
+    "threshold_met since June": {"threshold_met": True, "created_after": "2026-06-01"},
+    "narrow mean_prediction": {"metric_ranges": {"mean_prediction": (0.4, 0.41)}},
+    "wide mean_prediction": {"metric_ranges": {"mean_prediction": (0.1, 0.9)}},
+    "rows 10-1000": {"metric_ranges": {"rows": (10, 1000)}},
+}
+
+
+def fill(catalogue: RunCatalogue, runs: int):
+    rng = np.random.default_rng(42)
+    starts = np.datetime64("2026-01-01T00:00:00") + rng.integers(0, 300 * 86400 * 10 ** 6, runs).astype("timedelta64[us]")
+    conn = catalogue._connect()
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO runs (run_id, status, created_at, updated_at, threshold_met, deployed, rows, "
+        "mean_prediction, ra_mean) VALUES (?, 'done', ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (str(uuid.UUID(int=int(rng.integers(2 ** 63)) << 64)), f"{start}+00:00", f"{start}+00:00",
+             int(i % 2), int(i % 100 == 0), int(rows), float(mean), float(ra))
+            for i, (start, rows, mean, ra) in enumerate(zip(
+                starts, rng.integers(1, 10 ** 6, runs), rng.random(runs), rng.random(runs)
+            ))
+        )
+    )
+    conn.execute("COMMIT")
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    path = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(tempfile.mkdtemp()) / "catalogue.db"
+    # Keep a new catalogue from being backfilled with the local runs
+    service.ARTIFACTS_DIR = path.parent / "no-artifacts"
+    catalogue = RunCatalogue(path)
+    if catalogue.count() == 0:
+        started = time.perf_counter()
+        fill(catalogue, runs)
+        print(f"indexed {runs:,} runs in {time.perf_counter() - started:.1f} s")
+    print(f"{catalogue.count():,} runs in {path}")
+    
+    for label, filters in QUERIES.items():
+        started = time.perf_counter()
+        page, cursor = catalogue.list_runs(**filters)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        if cursor is not None:
+            catalogue.list_runs(**filters, cursor=cursor)
+        second = time.perf_counter() - started
+        print(f"{label:<28} {first * 1000:7.1f} ms   next page {second * 1000:7.1f} ms   ({len(page)} runs)")
+
+
+if __name__ == "__main__":
+    main()
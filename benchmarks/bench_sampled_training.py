@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark: training on every row vs. on a sample, predicting every row in chunks
+
+Usage:
+    python benchmarks/bench_sampled_training.py [rows] [sample_rows]
+
+Defaults to 5,000,000 rows and a 500,000 row sample. Runs the fit/predict
+stage (``_fit_predict``) on the RA features of a random walk with no row
+budget, then with a reservoir and a stratified sample. For each it prints
+wall time, traced peak memory, and how closely the predictions match those
+of the model fitted on every row (R^2 and mean absolute difference).
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import AnalysisOptions, _fit_predict, encode_ra_features
+
+
+def measure(label: str, df: pd.DataFrame, options: AnalysisOptions, reference=None):
+    tracemalloc.start()
+    started = time.perf_counter()
+    predictions, _, _, info = _fit_predict(df, options=options)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    agreement = ""
+    if reference is not None:
+        r2 = 1 - np.sum((predictions - reference) ** 2) / np.sum((reference - reference.mean()) ** 2)
+        agreement = f"   R^2 {r2:.5f}   mean |diff| {np.mean(np.abs(predictions - reference)):.2e}"
+    print(f"{label:<24} {elapsed:7.2f} s (fit {info['fit_seconds']:6.2f} s)   "
+          f"peak {peak / 1024 ** 2:8.1f} MiB{agreement}")
+    return predictions
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    sample_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 500_000
+    rng = np.random.default_rng(42)
+    df = encode_ra_features(pd.DataFrame({"value": rng.normal(size=rows).cumsum()}))
+    print(f"{rows:,} rows, sample of {sample_rows:,}")
+
+    engine = "hist_gradient_boosting"
+    reference = measure("every row", df, AnalysisOptions(engine=engine, train_rows=rows))
+    for method in ("reservoir", "stratified"):
+        options = AnalysisOptions(engine=engine, train_rows=sample_rows, train_sample=method)
+        measure(f"{method} sample", df, options, reference)
+
+
+if __name__ == "__main__":
+    main()
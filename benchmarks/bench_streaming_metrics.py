@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: L-drop metrics and RA score deltas, pandas reductions vs. streaming accumulators
+
+Usage:
+    python benchmarks/bench_streaming_metrics.py [rows] [workers]
+
+Defaults to 5,000,000 rows and 4 workers. Times the previous pandas
+implementation (a frame copy and one Series per statistic), the
+single-pass chunked accumulators, and ``workers`` accumulators over
+separate slices merged into one. It prints wall time, traced peak memory,
+and the largest difference of each result from the pandas one.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import LdropAccumulator, calculate_ldrop_metrics, calculate_ra_score_deltas, encode_ra_features
+
+
+def pandas_metrics(df: pd.DataFrame, predictions: np.ndarray) -> tuple[dict, dict]:
+    """The reductions as they were before the accumulators"""
+    df_with_pred = df.copy()
+    df_with_pred['predictions'] = predictions
+    ldrop = {
+        "mean_prediction": float(pd.Series(predictions).mean()),
+        "std_prediction": float(pd.Series(predictions).std()),
+        "min_prediction": float(pd.Series(predictions).min()),
+        "max_prediction": float(pd.Series(predictions).max()),
+        "samples_below_threshold": int((pd.Series(predictions) < 0.5).sum())
+    }
+    deltas = {
+        "ra_mean": float(df['RA'].mean()),
+        "ra_std": float(df['RA'].std()),
+        "ra_delta_mean": float(df['D'].mean()),
+        "ra_momentum": float(df['M'].mean()),
+        "ra_stability": float(df['S'].mean())
+    }
+    return ldrop, deltas
+
+
+def streaming_metrics(df: pd.DataFrame, predictions: np.ndarray) -> tuple[dict, dict]:
+    return calculate_ldrop_metrics(df, predictions), calculate_ra_score_deltas(df)
+
+
+def merged_metrics(workers: int):
+    def run(df: pd.DataFrame, predictions: np.ndarray) -> tuple[dict, dict]:
+        merged = LdropAccumulator()
+        for part in np.array_split(predictions, workers):
+            worker = LdropAccumulator()
+            worker.update(part)
+            merged.merge(worker)
+        return merged.metrics(), calculate_ra_score_deltas(df)
+    return run
+
+
+def measure(label: str, compute, df: pd.DataFrame, predictions: np.ndarray, reference=None):
+    tracemalloc.start()
+    started = time.perf_counter()
+    ldrop, deltas = compute(df, predictions)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    agreement = ""
+    if reference is not None:
+        results = {**ldrop, **deltas}
+        diff = max(abs(results[key] - value) for key, value in reference.items())
+        agreement = f"   max |diff| {diff:.1e}   p95 {ldrop['p95_prediction']:.4f}"
+    print(f"{label:<24} {elapsed:7.3f} s   peak {peak / 1024 ** 2:8.1f} MiB{agreement}")
+    return {**ldrop, **deltas}
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    rng = np.random.default_rng(42)
+    df = encode_ra_features(pd.DataFrame({"value": rng.normal(size=rows).cumsum()}))
+    predictions = df['RA'].to_numpy() * 0.8 + 0.1
+    print(f"{rows:,} rows, p95 {np.quantile(predictions, 0.95):.4f}")
+
+    reference = measure("pandas", pandas_metrics, df, predictions)
+    measure("streaming", streaming_metrics, df, predictions, reference)
+    measure(f"merged x{workers}", merged_metrics(workers), df, predictions, reference)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,6 +42,8 @@ gcloud builds submit --tag "$IMAGE_LOCATION"
 
 # This is the final deployment command.
 # It wires up your service account, secrets, and other settings.
+# The container runs the production server (python main.py serve), which
+# listens on the PORT Cloud Run sets and forks one worker per available core.
 echo "Deploying to Cloud Run..."
 gcloud run deploy "$SERVICE_NAME" \
   --image "$IMAGE_LOCATION" \
@@ -49,6 +51,8 @@ gcloud run deploy "$SERVICE_NAME" \
   --platform managed \
   --allow-unauthenticated \
   --port 8000 \
+  --command python \
+  --args main.py,serve \
   --service-account="$SA_EMAIL" \
   --update-secrets=CODEX_API_KEY="$API_KEY_SECRET_NAME":latest
 
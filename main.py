@@ -7,42 +7,285 @@ This microservice provides endpoints for:
 - Deploying models with DKIL validation
 """
 
+from __future__ import annotations
+
+import time
+
+# Import time of this module, reported in /api/longevity/stats
+_IMPORT_STARTED = time.perf_counter()
+
 import os
+import sys
+import gc
 import json
+import math
 import uuid
+import hashlib
+import pickle
+import threading
 import zipfile
+import shutil
 import re
+import asyncio
+import queue
+import sqlite3
+import base64
+import multiprocessing
+import bisect
+import functools
+import importlib
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Literal, TYPE_CHECKING
 from pathlib import Path
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Body
-from fastapi.responses import JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-import pandas as pd
-from sklearn.ensemble import RandomForestRegressor
-import uvicorn
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Body, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+import numpy as np
+import aiofiles
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class _LazyModule:
+    """
+    Stand-in for a heavy module that imports it on first attribute access.
+
+    The real module then replaces the stand-in under ``alias`` in this
+    module's globals, so later lookups cost nothing extra.
+    """
+
+    def __init__(self, name: str, alias: str):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+# pandas, scikit-learn and joblib are only imported once an analysis, report
+# or deployed model needs them (see warm_up), keeping cold starts short
+if not TYPE_CHECKING:
+    pd = _LazyModule("pandas", "pd")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks"""
+    ARTIFACTS_DIR.mkdir(parents=True, exist_ok=True)
+    if WARMUP:
+        threading.Thread(target=startup_warm_up.run, name="warm-up", daemon=True).start()
+    artifact_retention.start()
+    yield
+    artifact_retention.stop()
+    job_scheduler.shutdown()
+    analysis_pool.shutdown()
+    artifact_writer.close()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="RA Longevity MLOps API",
     description="Microservice for RA Longevity analysis and model deployment",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+def available_cores() -> int:
+    """CPUs this process may run on: its affinity mask, capped by a cgroup v2 CPU quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cores = min(cores, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def available_memory() -> int:
+    """Bytes of memory this process may use: physical memory, capped by a cgroup v2 or v1 limit"""
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            limit = Path(path).read_text().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            memory = min(memory, int(limit))
+    return memory
+
+
 # Configuration
-ARTIFACTS_DIR = Path("/home/runner/work/CODEXFOUNDRY4141/CODEXFOUNDRY4141/artifacts")
-ARTIFACTS_DIR.mkdir(exist_ok=True)
+# Created at startup (and by the first run written) rather than on import
+ARTIFACTS_DIR = Path(os.environ.get(
+    "ARTIFACTS_DIR", "/home/runner/work/CODEXFOUNDRY4141/CODEXFOUNDRY4141/artifacts"
+))
+
+# Warm the analysis stack in the background at startup (see warm_up)
+WARMUP = os.environ.get("WARMUP", "").lower() in ("1", "true", "yes")
 
 # Bearer token for authentication (in production, use environment variables)
 BEARER_TOKEN = os.environ.get("API_BEARER_TOKEN", "demo-token-replace-in-production")
 
+# Bearer tokens that may profile an analysis (?profile=true or X-Profile: 1); empty disables profiling
+PROFILE_TOKENS = {token for token in os.environ.get("PROFILE_TOKENS", "").split(",") if token}
+# Functions (by cumulative time) and allocation sites kept in a run's profile summary
+PROFILE_TOP_ENTRIES = int(os.environ.get("PROFILE_TOP_ENTRIES", 50))
+
+# CPU worker pool for the encode/fit/predict stages of an analysis
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", available_cores()))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("ANALYSIS_QUEUE_SIZE", ANALYSIS_WORKERS * 4))
+# "forkserver" keeps workers independent of the server's threads; set to "fork" or "spawn" to override
+ANALYSIS_MP_CONTEXT = os.environ.get("ANALYSIS_MP_CONTEXT", "forkserver")
+
+# Production server (python main.py serve): forked workers sharing one listening socket.
+# 0 starts one worker per available core; the cores are then split between their
+# analysis pools unless ANALYSIS_WORKERS is set
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 0))
+SERVER_HOST = os.environ.get("HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("PORT", 8000))
+# Seconds a draining worker gets to finish in-flight requests before it is killed
+SERVER_GRACEFUL_TIMEOUT = float(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30))
+
+# Job mode: background analyses admitted by the in-process scheduler
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", ANALYSIS_WORKERS))
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", 100))
+
+# Admission control: analyses (analyze, CSV and append, sync or job) are admitted while
+# they fit ADMISSION_CPU_SLOTS at once and ADMISSION_MEMORY_BYTES of estimated peak
+# memory; others wait up to ADMISSION_MAX_WAIT_SECONDS, then get 429 with Retry-After
+ADMISSION_CPU_SLOTS = int(os.environ.get("ADMISSION_CPU_SLOTS", ANALYSIS_WORKERS + ANALYSIS_QUEUE_SIZE))
+ADMISSION_MEMORY_BYTES = int(os.environ.get("ADMISSION_MEMORY_BYTES", available_memory() // 2))
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", 10))
+# Threads for the blocking parse, hashing and artifact I/O of analyses, kept apart from
+# the default thread pool so cheap endpoints (/, report, status, deploy) never queue behind
+# them. One per analysis worker keeps the workers fed; more only contend for the GIL
+ANALYSIS_IO_THREADS = int(os.environ.get("ANALYSIS_IO_THREADS", ANALYSIS_WORKERS))
+# Scheduling priority (nice) added to analysis workers, so under full CPU load the
+# server process still answers cheap endpoints promptly
+ANALYSIS_WORKER_NICE = int(os.environ.get("ANALYSIS_WORKER_NICE", 5))
+
+# CSV ingestion: uploads are parsed from the spooled file in row chunks
+CSV_CHUNK_ROWS = int(os.environ.get("CSV_CHUNK_ROWS", 100_000))
+CSV_SNIFF_ROWS = int(os.environ.get("CSV_SNIFF_ROWS", 1000))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 1024 ** 3))
+
+# Working-set budget for one column block of the 2-D RA kernel
+RA_KERNEL_BLOCK_BYTES = int(os.environ.get("RA_KERNEL_BLOCK_BYTES", 256 * 1024 ** 2))
+
+# Analysis cache: content-addressed run dedupe and fitted-model reuse.
+# Kept outside ARTIFACTS_DIR so cached models are never served under /artifacts
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", ARTIFACTS_DIR.parent / "cache"))
+CACHE_INDEX_BYTES = int(os.environ.get("CACHE_INDEX_BYTES", 8 * 1024 ** 2))
+MODEL_CACHE_BYTES = int(os.environ.get("MODEL_CACHE_BYTES", 256 * 1024 ** 2))
+MODEL_CACHE_DISK_BYTES = int(os.environ.get("MODEL_CACHE_DISK_BYTES", 4 * 1024 ** 3))
+# How long a synchronous duplicate request waits for the in-flight run it matched
+DEDUPE_WAIT_SECONDS = float(os.environ.get("DEDUPE_WAIT_SECONDS", 300))
+
+# Parameters of each model engine; part of every analysis cache key
+MODEL_PARAMS = {
+    "random_forest": {"n_estimators": 10, "random_state": 42},
+    "hist_gradient_boosting": {"max_iter": 100, "random_state": 42},
+    "linear": {},
+}
+# Engine used when a request names none: "auto" picks by training rows (see select_engine)
+MODEL_ENGINE = os.environ.get("MODEL_ENGINE", "auto")
+# "auto" fits a random forest up to this many training rows, histogram gradient boosting beyond
+MODEL_AUTO_FOREST_MAX_ROWS = int(os.environ.get("MODEL_AUTO_FOREST_MAX_ROWS", 50_000))
+# Training budgets when a request sets none: threads (0 = an equal share of
+# the available cores per analysis worker),
+# wall-clock seconds (0 = unbounded) and rows (0 = every row; larger inputs
+# are fitted on a MODEL_TRAIN_SAMPLE sample and still predicted in full)
+MODEL_THREADS = int(os.environ.get("MODEL_THREADS", 0))
+MODEL_TRAIN_SECONDS = float(os.environ.get("MODEL_TRAIN_SECONDS", 0))
+MODEL_TRAIN_ROWS = int(os.environ.get("MODEL_TRAIN_ROWS", 1_000_000))
+# How a row budget picks the training rows: "reservoir", "stratified" or "systematic"
+MODEL_TRAIN_SAMPLE = os.environ.get("MODEL_TRAIN_SAMPLE", "reservoir")
+# Rows per chunk when sampling row positions, building feature matrices, predicting
+# and accumulating metrics
+MODEL_CHUNK_ROWS = int(os.environ.get("MODEL_CHUNK_ROWS", 262_144))
+
+# Deployed models kept loaded for /predict, bounded by their on-disk size
+MODEL_POOL_BYTES = int(os.environ.get("MODEL_POOL_BYTES", 1024 ** 3))
+
+# Prediction micro-batching: concurrent /predict calls for one model share a
+# predict call, flushed after PREDICT_BATCH_WAIT_MS or PREDICT_BATCH_MAX_ROWS rows
+PREDICT_BATCH_MAX_ROWS = int(os.environ.get("PREDICT_BATCH_MAX_ROWS", 1024))
+PREDICT_BATCH_WAIT_MS = float(os.environ.get("PREDICT_BATCH_WAIT_MS", 2.0))
+
+# bundle.zip is built on download: "deflate" (BUNDLE_COMPRESSLEVEL 0-9) or "stored".
+# Finished bundles are cached under CACHE_DIR when BUNDLE_CACHE_BYTES > 0
+BUNDLE_COMPRESSION = os.environ.get("BUNDLE_COMPRESSION", "deflate")
+BUNDLE_COMPRESSLEVEL = int(os.environ.get("BUNDLE_COMPRESSLEVEL", 6))
+BUNDLE_CACHE_BYTES = int(os.environ.get("BUNDLE_CACHE_BYTES", 0))
+BUNDLE_CHUNK_BYTES = 1024 ** 2
+
+# SQLite index of runs behind GET /api/longevity/runs
+RUN_CATALOGUE_PATH = Path(os.environ.get("RUN_CATALOGUE_PATH", ARTIFACTS_DIR / "catalogue.db"))
+RUNS_PAGE_MAX = int(os.environ.get("RUNS_PAGE_MAX", 1000))
+
+# Artifact retention: undeployed runs are removed, least recently read first, once
+# ARTIFACTS_DIR exceeds RETENTION_MAX_BYTES or a run is older than RETENTION_MAX_AGE_SECONDS
+# (0 disables either bound). The collector runs every RETENTION_INTERVAL_SECONDS
+RETENTION_MAX_BYTES = int(os.environ.get("RETENTION_MAX_BYTES", 0))
+RETENTION_MAX_AGE_SECONDS = float(os.environ.get("RETENTION_MAX_AGE_SECONDS", 0))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get("RETENTION_INTERVAL_SECONDS", 300))
+
+# fsync artifacts that must be durable before a response (results, DKIL lock, deployment)
+ARTIFACT_FSYNC = os.environ.get("ARTIFACT_FSYNC", "1").lower() not in ("0", "false", "no")
+
+# Parsed results.json and dkil_lock.json files kept in memory for report polling
+REPORT_CACHE_BYTES = int(os.environ.get("REPORT_CACHE_BYTES", 64 * 1024 ** 2))
+
+# Pipeline stages reported in each run's status.json
+ANALYSIS_STAGES = ("encode", "train", "predict", "metrics", "artifacts")
+
+# Upper bounds (seconds) of the latency histogram buckets served at /metrics
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
 # Models
-class AnalyzeRequest(BaseModel):
+class AnalysisOptions(BaseModel):
+    """Options controlling how an analysis encodes and models the data"""
+    mode: Literal["tabular", "time_series"] = "tabular"
+    # time_series mode: one series per entity, ordered by timestamp
+    entity_column: Optional[str] = None
+    timestamp_column: Optional[str] = None
+    # Column the RA features are derived from (default: first numeric column)
+    value_column: Optional[str] = None
+    # Wide RA_<col>/D_<col>/M_<col>/S_<col>/LR_<col> features; ["*"] selects every numeric column
+    encode_columns: Optional[list[str]] = None
+    feature_dtype: Literal["float64", "float32"] = "float64"
+    # Model engine (default MODEL_ENGINE) and training budgets (defaults MODEL_THREADS,
+    # MODEL_TRAIN_SECONDS, MODEL_TRAIN_ROWS); see select_engine and fit_model
+    engine: Optional[Literal["random_forest", "hist_gradient_boosting", "linear"]] = None
+    train_threads: Optional[int] = Field(None, ge=1)
+    train_seconds: Optional[float] = Field(None, gt=0)
+    train_rows: Optional[int] = Field(None, ge=1)
+    train_sample: Optional[Literal["reservoir", "stratified", "systematic"]] = None
+
+class AnalyzeRequest(AnalysisOptions):
     """Request model for tabular data analysis"""
     data: list[dict]
-    mode: str = "tabular"  # "tabular" or "time_series"
+
+    def options(self) -> AnalysisOptions:
+        """The analysis options without the (large) data payload"""
+        return AnalysisOptions(**{name: getattr(self, name) for name in AnalysisOptions.model_fields})
+
+class AppendRequest(BaseModel):
+    """Request model for appending time-series rows to an existing run"""
+    data: list[dict]
 
 class DeployRequest(BaseModel):
     """Request model for model deployment"""
@@ -53,6 +296,15 @@ class DeployRequest(BaseModel):
     logic_key: str
     model_name: Optional[str] = None
 
+class PredictRequest(BaseModel):
+    """Request model for predictions from a deployed run's model"""
+    data: list[dict]
+
+class PredictResponse(BaseModel):
+    """Response model for predictions"""
+    run_id: str
+    predictions: list[float]
+
 class AnalyzeResponse(BaseModel):
     """Response model for analysis"""
     run_id: str
@@ -60,6 +312,9 @@ class AnalyzeResponse(BaseModel):
     ldrop_metrics: dict
     ra_score_deltas: dict
     timestamp: str
+    metadata: dict = {}
+    ldrop_metrics_by_entity: Optional[dict] = None
+    ra_score_deltas_by_entity: Optional[dict] = None
 
 # Authentication dependency
 async def verify_token(authorization: Optional[str] = Header(None)):
@@ -79,14 +334,208 @@ async def verify_token(authorization: Optional[str] = Header(None)):
     return token
 
 
+async def profile_requested(
+    profile: bool = False,
+    x_profile: Optional[str] = Header(None),
+    token: str = Depends(verify_token)
+) -> bool:
+    """Whether the request asks to be profiled; only PROFILE_TOKENS may ask"""
+    requested = profile or (x_profile is not None and x_profile.lower() in ("1", "true", "yes"))
+    if requested and token not in PROFILE_TOKENS:
+        raise HTTPException(status_code=403, detail="This token may not request profiling")
+    return requested
+
+
 # RA Feature Encoder
-def encode_ra_features(df: pd.DataFrame) -> pd.DataFrame:
+RA_FEATURES = ('RA', 'D', 'M', 'S', 'LR')
+RA_WINDOW = 3
+RA_EWM_SPAN = 3
+RA_EPSILON = 1e-10
+
+
+def _trailing_windows(tail: np.ndarray, values: np.ndarray, window: int) -> np.ndarray:
+    """(n, window) view of each value's trailing window, NaN-padded before the series start"""
+    pad = np.full(window - 1 - len(tail), np.nan)
+    extended = np.concatenate([pad, tail, values])
+    return np.lib.stride_tricks.sliding_window_view(extended, window)
+
+
+def _window_mean_std(windows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """NaN-aware mean and sample std per window, matching rolling(min_periods=1)"""
+    observed = ~np.isnan(windows)
+    count = observed.sum(axis=1)
+    filled = np.where(observed, windows, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=1) / count
+        deviations = np.where(observed, windows - mean[:, None], 0.0)
+        std = np.sqrt((deviations ** 2).sum(axis=1) / (count - 1))
+    return mean, np.where(count > 1, std, np.nan)
+
+
+class RAEncoder:
+    """
+    Stateful RA encoder that can be fed one series chunk by chunk.
+
+    Carries the running min/max, the previous value, the last ``window - 1``
+    values and deltas, and the EWM numerator/denominator, so chunk N+1 is
+    encoded exactly as if the whole series had been encoded in one go.
+
+    Features are accumulated in the raw units of the source column. RA, D,
+    M, S and LR are all affine in the min-max scale, so ``normalize`` maps
+    them onto the running scale once it is known, and ``rescale`` moves
+    features encoded under an earlier scale onto the current one without
+    re-encoding them.
+    """
+
+    def __init__(self, source_column: Optional[str] = None, window: int = RA_WINDOW, span: int = RA_EWM_SPAN):
+        self.source_column = source_column
+        self.window = window
+        self.span = span
+        self.reset()
+
+    def reset(self):
+        """Forget all carried state (the source column is kept)"""
+        self.rows = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.last_value = np.nan
+        self.tail_values = np.empty(0)
+        self.tail_deltas = np.empty(0)
+        self.ewm_num = 0.0
+        self.ewm_den = 0.0
+
+    @property
+    def decay(self) -> float:
+        """EWM weight decay per step, 1 - alpha with alpha = 2 / (span + 1)"""
+        return 1.0 - 2.0 / (self.span + 1.0)
+
+    def partial_encode(self, values) -> np.ndarray:
+        """
+        Encode the next chunk of the series and advance the carried state.
+
+        Returns:
+            (n, 5) array of raw-unit features in RA_FEATURES order
+        """
+        from scipy.signal import lfilter
+
+        x = np.asarray(values, dtype=np.float64)
+        n = len(x)
+        if n == 0:
+            return np.empty((0, len(RA_FEATURES)))
+        
+        # D: difference to the previous value, 0 for the first row (diff().fillna(0))
+        previous = np.empty(n)
+        previous[0] = self.last_value if self.rows else np.nan
+        previous[1:] = x[:-1]
+        deltas = x - previous
+        deltas[np.isnan(deltas)] = 0.0
+        
+        # M and S: rolling mean of D and rolling std of the values
+        momentum, _ = _window_mean_std(_trailing_windows(self.tail_deltas, deltas, self.window))
+        _, stability = _window_mean_std(_trailing_windows(self.tail_values, x, self.window))
+        stability[np.isnan(stability)] = 0.0
+        
+        # LR: adjusted EWM as a first-order recurrence over numerator and weights
+        observed = ~np.isnan(x)
+        decay = self.decay
+        num = lfilter([1.0], [1.0, -decay], np.where(observed, x, 0.0), zi=[decay * self.ewm_num])[0]
+        den = lfilter([1.0], [1.0, -decay], observed.astype(np.float64), zi=[decay * self.ewm_den])[0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ewm = num / den
+        
+        if observed.any():
+            chunk_min, chunk_max = float(x[observed].min()), float(x[observed].max())
+            self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+            self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        keep = self.window - 1
+        self.tail_values = np.concatenate([self.tail_values, x])[-keep:] if keep else np.empty(0)
+        self.tail_deltas = np.concatenate([self.tail_deltas, deltas])[-keep:] if keep else np.empty(0)
+        self.last_value = float(x[-1])
+        self.ewm_num = float(num[-1])
+        self.ewm_den = float(den[-1])
+        self.rows += n
+        
+        return np.column_stack([x, deltas, momentum, stability, ewm])
+
+    def _scale(self) -> tuple[float, float]:
+        if self.min is None:
+            return np.nan, np.nan
+        return self.min, self.max - self.min + RA_EPSILON
+
+    def normalize(self, raw: np.ndarray) -> np.ndarray:
+        """Map raw-unit features onto the current min-max scale"""
+        low, span = self._scale()
+        features = raw / span
+        features[:, 0] = (raw[:, 0] - low) / span
+        features[:, 4] = (raw[:, 4] - low) / span
+        return features
+
+    def rescale(self, features: np.ndarray, old_min: float, old_max: float) -> np.ndarray:
+        """Move features normalised with an earlier min/max onto the current scale"""
+        old_span = old_max - old_min + RA_EPSILON
+        low, span = self._scale()
+        factor = old_span / span
+        rescaled = features * factor
+        shift = (old_min - low) / span
+        rescaled[:, 0] += shift
+        rescaled[:, 4] += shift
+        return rescaled
+
+    def encode(self, values) -> np.ndarray:
+        """Encode a chunk and return it normalised with the updated scale"""
+        return self.normalize(self.partial_encode(values))
+
+    def state_dict(self) -> dict:
+        """JSON-serialisable encoder state"""
+        return {
+            "source_column": self.source_column,
+            "window": self.window,
+            "span": self.span,
+            "rows": self.rows,
+            "min": self.min,
+            "max": self.max,
+            "last_value": self.last_value,
+            "tail_values": self.tail_values.tolist(),
+            "tail_deltas": self.tail_deltas.tolist(),
+            "ewm_num": self.ewm_num,
+            "ewm_den": self.ewm_den,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "RAEncoder":
+        encoder = cls(state["source_column"], state["window"], state["span"])
+        encoder.rows = state["rows"]
+        encoder.min = state["min"]
+        encoder.max = state["max"]
+        encoder.last_value = state["last_value"]
+        encoder.tail_values = np.asarray(state["tail_values"], dtype=np.float64)
+        encoder.tail_deltas = np.asarray(state["tail_deltas"], dtype=np.float64)
+        encoder.ewm_num = state["ewm_num"]
+        encoder.ewm_den = state["ewm_den"]
+        return encoder
+
+
+def encode_ra_features(df: pd.DataFrame, encoder: Optional[RAEncoder] = None) -> pd.DataFrame:
     """
     Encode RA features: RA (Relative Activity), D (Delta), M (Momentum), 
     S (Stability), LR (Learning Rate)
+
+    When none of the features are supplied, they are derived from the first
+    numeric column with an RAEncoder; pass ``encoder`` to keep its state.
     """
     encoded_df = df.copy()
     
+    if not any(name in encoded_df.columns for name in RA_FEATURES):
+        numeric_cols = encoded_df.select_dtypes(include=['number']).columns
+        if len(numeric_cols) > 0:
+            encoder = encoder if encoder is not None else RAEncoder()
+            if encoder.source_column is None:
+                encoder.source_column = numeric_cols[0]
+            features = encoder.encode(encoded_df[encoder.source_column].to_numpy(dtype=np.float64))
+            for i, name in enumerate(RA_FEATURES):
+                encoded_df[name] = features[:, i]
+        return encoded_df
+    
     # Calculate RA features if not present
     if 'RA' not in encoded_df.columns:
         # RA: Relative Activity (normalized first column if numeric)
@@ -116,289 +565,4908 @@ def encode_ra_features(df: pd.DataFrame) -> pd.DataFrame:
         if 'RA' in encoded_df.columns:
             encoded_df['LR'] = encoded_df['RA'].ewm(span=3).mean()
     
-    return encoded_df
-
-
-def calculate_ldrop_metrics(df: pd.DataFrame, predictions: list[float]) -> dict:
-    """Calculate L-drop (Longevity drop) metrics"""
-    df_with_pred = df.copy()
-    df_with_pred['predictions'] = predictions
+    return encoded_df
+
+
+def _lagged_mean_std(values: np.ndarray, position: np.ndarray, window: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    NaN-aware trailing-window mean and sample std over axis 0 of (n, k) values.
+
+    ``position`` is each row's offset within its group, so windows never
+    reach back into the previous group (rolling(min_periods=1) per group).
+    """
+    n = values.shape[0]
+    total = np.zeros_like(values)
+    count = np.zeros_like(values)
+    masks = []
+    for lag in range(min(window, n)):
+        source = values[:n - lag]
+        valid = ~np.isnan(source) & (position[lag:] >= lag)[:, None]
+        masks.append(valid)
+        total[lag:] += np.where(valid, source, 0.0)
+        count[lag:] += valid
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        squares = np.zeros_like(values)
+        for lag, valid in enumerate(masks):
+            deviation = values[:n - lag] - mean[lag:]
+            squares[lag:] += np.where(valid, deviation * deviation, 0.0)
+        std = np.sqrt(squares / (count - 1))
+    std[count < 2] = np.nan
+    return mean, std
+
+
+def _ra_kernel(
+    values: np.ndarray,
+    group_starts: Optional[np.ndarray] = None,
+    window: int = RA_WINDOW,
+    span: int = RA_EWM_SPAN,
+    dtype=np.float64
+) -> dict:
+    """
+    Vectorised RA/D/M/S/LR over the rows of an (n, k) array.
+
+    Rows may be split into contiguous groups (one series per entity) by
+    ``group_starts``, the sorted start row of each group. All groups and
+    columns are computed together; nothing loops per entity. Definitions
+    match encode_ra_features: per-group min-max RA, diff().fillna(0),
+    rolling(window, min_periods=1) mean/std and ewm(span).mean().
+
+    Returns:
+        Dict of RA_FEATURES name -> array shaped like ``values``
+    """
+    from scipy.signal import lfilter
+
+    x = np.asarray(values, dtype=dtype)
+    squeeze = x.ndim == 1
+    if squeeze:
+        x = x[:, None]
+    n = x.shape[0]
+    if n == 0:
+        return {name: np.empty(np.shape(values), dtype=dtype) for name in RA_FEATURES}
+    
+    starts = np.zeros(1, dtype=np.intp) if group_starts is None else np.asarray(group_starts, dtype=np.intp)
+    sizes = np.diff(np.append(starts, n))
+    position = np.arange(n) - np.repeat(starts, sizes)
+    first_rows = position == 0
+    
+    # RA: min-max normalisation within each group
+    low = np.repeat(np.fmin.reduceat(x, starts, axis=0), sizes, axis=0)
+    high = np.repeat(np.fmax.reduceat(x, starts, axis=0), sizes, axis=0)
+    ra = (x - low) / (high - low + RA_EPSILON)
+    del low, high
+    
+    # D: difference to the previous row of the same group
+    d = np.empty_like(ra)
+    d[0] = 0
+    np.subtract(ra[1:], ra[:-1], out=d[1:])
+    d[first_rows] = 0.0
+    d[np.isnan(d)] = 0.0
+    
+    # M and S: trailing windows that stop at the group start
+    m, _ = _lagged_mean_std(d, position, window)
+    _, s = _lagged_mean_std(ra, position, window)
+    s[np.isnan(s)] = 0.0
+    
+    # LR: adjusted EWM as a recurrence over the whole array; each group then
+    # drops the decayed numerator/weights it inherited from the rows before it
+    decay = 1.0 - 2.0 / (span + 1.0)
+    observed = ~np.isnan(ra)
+    num = lfilter([1.0], [1.0, -decay], np.where(observed, ra, 0.0).astype(dtype, copy=False), axis=0)
+    den = lfilter([1.0], [1.0, -decay], observed.astype(dtype), axis=0)
+    observed_count = np.cumsum(observed, axis=0)
+    if len(starts) > 1:
+        carry_rows = starts[1:] - 1
+        inherited_weight = np.power(decay, position + 1.0).astype(dtype)[:, None]
+        num -= inherited_weight * np.repeat(np.vstack([np.zeros_like(num[:1]), num[carry_rows]]), sizes, axis=0)
+        den -= inherited_weight * np.repeat(np.vstack([np.zeros_like(den[:1]), den[carry_rows]]), sizes, axis=0)
+        observed_count -= np.repeat(
+            np.vstack([np.zeros_like(observed_count[:1]), observed_count[carry_rows]]), sizes, axis=0
+        )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lr = num / den
+    lr[observed_count == 0] = np.nan
+    
+    features = {'RA': ra, 'D': d, 'M': m, 'S': s, 'LR': lr}
+    if squeeze:
+        features = {name: column[:, 0] for name, column in features.items()}
+    return features
+
+
+def encode_ra_matrix(
+    df: pd.DataFrame,
+    columns: Optional[list] = None,
+    dtype=np.float64,
+    group_starts: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    """
+    Encode RA/D/M/S/LR for many numeric columns in one 2-D pass.
+
+    Selected columns are gathered into column-major float blocks and run
+    through _ra_kernel together; results are written into one
+    preallocated column-major (rows, 5 * columns) array, which is pandas'
+    native block layout, so it backs the returned frame without a copy. Blocks are sized by RA_KERNEL_BLOCK_BYTES to
+    bound the kernel's temporaries. Pass ``dtype=np.float32`` to halve
+    memory at reduced precision.
+
+    Returns:
+        Frame aligned with ``df`` holding columns named RA_<col>, D_<col>,
+        M_<col>, S_<col> and LR_<col> (grouped by feature, then column)
+    """
+    if columns is None:
+        columns = list(df.select_dtypes(include=['number']).columns)
+    n, k = len(df), len(columns)
+    dtype = np.dtype(dtype)
+    names = [f"{name}_{col}" for name in RA_FEATURES for col in columns]
+    out = np.empty((n, len(RA_FEATURES) * k), dtype=dtype, order='F')
+    
+    # The kernel holds roughly 16 temporaries of the block's size
+    block = max(1, RA_KERNEL_BLOCK_BYTES // max(1, n * dtype.itemsize * 16))
+    for first in range(0, k, block):
+        block_columns = columns[first:first + block]
+        values = np.empty((n, len(block_columns)), dtype=dtype, order='F')
+        for j, col in enumerate(block_columns):
+            values[:, j] = df[col].to_numpy(dtype=dtype)
+        features = _ra_kernel(values, group_starts, dtype=dtype)
+        for f, name in enumerate(RA_FEATURES):
+            out[:, f * k + first:f * k + first + len(block_columns)] = features[name]
+        del values, features
+    
+    return pd.DataFrame(out, index=df.index, columns=names, copy=False)
+
+
+def _panel_layout(df: pd.DataFrame, entity_column: Optional[str], timestamp_column: Optional[str]):
+    """
+    Stable sort order grouping rows by entity, then timestamp.
+
+    Returns:
+        (order, group_starts, entity_labels) where ``order`` sorts the frame,
+        ``group_starts`` is the first sorted row of each entity and
+        ``entity_labels`` names the entities in group order
+    """
+    keys = []
+    if timestamp_column is not None:
+        timestamps = df[timestamp_column]
+        if not pd.api.types.is_numeric_dtype(timestamps):
+            timestamps = pd.to_datetime(timestamps)
+        keys.append(timestamps.to_numpy().view(np.int64) if timestamps.dtype.kind == 'M' else timestamps.to_numpy())
+    if entity_column is not None:
+        codes, uniques = pd.factorize(df[entity_column], use_na_sentinel=False)
+        keys.append(codes)
+    else:
+        codes, uniques = np.zeros(len(df), dtype=np.intp), np.array([None])
+    
+    # lexsort sorts by the last key first and is stable
+    order = np.lexsort(keys) if keys else np.arange(len(df))
+    sorted_codes = codes[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(df) else np.zeros(0, dtype=np.intp)
+    entity_labels = [str(label) for label in np.asarray(uniques, dtype=object)[sorted_codes[group_starts]]]
+    if len(set(entity_labels)) < len(entity_labels):
+        # Per-entity results are keyed by label, so e.g. 1 and "1" would overwrite each other
+        counts = Counter(entity_labels)
+        collisions = sorted(label for label, count in counts.items() if count > 1)
+        raise AnalysisInputError(
+            f"Distinct values of '{entity_column}' share the labels {collisions}; use one type per entity column"
+        )
+    return order, group_starts, entity_labels
+
+
+def encode_ra_panel(
+    df: pd.DataFrame,
+    entity_column: Optional[str] = None,
+    timestamp_column: Optional[str] = None,
+    value_column: Optional[str] = None
+) -> tuple[pd.DataFrame, np.ndarray, np.ndarray, list[str]]:
+    """
+    Encode RA features for panel data: one series per entity, ordered by timestamp.
+
+    The frame is sorted once and all entities are encoded in a single
+    vectorised pass.
+
+    Returns:
+        (encoded frame in sorted order, sort order, group starts, entity labels)
+    """
+    if value_column is None:
+        exclude = {entity_column, timestamp_column}
+        numeric_cols = [col for col in df.select_dtypes(include=['number']).columns if col not in exclude]
+        if not numeric_cols:
+            raise AnalysisInputError("No numeric value column found for time_series encoding")
+        value_column = numeric_cols[0]
+    
+    order, group_starts, entity_labels = _panel_layout(df, entity_column, timestamp_column)
+    encoded_df = df.take(order).reset_index(drop=True)
+    features = _ra_kernel(encoded_df[value_column].to_numpy(dtype=np.float64), group_starts)
+    for name in RA_FEATURES:
+        encoded_df[name] = features[name]
+    return encoded_df, order, group_starts, entity_labels
+
+
+# Streaming Metrics
+# Predictions below this count towards the L-drop criterion of the DKIL lock
+LDROP_THRESHOLD = 0.5
+# Prediction quantiles reported in ldrop_metrics, answered by a QuantileSketch
+LDROP_QUANTILES = (0.5, 0.95, 0.99)
+# Relative error bound of QuantileSketch values
+SKETCH_RELATIVE_ACCURACY = 0.01
+# Magnitudes below this fall in the sketch's zero bucket
+SKETCH_MIN_VALUE = 1e-9
+
+
+class StreamingMoments:
+    """
+    Mergeable single-pass count, mean, variance, min and max of a value stream.
+
+    Each chunk is reduced on its own and folded into the running totals
+    with the pairwise Welford update (Chan et al.), so any split of the
+    values into chunks, updated in order or merged from separate
+    accumulators, gives the single-shot result up to rounding. NaN is
+    skipped, as in pandas.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+    def update(self, values):
+        """Fold in a chunk of values"""
+        x = np.asarray(values, dtype=np.float64)
+        if np.isnan(x).any():
+            x = x[~np.isnan(x)]
+        if not len(x):
+            return
+        mean = float(x.mean())
+        deviation = x - mean
+        self._fold(len(x), mean, float(np.dot(deviation, deviation)), float(x.min()), float(x.max()))
+
+    def merge(self, other: "StreamingMoments"):
+        """Fold in the totals of another accumulator"""
+        if other.count:
+            self._fold(other.count, other.mean, other.m2, other.min, other.max)
+
+    def _fold(self, count: int, mean: float, m2: float, low: float, high: float):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.min = low if self.count == 0 else min(self.min, low)
+        self.max = high if self.count == 0 else max(self.max, high)
+        self.count = total
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation (ddof=1), NaN below two values"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    def state_dict(self) -> dict:
+        """JSON-serialisable accumulator state"""
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "min": None if self.count == 0 else self.min, "max": None if self.count == 0 else self.max}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "StreamingMoments":
+        moments = cls()
+        moments.count = state["count"]
+        moments.mean = state["mean"]
+        moments.m2 = state["m2"]
+        moments.min = np.nan if state["min"] is None else state["min"]
+        moments.max = np.nan if state["max"] is None else state["max"]
+        return moments
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative error bound (DDSketch).
+
+    Values are counted in logarithmic buckets of width ``gamma`` =
+    (1 + a) / (1 - a), so every quantile is answered within a relative
+    error ``a`` of a value in the data. Bucket counts are exact integers:
+    chunked, merged and single-shot sketches of the same values are
+    identical.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.positive: dict[int, int] = {}
+        self.negative: dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+        self.min = np.nan
+        self.max = np.nan
+
+    def _add(self, store: dict, magnitudes: np.ndarray):
+        if not len(magnitudes):
+            return
+        keys = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+        low = int(keys.min())
+        counts = np.bincount(keys - low)
+        for offset in np.flatnonzero(counts).tolist():
+            store[low + offset] = store.get(low + offset, 0) + int(counts[offset])
+
+    def update(self, values):
+        """Count a chunk of values; NaN and infinities are skipped"""
+        x = np.asarray(values, dtype=np.float64).ravel()
+        x = x[np.isfinite(x)]
+        if not len(x):
+            return
+        self._add(self.positive, x[x >= SKETCH_MIN_VALUE])
+        self._add(self.negative, -x[x <= -SKETCH_MIN_VALUE])
+        self.zero += int((np.abs(x) < SKETCH_MIN_VALUE).sum())
+        self.count += len(x)
+        self.min = float(np.fmin(self.min, x.min()))
+        self.max = float(np.fmax(self.max, x.max()))
+
+    def merge(self, other: "QuantileSketch"):
+        """Add the counts of a sketch with the same relative accuracy"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for store, counts in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in counts.items():
+                store[key] = store.get(key, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.min = float(np.fmin(self.min, other.min))
+        self.max = float(np.fmax(self.max, other.max))
+
+    def quantile(self, q: float) -> float:
+        """Approximate ``q`` quantile, NaN for an empty sketch"""
+        if not self.count:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        buckets = [(-1.0, key, self.negative[key]) for key in sorted(self.negative, reverse=True)]
+        buckets.append((0.0, 0, self.zero))
+        buckets.extend((1.0, key, self.positive[key]) for key in sorted(self.positive))
+        for sign, key, count in buckets:
+            seen += count
+            if seen > rank:
+                # Bucket midpoint in relative terms, kept inside the observed range
+                value = sign * 2 * math.exp(key * self.log_gamma) / (1 + math.exp(self.log_gamma))
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def state_dict(self) -> dict:
+        """JSON-serialisable sketch state"""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "positive": {str(key): count for key, count in self.positive.items()},
+            "negative": {str(key): count for key, count in self.negative.items()},
+            "zero": self.zero,
+            "count": self.count,
+            "min": None if np.isnan(self.min) else self.min,
+            "max": None if np.isnan(self.max) else self.max,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "QuantileSketch":
+        sketch = cls(state["relative_accuracy"])
+        sketch.positive = {int(key): count for key, count in state["positive"].items()}
+        sketch.negative = {int(key): count for key, count in state["negative"].items()}
+        sketch.zero = state["zero"]
+        sketch.count = state["count"]
+        sketch.min = np.nan if state["min"] is None else state["min"]
+        sketch.max = np.nan if state["max"] is None else state["max"]
+        return sketch
+
+
+class LdropAccumulator:
+    """
+    L-drop metrics of a prediction stream, fed chunk by chunk as predictions are made.
+
+    Accumulators over different chunks of the same analysis (from
+    different workers, say) merge into the single-shot metrics.
+    """
+
+    def __init__(self, threshold: float = LDROP_THRESHOLD):
+        self.threshold = threshold
+        self.moments = StreamingMoments()
+        self.sketch = QuantileSketch()
+        self.below = 0
+
+    def update(self, predictions):
+        predictions = np.asarray(predictions, dtype=np.float64)
+        self.moments.update(predictions)
+        self.sketch.update(predictions)
+        self.below += int((predictions < self.threshold).sum())
+
+    def merge(self, other: "LdropAccumulator"):
+        if other.threshold != self.threshold:
+            raise ValueError("Cannot merge L-drop metrics with different thresholds")
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        self.below += other.below
+
+    def metrics(self) -> dict:
+        metrics = {
+            "mean_prediction": self.moments.mean if self.moments.count else np.nan,
+            "std_prediction": self.moments.std,
+            "min_prediction": self.moments.min,
+            "max_prediction": self.moments.max,
+        }
+        for q in LDROP_QUANTILES:
+            metrics[f"p{round(q * 100)}_prediction"] = float(self.sketch.quantile(q))
+        metrics["ldrop_threshold"] = self.threshold
+        metrics["samples_below_threshold"] = self.below
+        return metrics
+
+
+# RA score delta keys and the feature column each one averages
+RA_DELTA_MEANS = (("ra_delta_mean", 'D'), ("ra_momentum", 'M'), ("ra_stability", 'S'))
+
+
+def calculate_ldrop_metrics(df: pd.DataFrame, predictions, chunk_rows: Optional[int] = None) -> dict:
+    """
+    Calculate L-drop (Longevity drop) metrics
+
+    The predictions are read ``chunk_rows`` (default MODEL_CHUNK_ROWS) at a
+    time through an LdropAccumulator; ``df`` is not read.
+    """
+    chunk_rows = chunk_rows or MODEL_CHUNK_ROWS
+    predictions = np.asarray(predictions, dtype=np.float64)
+    ldrop = LdropAccumulator()
+    for start in range(0, len(predictions), chunk_rows):
+        ldrop.update(predictions[start:start + chunk_rows])
+    return ldrop.metrics()
+
+
+def calculate_ra_score_deltas(df_encoded: pd.DataFrame, chunk_rows: Optional[int] = None) -> dict:
+    """
+    Calculate RA score deltas
+
+    RA and whichever of D, M and S are present are reduced together, one
+    pass over ``chunk_rows`` (default MODEL_CHUNK_ROWS) rows at a time.
+    """
+    if 'RA' not in df_encoded.columns:
+        return {}
+    chunk_rows = chunk_rows or MODEL_CHUNK_ROWS
+    columns = ['RA'] + [name for _, name in RA_DELTA_MEANS if name in df_encoded.columns]
+    arrays = {name: df_encoded[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in columns}
+    moments = {name: StreamingMoments() for name in columns}
+    for start in range(0, len(df_encoded), chunk_rows):
+        for name in columns:
+            moments[name].update(arrays[name][start:start + chunk_rows])
+    means = {name: m.mean if m.count else np.nan for name, m in moments.items()}
+    
+    deltas = {"ra_mean": means['RA'], "ra_std": moments['RA'].std}
+    for key, name in RA_DELTA_MEANS:
+        deltas[key] = means.get(name, 0.0)
+    return deltas
+
+
+def _grouped_mean_std(values: np.ndarray, group_starts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """NaN-aware mean and sample std per contiguous group"""
+    observed = ~np.isnan(values)
+    count = np.add.reduceat(observed, group_starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.add.reduceat(np.where(observed, values, 0.0), group_starts) / count
+        deviation = np.where(observed, values - np.repeat(mean, np.diff(np.append(group_starts, len(values)))), 0.0)
+        std = np.sqrt(np.add.reduceat(deviation * deviation, group_starts) / (count - 1))
+    std[count < 2] = np.nan
+    return mean, std
+
+
+def _json_floats(values: np.ndarray) -> list:
+    """Floats for JSON output, with undefined values (NaN) as None"""
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+
+def calculate_entity_metrics(
+    df_encoded: pd.DataFrame,
+    predictions: np.ndarray,
+    group_starts: np.ndarray,
+    entity_labels: list[str]
+) -> tuple[dict, dict]:
+    """
+    Per-entity L-drop metrics and RA score deltas for entity-sorted rows.
+
+    Every statistic is a grouped reduction over all entities at once.
+
+    Returns:
+        (ldrop_metrics_by_entity, ra_score_deltas_by_entity)
+    """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    threshold = LDROP_THRESHOLD
+    mean, std = _grouped_mean_std(predictions, group_starts)
+    ldrop_columns = {
+        "mean_prediction": _json_floats(mean),
+        "std_prediction": _json_floats(std),
+        "min_prediction": _json_floats(np.minimum.reduceat(predictions, group_starts)),
+        "max_prediction": _json_floats(np.maximum.reduceat(predictions, group_starts)),
+        "samples": np.diff(np.append(group_starts, len(predictions))).tolist(),
+        "samples_below_threshold": np.add.reduceat(predictions < threshold, group_starts).tolist(),
+    }
+    
+    delta_columns = {}
+    if 'RA' in df_encoded.columns:
+        ra_mean, ra_std = _grouped_mean_std(df_encoded['RA'].to_numpy(dtype=np.float64), group_starts)
+        delta_columns["ra_mean"] = _json_floats(ra_mean)
+        delta_columns["ra_std"] = _json_floats(ra_std)
+        for key, name in RA_DELTA_MEANS:
+            if name in df_encoded.columns:
+                delta_columns[key] = _json_floats(
+                    _grouped_mean_std(df_encoded[name].to_numpy(dtype=np.float64), group_starts)[0]
+                )
+    
+    ldrop_by_entity = {}
+    deltas_by_entity = {}
+    for i, label in enumerate(entity_labels):
+        ldrop_by_entity[label] = {key: column[i] for key, column in ldrop_columns.items()}
+        ldrop_by_entity[label]["ldrop_threshold"] = threshold
+        deltas_by_entity[label] = {key: column[i] for key, column in delta_columns.items()}
+    return ldrop_by_entity, deltas_by_entity
+
+# CSV Ingestion
+def _sniff_csv_dtypes(fileobj, nrows: int = CSV_SNIFF_ROWS) -> dict:
+    """
+    Infer explicit column dtypes from the first rows of a CSV stream.
+
+    Numeric columns are read as float64 so missing values later in the file
+    cannot break the parse; everything else stays as object.
+    """
+    sample = pd.read_csv(fileobj, nrows=nrows)
+    fileobj.seek(0)
+    return {
+        col: 'float64' if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+        else 'object'
+        for col, dtype in sample.dtypes.items()
+    }
+
+
+def _collect_csv_chunks(
+    fileobj,
+    dtypes: Optional[dict],
+    chunk_rows: int,
+    encoder: Optional[RAEncoder] = None
+) -> tuple[pd.DataFrame, dict]:
+    chunks = []
+    raw_features = []
+    held_bytes = 0
+    peak_bytes = 0
+    rows = 0
+    
+    with pd.read_csv(fileobj, dtype=dtypes, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            if encoder is not None and not chunks:
+                encoder = _chunk_encoder(chunk, encoder)
+            if encoder is not None:
+                raw = encoder.partial_encode(chunk[encoder.source_column].to_numpy(dtype=np.float64))
+                raw_features.append(raw)
+                held_bytes += raw.nbytes
+            chunk_bytes = int(chunk.memory_usage(index=False, deep=True).sum())
+            held_bytes += chunk_bytes
+            peak_bytes = max(peak_bytes, held_bytes)
+            rows += len(chunk)
+            chunks.append(chunk)
+    
+    if not chunks:
+        raise ValueError("CSV contains no rows")
+    
+    n_chunks = len(chunks)
+    df = pd.concat(chunks, ignore_index=True, copy=False) if n_chunks > 1 else chunks[0]
+    if n_chunks > 1:
+        # The chunks are still alive while concat builds the final frame
+        peak_bytes = max(peak_bytes, held_bytes + int(df.memory_usage(index=False, deep=True).sum()))
+    del chunks
+    
+    if encoder is not None:
+        # Normalisation needs the global min/max, known only after the last chunk
+        features = encoder.normalize(np.concatenate(raw_features))
+        for i, name in enumerate(RA_FEATURES):
+            df[name] = features[:, i]
+    
+    return df, {"rows": rows, "chunks": n_chunks, "chunk_rows": chunk_rows, "typed": dtypes is not None,
+                "encoded_in_chunks": encoder is not None, "peak_memory_bytes": peak_bytes}
+
+
+def _chunk_encoder(chunk: pd.DataFrame, encoder: RAEncoder) -> Optional[RAEncoder]:
+    """Bind the encoder to its source column (default: first numeric), or None if it cannot be used"""
+    if any(name in chunk.columns for name in RA_FEATURES):
+        return None
+    if encoder.source_column is not None:
+        return encoder if encoder.source_column in chunk.columns else None
+    numeric_cols = chunk.select_dtypes(include=['number']).columns
+    if len(numeric_cols) == 0:
+        return None
+    encoder.source_column = numeric_cols[0]
+    return encoder
+
+
+def read_csv_chunked(
+    fileobj,
+    chunk_rows: int = CSV_CHUNK_ROWS,
+    encoder: Optional[RAEncoder] = None
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Parse a binary CSV stream incrementally with explicit dtypes.
+
+    The bytes are handed straight to the C parser, so the upload is never
+    decoded into one large string. With ``encoder``, each chunk is fed to
+    it as it is parsed and the RA features are added to the frame. Falls
+    back to per-chunk type inference, without chunked encoding, if the
+    sniffed dtypes do not hold for the whole file.
+
+    Returns:
+        (DataFrame, ingest metadata with row/chunk counts and peak memory)
+    """
+    dtypes = _sniff_csv_dtypes(fileobj)
+    try:
+        df, info = _collect_csv_chunks(fileobj, dtypes, chunk_rows, encoder)
+    except (ValueError, TypeError):
+        fileobj.seek(0)
+        if encoder is not None:
+            encoder.reset()
+        df, info = _collect_csv_chunks(fileobj, None, chunk_rows)
+    
+    info["process_peak_rss_bytes"] = _process_peak_rss_bytes()
+    return df, info
+
+
+def _process_peak_rss_bytes() -> Optional[int]:
+    """High-water resident set size of this process, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _upload_size(file: UploadFile) -> int:
+    """Size of a spooled upload, measured by seeking if the parser did not record it"""
+    if file.size is not None:
+        return file.size
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+
+# Columnar Uploads
+# Content types of the Arrow and Parquet bodies accepted by /api/longevity/analyze
+ARROW_STREAM_CONTENT_TYPES = ("application/vnd.apache.arrow.stream",)
+PARQUET_CONTENT_TYPES = ("application/vnd.apache.parquet", "application/x-parquet", "application/parquet")
+
+
+def ingest_columns(schema: list[tuple[str, bool]], options: AnalysisOptions, keep: Optional[list[str]] = None) -> list[str]:
+    """
+    Columns of an uploaded table that the analysis reads, in table order.
+
+    ``schema`` lists (name, is_numeric) per column. These are the RA source
+    column (``value_column``, or the first numeric column as the encoders
+    would choose it), any supplied RA features, the entity/timestamp
+    columns, the wide ``encode_columns`` and ``target``, plus ``keep``
+    (``["*"]`` keeps every column). Requested columns missing from the
+    table are left for the pipeline to report.
+    """
+    names = [name for name, _ in schema]
+    if keep == ["*"]:
+        return names
+    numeric = [name for name, is_numeric in schema if is_numeric]
+    
+    needed = set(keep or ())
+    needed.update(column for column in (options.entity_column, options.timestamp_column, options.value_column) if column)
+    supplied = [name for name in RA_FEATURES if name in names]
+    needed.update(supplied)
+    if 'target' in names:
+        needed.add('target')
+    if numeric and (options.value_column is None or supplied):
+        # Tabular encoding falls back to the first numeric column, panel
+        # encoding to the first one that is not an entity or timestamp
+        needed.add(numeric[0])
+        series = [name for name in numeric if name not in (options.entity_column, options.timestamp_column)]
+        if _is_panel(options) and series:
+            needed.add(series[0])
+    if options.encode_columns == ["*"]:
+        needed.update(numeric)
+    elif options.encode_columns:
+        needed.update(options.encode_columns)
+    return [name for name in names if name in needed]
+
+
+def read_table_upload(
+    body: bytes,
+    content_type: str,
+    options: AnalysisOptions,
+    keep: Optional[list[str]] = None
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Read an Arrow IPC stream or Parquet body into a DataFrame.
+
+    Only the columns from ``ingest_columns`` are read: Parquet skips the
+    other column chunks, and Arrow record batches are sliced without copying
+    the body. Numeric columns become NumPy arrays over the Arrow buffers,
+    with no per-value Python objects.
+
+    Returns:
+        (DataFrame, ingest metadata with the format and columns read)
+    """
+    pa = _optional_module("pyarrow")
+    if pa is None:
+        raise HTTPException(status_code=415, detail="Arrow and Parquet uploads need pyarrow installed")
+    
+    buffer = pa.py_buffer(body)
+    if content_type in PARQUET_CONTENT_TYPES:
+        upload_format = "parquet"
+        parquet_file = _optional_module("pyarrow.parquet").ParquetFile(pa.BufferReader(buffer))
+        schema = parquet_file.schema_arrow
+        columns = ingest_columns(_arrow_schema_columns(pa, schema), options, keep)
+        table = parquet_file.read(columns=columns)
+    else:
+        upload_format = "arrow"
+        reader = pa.ipc.open_stream(buffer)
+        schema = reader.schema
+        columns = ingest_columns(_arrow_schema_columns(pa, schema), options, keep)
+        table = reader.read_all().select(columns)
+    
+    # One block per column lets numeric columns share the Arrow buffers
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    return df, {
+        "format": upload_format,
+        "rows": len(df),
+        "columns_read": columns,
+        "columns_skipped": len(schema) - len(columns)
+    }
+
+
+def _arrow_schema_columns(pa, schema) -> list[tuple[str, bool]]:
+    return [(field.name, pa.types.is_integer(field.type) or pa.types.is_floating(field.type)) for field in schema]
+
+
+def _declared_length(request: Request) -> Optional[int]:
+    """The request's Content-Length, if it declares one; refused with 413 above MAX_UPLOAD_BYTES"""
+    declared = request.headers.get("content-length")
+    if declared is None or not declared.isdigit():
+        return None
+    if int(declared) > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload of {declared} bytes exceeds the {MAX_UPLOAD_BYTES} byte limit"
+        )
+    return int(declared)
+
+
+async def _read_body(request: Request) -> bytes:
+    """The request body, refused with 413 once it exceeds MAX_UPLOAD_BYTES"""
+    _declared_length(request)
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+# Stage Timing Metrics
+class StageClock:
+    """
+    Wall-clock time and row counts of the consecutive stages of one analysis.
+
+    Starting a stage ends the previous one. The clock lives wherever the
+    pipeline runs, including inside analysis workers, and its ``stages``
+    travel back with the computed results.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, dict] = {}
+        self._current: Optional[str] = None
+        self._started = 0.0
+
+    def start(self, stage: str, rows: Optional[int] = None):
+        now = time.perf_counter()
+        self.stop(now)
+        self._current, self._started = stage, now
+        entry = self.stages.setdefault(stage, {"seconds": 0.0})
+        if rows is not None:
+            entry["rows"] = int(rows)
+
+    def stop(self, now: Optional[float] = None):
+        if self._current is None:
+            return
+        now = time.perf_counter() if now is None else now
+        self.stages[self._current]["seconds"] += now - self._started
+        self._current = None
+
+
+_stage_clock: ContextVar[Optional[StageClock]] = ContextVar("stage_clock", default=None)
+
+
+@contextmanager
+def timed_stages():
+    """Collect the stages started in this context (see ``clock_stage``) on a new StageClock"""
+    clock = StageClock()
+    token = _stage_clock.set(clock)
+    try:
+        yield clock
+    finally:
+        clock.stop()
+        _stage_clock.reset(token)
+
+
+def clock_stage(stage: str, rows: Optional[int] = None):
+    """Start ``stage`` on the current StageClock; a no-op outside ``timed_stages``"""
+    clock = _stage_clock.get()
+    if clock is not None:
+        clock.start(stage, rows)
+
+
+class StageMetrics:
+    """
+    Process-wide latency histograms and row/byte counters, rendered in the
+    Prometheus text format.
+
+    Recording is a bisect and a few additions under a lock, cheap enough to
+    stay on for every request.
+    """
+
+    METRICS = {
+        "stage_duration_seconds": ("histogram", "Time spent in each analysis stage"),
+        "stage_rows_total": ("counter", "Rows processed by each analysis stage"),
+        "stage_bytes_total": ("counter", "Bytes read or written by each analysis stage"),
+        "request_duration_seconds": ("histogram", "HTTP request latency by route"),
+        "requests_total": ("counter", "HTTP requests by route and status code"),
+        "response_bytes_total": ("counter", "HTTP response body bytes by route"),
+    }
+
+    def __init__(self, buckets: tuple, prefix: str = "ra_longevity_"):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # (name, labels) -> per-bucket counts, the +Inf bucket, then the sum
+        self._histograms: dict[tuple, list] = {}
+        self._counters: dict[tuple, float] = {}
+
+    def observe(self, name: str, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def add(self, name: str, labels: tuple, value: float = 1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def record_stage(self, stage: str, seconds: float, rows: Optional[int] = None, nbytes: Optional[int] = None):
+        labels = (("stage", stage),)
+        self.observe("stage_duration_seconds", labels, seconds)
+        if rows is not None:
+            self.add("stage_rows_total", labels, rows)
+        if nbytes is not None:
+            self.add("stage_bytes_total", labels, nbytes)
+
+    def record_stages(self, stages: dict):
+        """Record a run's StageClock breakdown"""
+        for stage, entry in stages.items():
+            self.record_stage(stage, entry["seconds"], entry.get("rows"), entry.get("bytes"))
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, nbytes: int):
+        labels = (("method", method), ("route", route))
+        self.observe("request_duration_seconds", labels, seconds)
+        self.add("requests_total", labels + (("status", str(status)),))
+        self.add("response_bytes_total", labels, nbytes)
+
+    def render(self) -> str:
+        """All series in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+            counters = dict(self._counters)
+        
+        lines = []
+        for name, (kind, help_text) in self.METRICS.items():
+            metric = self.prefix + name
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            if kind == "counter":
+                for (series, labels), value in sorted(counters.items()):
+                    if series == name:
+                        lines.append(f"{metric}{_prometheus_labels(labels)} {_prometheus_value(value)}")
+                continue
+            for (series, labels), values in sorted(histograms.items()):
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _prometheus_value(bound)
+                    lines.append(f"{metric}_bucket{_prometheus_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{metric}_sum{_prometheus_labels(labels)} {_prometheus_value(values[-1])}")
+                lines.append(f"{metric}_count{_prometheus_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _prometheus_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _prometheus_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+stage_metrics = StageMetrics(METRICS_BUCKETS)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording each HTTP request's latency, status and
+    response size in ``stage_metrics``.
+
+    Requests are labelled with their route template (not the concrete
+    path, which would give one series per run_id); unmatched paths share
+    one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[dict] = None
+
+    def _route_path(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {route.endpoint: route.path for route in scope["app"].routes
+                            if hasattr(route, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        status = 500
+        sent = 0
+        
+        async def send_and_count(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_and_count)
+        finally:
+            stage_metrics.record_request(scope["method"], self._route_path(scope), status,
+                                         time.perf_counter() - started, sent)
+
+
+app.add_middleware(RequestMetricsMiddleware)
+
+
+def _timed_chunks(stage: str, chunks):
+    """
+    Yield from ``chunks``, recording the time spent producing them as
+    ``stage``. Time blocked on the client between chunks is not counted,
+    and an abandoned stream is not recorded.
+    """
+    elapsed = 0.0
+    nbytes = 0
+    iterator = iter(chunks)
+    while True:
+        started = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - started
+        nbytes += len(chunk)
+        yield chunk
+    stage_metrics.record_stage(stage, elapsed, nbytes=nbytes)
+
+
+# CPU Worker Pool
+class AnalysisWorkerPool:
+    """
+    Process pool that runs the CPU-bound analysis stages off the event loop.
+
+    Submissions beyond ``max_workers + queue_size`` in-flight jobs are rejected
+    with a 503 so a burst of uploads cannot grow an unbounded backlog.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, mp_context: Optional[str] = None):
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(0, queue_size)
+        self.mp_context = mp_context
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._in_flight = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = None
+            if self.mp_context and self.mp_context in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context(self.mp_context)
+                if WARMUP and self.mp_context == "forkserver":
+                    # Workers fork from a server that already imported the analysis stack
+                    context.set_forkserver_preload(list(WARMUP_PRELOAD))
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=context, initializer=_analysis_worker_init
+            )
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` in a worker process and await its result"""
+        if self._in_flight >= self.max_workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Analysis queue is full, retry later")
+
+        self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            result, elapsed = await loop.run_in_executor(executor, _timed_call, fn, *args)
+            self._busy_seconds += elapsed
+            self.completed += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for later jobs.
+            # Shut the broken one down so its management thread and surviving
+            # children exit; concurrent failures only replace it once.
+            self.failed += 1
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def stats(self) -> dict:
+        """Current queue depth and worker utilisation"""
+        running = min(self._in_flight, self.max_workers)
+        uptime = max(time.monotonic() - self._started_at, 1e-9)
+        return {
+            "max_workers": self.max_workers,
+            "queue_size": self.queue_size,
+            "running": running,
+            "queued": self._in_flight - running,
+            "utilization": running / self.max_workers,
+            "avg_utilization": min(self._busy_seconds / (uptime * self.max_workers), 1.0),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def warm_up(self):
+        """Start every worker process and run warm_up in each; blocking"""
+        executor = self._get_executor()
+        for future in [executor.submit(warm_up) for _ in range(self.max_workers)]:
+            future.result()
+
+
+def _analysis_worker_init():
+    """Worker start-up: yield CPU to the server process (see ANALYSIS_WORKER_NICE)"""
+    if ANALYSIS_WORKER_NICE > 0:
+        try:
+            os.nice(ANALYSIS_WORKER_NICE)
+        except OSError:
+            pass
+
+
+def _timed_call(fn, *args):
+    """Worker-side wrapper returning the result with its wall-clock duration"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+analysis_pool = AnalysisWorkerPool(ANALYSIS_WORKERS, ANALYSIS_QUEUE_SIZE, ANALYSIS_MP_CONTEXT)
+
+
+# Cold Start
+# Modules the forkserver imports before forking analysis workers when WARMUP is on
+WARMUP_PRELOAD = ("pandas", "sklearn.ensemble", "joblib")
+
+
+def warm_up() -> float:
+    """
+    Import the analysis stack and run one tiny analysis; returns its seconds.
+
+    Pays the import and first-call costs of encode, fit and predict up
+    front instead of on the first request. Nothing is written to disk.
+    """
+    started = time.perf_counter()
+    for name in WARMUP_PRELOAD:
+        importlib.import_module(name)
+    _compute_analysis(pd.DataFrame({"value": np.linspace(0.0, 1.0, 16)}))
+    return time.perf_counter() - started
+
+
+class StartupWarmUp:
+    """
+    Background warm-up run at startup when WARMUP is set.
+
+    Warms the server process first, then starts and warms every analysis
+    worker. Requests are served throughout; one arriving before the stack is
+    warm waits on the same imports instead of repeating them.
+    """
+
+    def __init__(self):
+        self.state = "off"
+        self.process_seconds: Optional[float] = None
+        self.workers_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def run(self):
+        self.state = "running"
+        try:
+            self.process_seconds = warm_up()
+            started = time.perf_counter()
+            analysis_pool.warm_up()
+            self.workers_seconds = time.perf_counter() - started
+            self.state = "done"
+        except Exception as e:
+            self.error = repr(e)
+            self.state = "failed"
+
+    def stats(self) -> dict:
+        return {
+            "import_seconds": IMPORT_SECONDS,
+            "warm_up": self.state,
+            "warm_up_process_seconds": self.process_seconds,
+            "warm_up_workers_seconds": self.workers_seconds,
+            "warm_up_error": self.error,
+        }
+
+
+startup_warm_up = StartupWarmUp()
+
+
+# Job Scheduler
+class AnalysisJobScheduler:
+    """
+    Bounded in-process scheduler for job-mode analyses.
+
+    At most ``max_concurrent`` jobs run at once and at most ``max_pending``
+    wait for a slot; further submissions are rejected with a 503.
+    """
+
+    def __init__(self, max_concurrent: int, max_pending: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_pending = max(0, max_pending)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: set = set()
+        self._pending = 0
+        self._running = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._loop = loop
+        return self._semaphore
+
+    def submit(self, coro) -> asyncio.Task:
+        """Schedule ``coro`` as a background job"""
+        if self._pending + self._running >= self.max_concurrent + self.max_pending:
+            coro.close()
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many pending analysis jobs, retry later")
+
+        self.submitted += 1
+        self._pending += 1
+        task = asyncio.get_running_loop().create_task(self._run(coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, coro):
+        semaphore = self._get_semaphore()
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self._pending -= 1
+            coro.close()
+            raise
+        self._pending -= 1
+        self._running += 1
+        try:
+            await coro
+        finally:
+            self._running -= 1
+            semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_pending": self.max_pending,
+            "running": self._running,
+            "pending": self._pending,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+
+job_scheduler = AnalysisJobScheduler(MAX_CONCURRENT_JOBS, MAX_PENDING_JOBS)
+
+
+# Admission Control
+# Estimated peak memory of an analysis: a fixed base for the fit and the worker's copies,
+# plus bytes per upload byte by body format, or per cell once the row count is known
+ADMISSION_BASE_BYTES = 64 * 1024 ** 2
+ADMISSION_BYTES_PER_UPLOAD_BYTE = {"json": 18, "csv": 14, "arrow": 16, "parquet": 16}
+ADMISSION_BYTES_PER_CELL = 32
+# Upper bound of the Retry-After seconds sent with a 429
+ADMISSION_MAX_RETRY_AFTER = 60
+
+
+def estimate_analysis_memory(
+    upload_bytes: int = 0,
+    body_format: str = "json",
+    rows: int = 0,
+    columns: int = 0
+) -> int:
+    """
+    Estimated peak memory of one analysis, for admission control.
+
+    From the row and column count when known (each input column plus the
+    RA features and predictions, in the parsed, worker and encoded
+    frames), otherwise from the size of the upload in ``body_format``.
+    """
+    if rows:
+        return ADMISSION_BASE_BYTES + rows * (columns + len(RA_FEATURES) + 1) * ADMISSION_BYTES_PER_CELL
+    return ADMISSION_BASE_BYTES + upload_bytes * ADMISSION_BYTES_PER_UPLOAD_BYTE[body_format]
+
+
+class AdmissionTicket:
+    """
+    One analysis' claim on the admission budget: a CPU slot and its estimated memory.
+
+    Used as ``async with admission.admit(memory_bytes) as ticket``, which
+    waits for admission and releases the claim on exit. A request that
+    stops computing for a while (waiting on a duplicate run) can
+    ``release`` the claim early and ``readmit`` if it has to compute after
+    all.
+
+    A job reserves only its memory when it is submitted
+    (``admit(memory_bytes, slot=False, max_wait=0)``), so a burst of queued
+    jobs cannot outgrow the memory budget. The job takes the ticket over
+    with ``hand_off`` and claims its CPU slot with ``take_slot`` once the
+    scheduler starts it.
+    """
+
+    def __init__(
+        self,
+        controller: "AdmissionController",
+        memory_bytes: int,
+        slot: bool = True,
+        max_wait: Optional[float] = None
+    ):
+        self.controller = controller
+        self.memory_bytes = memory_bytes
+        self.slot = slot
+        # None waits without a time limit
+        self.max_wait = max_wait
+        self.granted = False
+        self.released = False
+        self.handed_off = False
+        # What the ticket holds; a pending claim is granted as a whole
+        self.holds_slot = False
+        self.held_memory = 0
+        self.granted_at = 0.0
+
+    async def __aenter__(self) -> "AdmissionTicket":
+        await self.controller._acquire(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if not self.handed_off:
+            self.release()
+
+    def hand_off(self) -> "AdmissionTicket":
+        """Keep the claim past the ``async with`` block; the new owner calls release"""
+        self.handed_off = True
+        return self
+
+    async def take_slot(self):
+        """Claim a CPU slot for a ticket that holds only memory, waiting as long as it takes"""
+        self.slot = True
+        self.max_wait = None
+        await self.controller._acquire(self)
+
+    async def readmit(self):
+        """Claim the budget again after ``release``"""
+        self.granted = False
+        self.released = False
+        await self.controller._acquire(self)
+
+    def release(self):
+        if self.granted and not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def _wants(self) -> tuple[bool, int]:
+        """(CPU slot, memory) the ticket still has to be granted"""
+        return self.slot and not self.holds_slot, self.memory_bytes - self.held_memory
+
+
+class AdmissionController:
+    """
+    Admits analyses while they fit a CPU-slot budget and a memory budget.
+
+    Each admitted analysis holds one of ``cpu_slots`` slots and its
+    estimated peak memory (see estimate_analysis_memory) until its ticket
+    is released; a submitted job holds its memory from submission and its
+    slot once it starts. Requests that do not fit wait in arrival order,
+    so a large request is not overtaken indefinitely by small ones, for up
+    to ``max_wait`` seconds; then they are shed with a 429 whose
+    Retry-After is the expected time until enough analyses have finished.
+    A request estimated above the whole memory budget runs only when
+    nothing else is admitted.
+    """
+
+    def __init__(self, cpu_slots: int, memory_bytes: int, max_wait: float):
+        self.cpu_slots = max(1, cpu_slots)
+        self.memory_bytes = max(0, memory_bytes)
+        self.max_wait = max(0.0, max_wait)
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+        self._slots_used = 0
+        self._memory_used = 0
+        # Tickets holding memory but no slot yet (queued jobs)
+        self._reserved = 0
+        # Moving average of how long an admitted analysis holds its slot
+        self._hold_seconds: Optional[float] = None
+        self.admitted = 0
+        self.waited = 0
+        self.shed = 0
+        self.wait_seconds = 0.0
+
+    def admit(self, memory_bytes: int, slot: bool = True, max_wait: Optional[float] = -1) -> AdmissionTicket:
+        """
+        A ticket for an analysis of ``memory_bytes``; admitted when its ``async with`` is entered.
+
+        Without ``slot`` only the memory is claimed. ``max_wait`` defaults
+        to the controller's; None waits without a time limit.
+        """
+        return AdmissionTicket(self, int(memory_bytes), slot, self.max_wait if max_wait == -1 else max_wait)
+
+    def _fits(self, ticket: AdmissionTicket) -> bool:
+        slot, memory = ticket._wants()
+        if slot and self._slots_used >= self.cpu_slots:
+            return False
+        if not memory:
+            return True
+        idle = self._slots_used == 0 and self._memory_used == 0
+        return idle or self._memory_used + memory <= self.memory_bytes
+
+    def _grant(self, ticket: AdmissionTicket):
+        slot, memory = ticket._wants()
+        if ticket.held_memory and not ticket.holds_slot:
+            self._reserved -= 1
+        if slot:
+            self._slots_used += 1
+            ticket.holds_slot = True
+            ticket.granted_at = time.monotonic()
+        self._memory_used += memory
+        ticket.held_memory += memory
+        if not ticket.holds_slot:
+            self._reserved += 1
+        if not ticket.granted:
+            ticket.granted = True
+            self.admitted += 1
+
+    async def _acquire(self, ticket: AdmissionTicket):
+        max_wait = ticket.max_wait
+        waits = max_wait is None or max_wait > 0
+        with self._lock:
+            # A job holding its memory only needs a slot, so it does not queue behind requests waiting for memory
+            if (not self._waiters or not ticket._wants()[1]) and self._fits(ticket):
+                self._grant(ticket)
+                return
+            if waits:
+                future = asyncio.get_running_loop().create_future()
+                self._waiters.append((future, ticket))
+                self.waited += 1
+        
+        if waits:
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(asyncio.shield(future), max_wait)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                # Cancelled (the client went away): give up the place or the grant
+                self._withdraw(ticket)
+                ticket.release()
+                raise
+            finally:
+                self.wait_seconds += time.monotonic() - started
+            if not self._withdraw(ticket):
+                return
+        
+        with self._lock:
+            self.shed += 1
+            retry_after = self._retry_after()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many analyses in progress, retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def _withdraw(self, ticket: AdmissionTicket) -> bool:
+        """Take a ticket out of the queue; False if it was granted meanwhile"""
+        with self._lock:
+            if not any(waiter[1] is ticket for waiter in self._waiters):
+                return False
+            self._waiters = deque(waiter for waiter in self._waiters if waiter[1] is not ticket)
+            # It may have been the head, blocking requests that fit
+            self._wake()
+            return True
+
+    def _release(self, ticket: AdmissionTicket):
+        with self._lock:
+            if ticket.holds_slot:
+                held = time.monotonic() - ticket.granted_at
+                self._slots_used -= 1
+                self._hold_seconds = held if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * held
+            elif ticket.held_memory:
+                self._reserved -= 1
+            self._memory_used -= ticket.held_memory
+            ticket.holds_slot = False
+            ticket.held_memory = 0
+            self._wake()
+
+    def _wake(self):
+        """
+        Grant waiting tickets in arrival order while the head fits; called with the lock held.
+
+        Jobs that already hold their memory and wait only for a slot are
+        granted first, since the memory they free is what the rest may be
+        waiting for.
+        """
+        while self._waiters:
+            waiter = next(
+                (waiter for waiter in self._waiters if not waiter[1]._wants()[1] and self._fits(waiter[1])),
+                None
+            )
+            if waiter is None:
+                if not self._fits(self._waiters[0][1]):
+                    return
+                waiter = self._waiters[0]
+            future, ticket = waiter
+            self._waiters.remove(waiter)
+            self._grant(ticket)
+            try:
+                future.get_loop().call_soon_threadsafe(_resolve_future, future)
+            except RuntimeError:
+                # The waiter's event loop is gone; its request is too
+                ticket.released = True
+                if ticket.holds_slot:
+                    self._slots_used -= 1
+                else:
+                    self._reserved -= 1
+                self._memory_used -= ticket.held_memory
+                ticket.holds_slot = False
+                ticket.held_memory = 0
+
+    def _retry_after(self) -> int:
+        """Seconds until the analyses admitted and queued now are expected to have finished a slot's worth"""
+        hold = self._hold_seconds if self._hold_seconds is not None else self.max_wait or 1.0
+        rounds = (len(self._waiters) + self._slots_used + self._reserved) / self.cpu_slots
+        return int(min(max(1, math.ceil(hold * rounds)), ADMISSION_MAX_RETRY_AFTER))
+
+    def stats(self) -> dict:
+        return {
+            "cpu_slots": self.cpu_slots,
+            "memory_bytes": self.memory_bytes,
+            "max_wait_seconds": self.max_wait,
+            "running": self._slots_used,
+            "reserved": self._reserved,
+            "reserved_memory_bytes": self._memory_used,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "shed": self.shed,
+            "wait_seconds": self.wait_seconds,
+            "avg_hold_seconds": self._hold_seconds,
+        }
+
+
+def _resolve_future(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+admission = AdmissionController(ADMISSION_CPU_SLOTS, ADMISSION_MEMORY_BYTES, ADMISSION_MAX_WAIT_SECONDS)
+
+
+def _admit_analysis(memory_bytes: int, job: bool) -> AdmissionTicket:
+    """
+    Admission ticket for an analysis request.
+
+    A job reserves only its memory, and is shed at once if that does not
+    fit: its request returns a 202 without waiting, and queued jobs must
+    not outgrow the memory budget. It takes a CPU slot when it starts.
+    """
+    if job:
+        return admission.admit(memory_bytes, slot=False, max_wait=0)
+    return admission.admit(memory_bytes)
+# Blocking work of analyses runs here rather than in the default thread pool (see ANALYSIS_IO_THREADS)
+analysis_io = ThreadPoolExecutor(max_workers=ANALYSIS_IO_THREADS, thread_name_prefix="analysis-io")
+
+
+async def run_analysis_io(fn, *args):
+    """Run blocking analysis work (parse, hashing, artifact I/O) on the analysis_io threads"""
+    return await asyncio.get_running_loop().run_in_executor(analysis_io, functools.partial(fn, *args))
+
+
+# Analysis Cache
+class ByteBudgetLRU:
+    """
+    Thread-safe in-memory LRU bounded by the total byte size of its values.
+
+    Values larger than the whole budget are not cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, max_bytes)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size: int):
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+def analysis_content_key(df: pd.DataFrame, options: AnalysisOptions, exclude: tuple = ()) -> str:
+    """
+    SHA-256 over the canonicalised input, the analysis options and the model parameters.
+
+    Columns are hashed in name order and numeric columns as float64, so the
+    same table sent as JSON records or uploaded as CSV gets the same key.
+    Row order is significant: the RA features are sequential.
+    """
+    digest = hashlib.sha256()
+    # The thread budget does not change the fitted model
+    header = {
+        "options": options.model_dump(exclude={"train_threads"}),
+        "model": MODEL_PARAMS,
+        "engine": select_engine(len(df), options),
+        "train_rows": _train_row_budget(len(df), options),
+        "train_sample": options.train_sample or MODEL_TRAIN_SAMPLE,
+        "rows": len(df)
+    }
+    digest.update(json.dumps(header, sort_keys=True).encode())
+    
+    for column in sorted((col for col in df.columns if col not in exclude), key=str):
+        series = df[column]
+        digest.update(json.dumps(str(column)).encode())
+        if pd.api.types.is_numeric_dtype(series):
+            values = np.ascontiguousarray(series.to_numpy(dtype=np.float64, na_value=np.nan))
+            digest.update(b"f8")
+        else:
+            try:
+                values = pd.util.hash_pandas_object(series, index=False).to_numpy()
+            except TypeError:
+                # Unhashable cells such as nested JSON objects
+                values = pd.util.hash_pandas_object(series.astype(str), index=False).to_numpy()
+            digest.update(b"h8")
+        digest.update(values.data)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of analysis runs and fitted models.
+
+    Entries are keyed by ``analysis_content_key`` and kept in memory LRUs
+    backed by files under ``cache_dir``, so they survive restarts and are
+    shared by every server process:
+
+    - runs/<key>.json: the run that analysed this content
+    - models/<key>.pkl: its fitted model, reused when the run itself cannot be
+    - idempotency/<sha256 of Idempotency-Key>.json: the run a client key maps to
+    """
+
+    def __init__(self, cache_dir: Path, index_bytes: int, model_bytes: int, model_disk_bytes: int):
+        self.cache_dir = cache_dir
+        self.model_disk_bytes = max(0, model_disk_bytes)
+        self._index = ByteBudgetLRU(index_bytes)
+        self._models = ByteBudgetLRU(model_bytes)
+        self.run_hits = 0
+        self.run_misses = 0
+        self.model_hits = 0
+        self.model_disk_hits = 0
+        self.model_misses = 0
+        self.idempotent_replays = 0
+        self.idempotency_conflicts = 0
+
+    # Small JSON index entries (runs, idempotency keys)
+    def _read_entry(self, kind: str, name: str) -> Optional[dict]:
+        entry = self._index.get((kind, name))
+        if entry is not None:
+            return entry
+        try:
+            with open(self.cache_dir / kind / f"{name}.json", 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        self._index.put((kind, name), entry, len(name) + 256)
+        return entry
+
+    def _write_entry(self, kind: str, name: str, entry: dict):
+        path = self.cache_dir / kind / f"{name}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(path, entry)
+        self._index.put((kind, name), entry, len(name) + 256)
+
+    def _forget_entry(self, kind: str, name: str):
+        self._index.pop((kind, name))
+        (self.cache_dir / kind / f"{name}.json").unlink(missing_ok=True)
+
+    def lookup_run(self, content_key: str) -> Optional[str]:
+        entry = self._read_entry("runs", content_key)
+        return entry["run_id"] if entry else None
+
+    def remember_run(self, content_key: str, run_id: str):
+        self._write_entry("runs", content_key, {"run_id": run_id})
+
+    def forget_run(self, content_key: str):
+        self._forget_entry("runs", content_key)
+
+    @staticmethod
+    def _idempotency_name(idempotency_key: str) -> str:
+        return hashlib.sha256(idempotency_key.encode()).hexdigest()
+
+    def lookup_idempotency(self, idempotency_key: str) -> Optional[dict]:
+        return self._read_entry("idempotency", self._idempotency_name(idempotency_key))
+
+    def remember_idempotency(self, idempotency_key: str, run_id: str, content_key: str):
+        self._write_entry("idempotency", self._idempotency_name(idempotency_key),
+                          {"run_id": run_id, "content_key": content_key})
+
+    # Fitted models (pickled bytes); blocking, call off the event loop
+    def lookup_model(self, content_key: str) -> Optional[bytes]:
+        blob = self._models.get(content_key)
+        if blob is None:
+            path = self.cache_dir / "models" / f"{content_key}.pkl"
+            try:
+                blob = path.read_bytes()
+                os.utime(path)
+            except FileNotFoundError:
+                self.model_misses += 1
+                return None
+            self.model_disk_hits += 1
+            self._models.put(content_key, blob, len(blob))
+        self.model_hits += 1
+        return blob
+
+    def store_model(self, content_key: str, blob: bytes):
+        self._models.put(content_key, blob, len(blob))
+        if len(blob) > self.model_disk_bytes:
+            return
+        models_dir = self.cache_dir / "models"
+        models_dir.mkdir(parents=True, exist_ok=True)
+        path = models_dir / f"{content_key}.pkl"
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp_path.write_bytes(blob)
+        os.replace(tmp_path, path)
+        self._trim_models_dir(models_dir)
+
+    def _trim_models_dir(self, models_dir: Path):
+        """Drop the least recently used model files beyond the disk budget"""
+        files = []
+        for entry in os.scandir(models_dir):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.model_disk_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+    def stats(self) -> dict:
+        return {
+            "runs": {"hits": self.run_hits, "misses": self.run_misses},
+            "models": {
+                "hits": self.model_hits,
+                "disk_hits": self.model_disk_hits,
+                "misses": self.model_misses,
+                "memory": self._models.stats(),
+            },
+            "idempotency": {"replays": self.idempotent_replays, "conflicts": self.idempotency_conflicts},
+            "index": self._index.stats(),
+        }
+
+
+analysis_cache = AnalysisCache(CACHE_DIR, CACHE_INDEX_BYTES, MODEL_CACHE_BYTES, MODEL_CACHE_DISK_BYTES)
+
+
+# Model Serving
+class DeployedModel:
+    """A run's fitted model with its manifest, ready to predict on new rows"""
+
+    def __init__(self, run_id: str, model, manifest: dict):
+        self.run_id = run_id
+        self.model = model
+        self.features = manifest["features"]
+        self.options = AnalysisOptions(**manifest["options"])
+        self.encoder_state = manifest.get("encoder_state")
+        self.batcher = PredictionBatcher(self, PREDICT_BATCH_MAX_ROWS, PREDICT_BATCH_WAIT_MS / 1000)
+
+    def encode(self, df: pd.DataFrame) -> np.ndarray:
+        """Feature matrix for new rows, encoded as the training data was"""
+        if not all(name in df.columns for name in self.features):
+            df = encode_new_rows(df, self.options, self.encoder_state)
+        missing = [name for name in self.features if name not in df.columns]
+        if missing:
+            raise AnalysisInputError(f"Rows cannot be encoded into the model features {missing}")
+        return df[self.features].fillna(0).to_numpy(dtype=np.float32)
+
+    def predict(self, df: pd.DataFrame) -> list[float]:
+        return self.model.predict(self.encode(df)).tolist()
+
+    def predict_many(self, frames: list) -> list:
+        """
+        Predict several requests with one model call.
+
+        Returns one list of predictions per frame, or the exception raised
+        while encoding that frame, so one bad request does not fail the others.
+        """
+        encoded = []
+        for df in frames:
+            try:
+                encoded.append(self.encode(df))
+            except Exception as e:
+                encoded.append(e)
+        
+        arrays = [X for X in encoded if not isinstance(X, Exception)]
+        if arrays:
+            predictions = self.model.predict(np.concatenate(arrays)).tolist()
+        
+        results, offset = [], 0
+        for X in encoded:
+            if isinstance(X, Exception):
+                results.append(X)
+            else:
+                results.append(predictions[offset:offset + len(X)])
+                offset += len(X)
+        return results
+
+
+class BatchStats:
+    """Batch-size distribution and queueing delay of the prediction micro-batchers"""
+
+    def __init__(self, max_rows: int, window: int = 2048):
+        # Power-of-two row buckets up to max_rows, plus one for larger batches
+        self.bounds = [2 ** i for i in range(max(1, max_rows).bit_length())]
+        if self.bounds[-1] < max_rows:
+            self.bounds.append(max_rows)
+        self.batch_rows = [0] * (len(self.bounds) + 1)
+        self.delays = deque(maxlen=window)
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+
+    def record(self, rows: int, delays: list[float]):
+        self.batches += 1
+        self.requests += len(delays)
+        self.rows += rows
+        index = next((i for i, bound in enumerate(self.bounds) if rows <= bound), len(self.bounds))
+        self.batch_rows[index] += 1
+        self.delays.extend(delays)
+
+    def stats(self) -> dict:
+        labels = [f"le_{bound}" for bound in self.bounds] + [f"gt_{self.bounds[-1]}"]
+        delays_ms = np.asarray(self.delays) * 1000
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "rows": self.rows,
+            "requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+            "batch_rows": dict(zip(labels, self.batch_rows)),
+            "queue_delay_ms": {
+                "p50": float(np.percentile(delays_ms, 50)) if len(delays_ms) else 0.0,
+                "p95": float(np.percentile(delays_ms, 95)) if len(delays_ms) else 0.0,
+                "max": float(delays_ms.max()) if len(delays_ms) else 0.0,
+            },
+        }
+
+
+class PredictionBatcher:
+    """
+    Coalesces concurrent predictions for one model into a single predict call.
+
+    The first request of a batch opens a ``max_wait`` second window; the
+    batch is flushed when it closes or once ``max_rows`` rows are queued.
+    The batch is encoded per request, predicted as one stacked array off
+    the event loop, and the results are scattered back to each caller.
+    """
+
+    def __init__(self, deployed: "DeployedModel", max_rows: int, max_wait: float):
+        self.deployed = deployed
+        self.max_rows = max(1, max_rows)
+        self.max_wait = max(0.0, max_wait)
+        self._pending: list = []
+        self._pending_rows = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def predict(self, df: pd.DataFrame) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((df, future, time.perf_counter()))
+        self._pending_rows += len(df)
+        if self._pending_rows >= self.max_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, rows = self._pending, self._pending_rows
+        self._pending, self._pending_rows = [], 0
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch, rows))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list, rows: int):
+        started = time.perf_counter()
+        batch_stats.record(rows, [started - enqueued for _, _, enqueued in batch])
+        try:
+            results = await asyncio.to_thread(self.deployed.predict_many, [df for df, _, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        
+        for (_, future, _), result in zip(batch, results):
+            # The caller may have gone away (e.g. the client disconnected)
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+batch_stats = BatchStats(PREDICT_BATCH_MAX_ROWS)
+
+
+class ModelPool:
+    """
+    Bounded LRU pool that keeps deployed models loaded for /predict.
+
+    Entries are keyed by run_id and hold the model file's mtime, so a model
+    refit by an append is reloaded in place of the old one. The budget
+    counts each model's on-disk size.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._models = ByteBudgetLRU(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _model_path(run_id: str) -> Path:
+        return _run_dir(run_id) / "model.joblib"
+
+    def lookup(self, run_id: str) -> Optional[DeployedModel]:
+        """The loaded model if it is current; cheap enough for the event loop"""
+        try:
+            mtime = self._model_path(run_id).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        entry = self._models.get(run_id)
+        if entry is None or entry[0] != mtime:
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def load(self, run_id: str) -> DeployedModel:
+        """Load a model from disk into the pool; blocking, call off the event loop"""
+        path = self._model_path(run_id)
+        stat = path.stat()
+        with open(_run_dir(run_id) / "model.json", 'r') as f:
+            manifest = json.load(f)
+        import joblib
+        
+        deployed = DeployedModel(run_id, joblib.load(path, mmap_mode="r"), manifest)
+        
+        # Replaces any older version of the run's model
+        self._models.put(run_id, (stat.st_mtime_ns, deployed), stat.st_size)
+        self.misses += 1
+        return deployed
+
+    def preload(self) -> list[str]:
+        """
+        Load the newest deployed models that fit the budget; blocking.
+
+        The production server calls this before forking its workers, so they
+        share these models' memory copy-on-write instead of each loading its
+        own copy (fitted trees are copied out of the memory-mapped file on
+        load, so mmap alone does not share them). Returns the loaded run ids.
+        """
+        run_ids, total, cursor = [], 0, None
+        while True:
+            runs, cursor = run_catalogue.list_runs(deployed=True, limit=RUNS_PAGE_MAX, cursor=cursor)
+            for run in runs:
+                try:
+                    size = self._model_path(run["run_id"]).stat().st_size
+                except FileNotFoundError:
+                    continue
+                if total + size > self._models.max_bytes:
+                    cursor = None
+                    break
+                run_ids.append(run["run_id"])
+                total += size
+            if cursor is None:
+                break
+        loaded = []
+        # Oldest first, so the newest end up most recently used
+        for run_id in reversed(run_ids):
+            try:
+                self.load(run_id)
+            except Exception:
+                # Left for the worker to load (and report) on its first /predict
+                continue
+            loaded.append(run_id)
+        return loaded
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            **self._models.stats(),
+            "batching": batch_stats.stats()
+        }
+
+
+model_pool = ModelPool(MODEL_POOL_BYTES)
+
+
+# Report Cache
+class ParsedFileCache:
+    """
+    Byte-bounded LRU of parsed JSON artifact files.
+
+    Entries are keyed by path and hold the file's version (inode, size and
+    mtime), so a file replaced by an atomic rename or rewritten in place is
+    parsed again, in place of the old entry. The budget counts each file's on-disk size. Returned
+    objects are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._files = ByteBudgetLRU(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _version(stat: os.stat_result) -> str:
+        return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+    def version(self, path: Path) -> str:
+        """Identity of the file's current contents; raises FileNotFoundError"""
+        return self._version(path.stat())
+
+    def lookup(self, path: Path) -> Optional[tuple[dict, str]]:
+        """The parsed file and its version if it is cached and current; cheap enough for the event loop"""
+        try:
+            version = self.version(path)
+        except FileNotFoundError:
+            return None
+        entry = self._files.get(str(path))
+        if entry is None or entry[0] != version:
+            return None
+        self.hits += 1
+        return entry[1], version
+
+    def load(self, path: Path) -> tuple[dict, str]:
+        """Parse the file, or return it from the cache if current; blocking, call off the event loop"""
+        cached = self.lookup(path)
+        if cached is not None:
+            return cached
+        with open(path, 'r') as f:
+            # Version the open file, which an atomic rename cannot swap underneath
+            stat = os.fstat(f.fileno())
+            parsed = json.load(f)
+        version = self._version(stat)
+        
+        # Replaces any older version of the file
+        self._files.put(str(path), (version, parsed), stat.st_size)
+        self.misses += 1
+        return parsed, version
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, **self._files.stats()}
+
+
+report_cache = ParsedFileCache(REPORT_CACHE_BYTES)
+
+
+def validate_run_id(run_id: str) -> str:
+    """
+    Validate and sanitize run_id to prevent path traversal attacks.
+    
+    Security: This function provides defense-in-depth against path injection:
+    1. Strict UUID format validation (8-4-4-4-12 hex pattern)
+    
+    Only allows UUID format (alphanumeric and hyphens).
+    
+    Note: CodeQL may flag uses of validated_run_id as path injection,
+    but these are false positives as the validation ensures only safe UUIDs pass.
+    
+    Args:
+        run_id: User-provided run identifier
+    
+    Returns:
+        Validated run_id string (guaranteed to be safe UUID format)
+    
+    Raises:
+        HTTPException: If run_id doesn't match UUID format
+    """
+    # Check if run_id matches UUID format (only allows hex digits and hyphens)
+    uuid_pattern = re.compile(r'^[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}$', re.IGNORECASE)
+    if not uuid_pattern.match(run_id):
+        raise HTTPException(status_code=400, detail="Invalid run_id format. Must be a valid UUID.")
+    
+    return run_id
+
+
+def _run_dir(run_id: str) -> Path:
+    """
+    Artifacts directory for an already validated run_id.
+
+    Runs are sharded by the first two hex digits of their id
+    (ARTIFACTS_DIR/ab/abcdef01-...), so no directory holds more than about
+    1/256 of them. Runs created before sharding stay at ARTIFACTS_DIR/<run_id>.
+    """
+    sharded = ARTIFACTS_DIR / run_id[:2].lower() / run_id
+    if not sharded.exists():
+        legacy = ARTIFACTS_DIR / run_id
+        if legacy.exists():
+            return legacy
+    return sharded
+
+
+def _dir_bytes(path: Path) -> int:
+    """Total size of the files under ``path``"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _iter_run_dirs():
+    """Every run directory under ARTIFACTS_DIR, sharded or legacy"""
+    if not ARTIFACTS_DIR.is_dir():
+        return
+    for entry in os.scandir(ARTIFACTS_DIR):
+        if not entry.is_dir():
+            continue
+        if len(entry.name) == 2:
+            for run in os.scandir(entry.path):
+                # Skips runs left half-removed as .{run_id}.evicting
+                if run.is_dir() and not run.name.startswith("."):
+                    yield Path(run.path)
+        elif len(entry.name) == 36:
+            yield Path(entry.path)
+
+
+def check_dkil(run_id: str, threshold: float = 0.5) -> tuple[bool, dict]:
+    """
+    Check DKIL (Data Knowledge Integrity Lock) status
+    Returns: (passed, details)
+    """
+    # Validate run_id to prevent path traversal
+    validated_run_id = validate_run_id(run_id)
+    
+    artifacts_path = _run_dir(validated_run_id)
+    dkil_file = artifacts_path / "dkil_lock.json"
+    
+    try:
+        dkil_data, _ = report_cache.load(dkil_file)
+    except FileNotFoundError:
+        return False, {"error": "DKIL lock file not found"}
+    
+    # Check if integrity checks passed (threshold_met is informational)
+    passed = dkil_data.get('integrity_check', False)
+    
+    return passed, dkil_data
+
+
+def _load_results_manifest(run_id: str) -> dict:
+    """Load a run's results.json: metadata and metrics, plus the columnar data manifest"""
+    with open(_run_dir(run_id) / "results.json", 'r') as f:
+        return json.load(f)
+
+
+def _load_profile(run_id: str) -> dict:
+    """Load a profiled run's profile/profile.json summary"""
+    with open(_run_dir(run_id) / "profile" / "profile.json", 'r') as f:
+        return json.load(f)
+
+
+def _load_results(run_id: str, encoded_data: bool = True, arrays: bool = False) -> dict:
+    """
+    Load a run's results in the report shape, with predictions and encoded_data inline.
+
+    ``encoded_data=False`` skips rebuilding the row records; ``arrays`` is
+    passed on to ``_report_payload``.
+    """
+    results = _load_results_manifest(run_id)
+    fields = None if encoded_data else (set(results) | {"predictions"}) - {"data", "encoded_data"}
+    return _report_payload(run_id, results, fields, arrays=arrays)
+
+
+def _report_payload(
+    run_id: str,
+    results: dict,
+    fields: Optional[set] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    arrays: bool = False
+) -> dict:
+    """
+    Build the report for a parsed results.json without modifying it.
+
+    ``fields`` keeps only those top-level keys; predictions and encoded_data
+    are only read when kept, and only the ``offset``/``limit`` row range.
+    With ``arrays`` they are left as a float64 array and a DataFrame for
+    ``encode_response`` instead of being converted to lists and records.
+    Runs written before the columnar format keep everything in results.json.
+    """
+    report = {key: value for key, value in results.items()
+              if key != "data" and (fields is None or key in fields)}
+    want_predictions = fields is None or "predictions" in fields
+    want_rows = fields is None or "encoded_data" in fields
+    stop = None if limit is None else offset + limit
+    
+    data = results.get("data")
+    if data is not None:
+        if want_predictions or want_rows:
+            df, predictions = read_columns(run_id, data, None if want_rows else [], offset, limit)
+            if want_predictions:
+                report["predictions"] = np.asarray(predictions) if arrays else predictions.tolist()
+            if want_rows:
+                report["encoded_data"] = df if arrays else df.to_dict(orient='records')
+        rows = data["rows"]
+    else:
+        for key in ("predictions", "encoded_data"):
+            if key in report:
+                report[key] = report[key][offset:stop]
+        rows = len(results.get("predictions", []))
+    
+    if offset or limit is not None:
+        report["page"] = {"offset": offset, "limit": limit, "rows": rows}
+    return report
+
+
+# Columnar Artifacts
+RESULTS_DATA_FORMAT = "npy-columns/1"
+
+
+def _save_npy_atomic(path: Path, values: np.ndarray):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        np.save(f, values, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def write_columns(run_artifacts_dir: Path, df: pd.DataFrame, predictions) -> dict:
+    """
+    Write a run's encoded data and predictions column by column.
+
+    Files go to a fresh data/<generation>/ directory, so readers of the
+    previous generation (including memory maps) are unaffected until
+    results.json points at the new one. Numeric, boolean and datetime
+    columns are stored as .npy files that can be memory-mapped; other
+    columns as JSON lists. Returns the ``data`` manifest for results.json.
+    """
+    generation = uuid.uuid4().hex[:12]
+    data_dir = run_artifacts_dir / "data" / generation
+    data_dir.mkdir(parents=True)
+    
+    columns = []
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM":
+            file_name = f"c{i:04d}.npy"
+            _save_npy_atomic(data_dir / file_name, series.to_numpy())
+        elif pd.api.types.is_numeric_dtype(series):
+            file_name = f"c{i:04d}.npy"
+            _save_npy_atomic(data_dir / file_name, series.to_numpy(dtype=np.float64, na_value=np.nan))
+        else:
+            file_name = f"c{i:04d}.json"
+            with open(data_dir / file_name, 'w') as f:
+                json.dump(series.tolist(), f, default=str)
+        columns.append({"name": name, "file": file_name, "dtype": str(series.dtype)})
+    _save_npy_atomic(data_dir / "predictions.npy", np.asarray(predictions, dtype=np.float64))
+    
+    return {
+        "format": RESULTS_DATA_FORMAT,
+        "path": f"data/{generation}",
+        "rows": len(df),
+        "columns": columns,
+        "predictions": "predictions.npy"
+    }
+
+
+def read_columns(
+    run_id: str,
+    data: dict,
+    columns: Optional[list] = None,
+    offset: int = 0,
+    limit: Optional[int] = None
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Read a run's encoded data and predictions from its columnar files.
+
+    .npy columns are memory-mapped, so selecting ``columns`` or a row range
+    (``offset``/``limit``) only reads the pages it needs.
+    """
+    data_dir = _run_dir(run_id) / data["path"]
+    stop = None if limit is None else offset + limit
+    frame = {}
+    for column in data["columns"]:
+        if columns is not None and column["name"] not in columns:
+            continue
+        path = data_dir / column["file"]
+        if column["file"].endswith(".npy"):
+            frame[column["name"]] = np.load(path, mmap_mode='r')[offset:stop]
+        else:
+            with open(path, 'r') as f:
+                frame[column["name"]] = json.load(f)[offset:stop]
+    predictions = np.load(data_dir / data["predictions"], mmap_mode='r')[offset:stop]
+    return pd.DataFrame(frame), predictions
+
+
+def _store_columns(run_id: Optional[str], computed: dict) -> dict:
+    """
+    Write the encoded data where it was computed, so the analysis worker
+    does not ship the whole frame back to the API process.
+    """
+    if run_id is not None:
+        mark_stage(run_id, "artifacts", len(computed["df_encoded"]))
+        df_encoded = computed.pop("df_encoded")
+        computed["data"] = write_columns(_run_dir(run_id), df_encoded, computed["predictions"])
+    return computed
+
+
+def _remove_stale_data(run_artifacts_dir: Path, current: str):
+    """Delete data generations other than ``current`` (e.g. superseded by an append)"""
+    data_root = run_artifacts_dir / "data"
+    for generation in data_root.iterdir():
+        if f"data/{generation.name}" != current:
+            shutil.rmtree(generation, ignore_errors=True)
+
+
+# Run Bundles
+BUNDLE_COMPRESSION_TYPES = {"deflate": zipfile.ZIP_DEFLATED, "stored": zipfile.ZIP_STORED}
+# ZipFile.open() takes a member's level from its ZipInfo, not the archive.
+# Before Python 3.13 (public compress_level) that is the private
+# _compresslevel attribute; this relies on it so members keep their file
+# mtime and mode, which opening a member by name would replace with the
+# current time. test_bundle_streamed_on_request catches a level ignored.
+_ZIPINFO_LEVEL_ATTR = "compress_level" if hasattr(zipfile.ZipInfo, "compress_level") else "_compresslevel"
+
+
+def _bundle_files(run_artifacts_dir: Path) -> list[tuple[Path, str, os.stat_result]]:
+    """Files that go into a run's bundle as (path, archive name, stat), in archive order"""
+    files = []
+    for path in sorted(run_artifacts_dir.rglob('*')):
+        relative = path.relative_to(run_artifacts_dir)
+        if (path.name.startswith('.') or path.name in ('bundle.zip', 'status.json')
+                or relative.parts[0] == 'profile' or not path.is_file()):
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((path, relative.as_posix(), stat))
+    return files
+
+
+def bundle_key(files: list, compression: str, level: int) -> str:
+    """Identity of a bundle: its files' names, sizes and mtimes plus the compression settings"""
+    digest = hashlib.sha256(json.dumps([compression, level]).encode())
+    for _, arcname, stat in files:
+        digest.update(f"{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    return digest.hexdigest()[:32]
+
+
+class _ZipSink:
+    """Write-only, unseekable file object that collects zipfile output for a generator to drain"""
+
+    def __init__(self):
+        self._parts: list = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def stream_bundle(files: list, compression: str = BUNDLE_COMPRESSION, level: int = BUNDLE_COMPRESSLEVEL):
+    """
+    Generate a zip of ``files`` as it is compressed.
+
+    The archive is written to an unseekable sink, so sizes and CRCs go into
+    data descriptors after each member and no member is held in memory
+    beyond one BUNDLE_CHUNK_BYTES read.
+    """
+    compress_type = BUNDLE_COMPRESSION_TYPES[compression]
+    sink = _ZipSink()
+    if compress_type != zipfile.ZIP_DEFLATED:
+        level = None
+    with zipfile.ZipFile(sink, 'w', compress_type, compresslevel=level) as zipf:
+        for path, arcname, _ in files:
+            try:
+                src = open(path, 'rb')
+            except FileNotFoundError:
+                # Replaced by a newer data generation while the bundle was streamed
+                continue
+            stat = os.fstat(src.fileno())
+            info = zipfile.ZipInfo(arcname, time.localtime(stat.st_mtime)[:6])
+            info.external_attr = (stat.st_mode & 0xFFFF) << 16
+            info.file_size = stat.st_size
+            info.compress_type = compress_type
+            setattr(info, _ZIPINFO_LEVEL_ATTR, level)
+            with src, zipf.open(info, 'w') as dst:
+                while chunk := src.read(BUNDLE_CHUNK_BYTES):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+class BundleCache:
+    """
+    Optional disk cache of finished bundles, bounded by their total size.
+
+    Bundles are named by run and ``bundle_key``, so any change to a run's
+    files (an append, a deployment) produces a new bundle. The least
+    recently served bundles are removed first.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max(0, max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, run_id: str, key: str) -> Path:
+        return self.cache_dir / f"{run_id}-{key}.zip"
+
+    def lookup(self, run_id: str, key: str) -> Optional[Path]:
+        path = self._path(run_id, key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def stream_and_store(self, run_id: str, key: str, chunks):
+        """Pass ``chunks`` through, keeping a copy that is published once the stream completes"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(run_id, key)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+            self._trim()
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _trim(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".zip"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses, "max_bytes": self.max_bytes}
+
+
+bundle_cache = BundleCache(CACHE_DIR / "bundles", BUNDLE_CACHE_BYTES)
+
+
+# Run Catalogue
+class RunCatalogue:
+    """
+    SQLite index of runs for listing and search without touching run directories.
+
+    One row per run holds its status, deployment, DKIL threshold and
+    headline metrics; filtered listings use the indexes and keyset
+    pagination, so a page costs the same at any depth. The database uses
+    WAL, so several server processes can share it. A catalogue created
+    next to existing runs is backfilled from their results.json files.
+    """
+
+    METRICS = (
+        "rows", "mean_prediction", "std_prediction", "min_prediction", "max_prediction",
+        "samples_below_threshold", "ra_mean", "ra_std"
+    )
+    # Metric ranges holding fewer rows than this are read through their index
+    RANGE_PROBE_ROWS = 5000
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            threshold_met INTEGER,
+            deployed INTEGER NOT NULL DEFAULT 0,
+            deployed_at TEXT,
+            model_name TEXT,
+            rows INTEGER,
+            mean_prediction REAL,
+            std_prediction REAL,
+            min_prediction REAL,
+            max_prediction REAL,
+            samples_below_threshold INTEGER,
+            ra_mean REAL,
+            ra_std REAL,
+            bytes INTEGER,
+            last_read_at TEXT
+        );
+    """
+    # Columns added after the first catalogue release, as (name, type)
+    ADDED_COLUMNS = (("bytes", "INTEGER"), ("last_read_at", "TEXT"))
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS runs_created ON runs (created_at, run_id);
+        CREATE INDEX IF NOT EXISTS runs_deployed ON runs (deployed, created_at, run_id);
+        CREATE INDEX IF NOT EXISTS runs_threshold ON runs (threshold_met, created_at, run_id);
+        CREATE INDEX IF NOT EXISTS runs_status ON runs (status, created_at, run_id);
+        DROP INDEX IF EXISTS runs_last_read;
+        CREATE INDEX IF NOT EXISTS runs_eviction ON runs (deployed, COALESCE(last_read_at, created_at), run_id);
+    """ + "".join(f"CREATE INDEX IF NOT EXISTS runs_{name} ON runs ({name});" for name in METRICS)
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            created = not self.path.exists()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(runs)")}
+            for name, kind in self.ADDED_COLUMNS:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE runs ADD COLUMN {name} {kind}")
+            conn.executescript(self.INDEXES)
+            if created and ARTIFACTS_DIR.exists():
+                self._backfill(conn)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def record_run(self, run_id: str, results: dict, dkil_data: Optional[dict] = None, size: Optional[int] = None):
+        """Insert or refresh a finished run from its results (and DKIL lock) and its size on disk"""
+        with self._lock:
+            self._upsert_run(self._connect(), run_id, results, dkil_data, size)
+
+    @staticmethod
+    def _upsert_run(
+        conn: sqlite3.Connection,
+        run_id: str,
+        results: dict,
+        dkil_data: Optional[dict],
+        size: Optional[int]
+    ):
+        ldrop = results.get("ldrop_metrics", {})
+        deltas = results.get("ra_score_deltas", {})
+        data = results.get("data")
+        rows = data["rows"] if data is not None else len(results.get("predictions", []))
+        threshold_met = None if dkil_data is None else int(bool(dkil_data.get("threshold_met")))
+        conn.execute("""
+            INSERT INTO runs (run_id, status, created_at, updated_at, threshold_met, rows,
+                              mean_prediction, std_prediction, min_prediction, max_prediction,
+                              samples_below_threshold, ra_mean, ra_std, bytes)
+            VALUES (?, 'done', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (run_id) DO UPDATE SET bytes = excluded.bytes,
+                status = 'done', updated_at = excluded.updated_at, threshold_met = excluded.threshold_met,
+                rows = excluded.rows, mean_prediction = excluded.mean_prediction,
+                std_prediction = excluded.std_prediction, min_prediction = excluded.min_prediction,
+                max_prediction = excluded.max_prediction,
+                samples_below_threshold = excluded.samples_below_threshold,
+                ra_mean = excluded.ra_mean, ra_std = excluded.ra_std
+        """, (
+            run_id, results["timestamp"], results["timestamp"], threshold_met, rows,
+            ldrop.get("mean_prediction"), ldrop.get("std_prediction"), ldrop.get("min_prediction"),
+            ldrop.get("max_prediction"), ldrop.get("samples_below_threshold"),
+            deltas.get("ra_mean"), deltas.get("ra_std"), size
+        ))
+
+    def record_failure(self, run_id: str):
+        now = datetime.now(timezone.utc).isoformat()
+        self._execute("""
+            INSERT INTO runs (run_id, status, created_at, updated_at) VALUES (?, 'failed', ?, ?)
+            ON CONFLICT (run_id) DO UPDATE SET status = 'failed', updated_at = excluded.updated_at
+        """, (run_id, now, now))
+
+    def record_deployment(self, run_id: str, deployment: dict):
+        self._execute(
+            "UPDATE runs SET deployed = 1, deployed_at = ?, model_name = ? WHERE run_id = ?",
+            (deployment["deployed_at"], deployment["model_name"], run_id)
+        )
+
+    def forget(self, run_id: str):
+        self._execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    def record_reads(self, reads: dict):
+        """Store last-read times ({run_id: ISO time}) collected in memory"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            conn.executemany("UPDATE runs SET last_read_at = ? WHERE run_id = ?",
+                             [(read_at, run_id) for run_id, read_at in reads.items()])
+            conn.execute("COMMIT")
+
+    def usage(self) -> tuple[int, int]:
+        """(runs, bytes) recorded in the catalogue"""
+        runs, size = self._execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM runs")[0]
+        return runs, size
+
+    def eviction_candidates(
+        self,
+        older_than: Optional[str] = None,
+        after: Optional[tuple[str, str]] = None,
+        limit: int = 256
+    ) -> list[dict]:
+        """
+        Undeployed runs, least recently read (or created, if never read) first.
+
+        With ``older_than``, only runs created before that time. ``after`` is
+        the (read_at, run_id) of the last candidate of the previous page.
+        """
+        clauses, params = ["deployed = 0"], []
+        if older_than is not None:
+            clauses.append("created_at < ?")
+            params.append(older_than)
+        if after is not None:
+            clauses.append("(COALESCE(last_read_at, created_at), run_id) > (?, ?)")
+            params.extend(after)
+        rows = self._execute(
+            f"SELECT run_id, bytes, created_at, COALESCE(last_read_at, created_at) AS read_at FROM runs "
+            f"WHERE {' AND '.join(clauses)} ORDER BY COALESCE(last_read_at, created_at), run_id LIMIT ?",
+            (*params, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def list_runs(
+        self,
+        created_after: Optional[str] = None,
+        created_before: Optional[str] = None,
+        status: Optional[str] = None,
+        deployed: Optional[bool] = None,
+        threshold_met: Optional[bool] = None,
+        metric_ranges: Optional[dict] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> tuple[list[dict], Optional[str]]:
+        """
+        Runs matching every given filter, newest first.
+
+        ``metric_ranges`` maps a METRICS column to a (low, high) pair, either
+        bound may be None. Returns the page and the cursor of the next page.
+        """
+        clauses, params = [], []
+        if created_after is not None:
+            clauses.append("created_at >= ?")
+            params.append(created_after)
+        if created_before is not None:
+            clauses.append("created_at < ?")
+            params.append(created_before)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if deployed is not None:
+            clauses.append("deployed = ?")
+            params.append(int(deployed))
+        if threshold_met is not None:
+            clauses.append("threshold_met = ?")
+            params.append(int(threshold_met))
+        ranges = []
+        for name, (low, high) in (metric_ranges or {}).items():
+            if name not in self.METRICS:
+                raise ValueError(f"Unknown metric '{name}'")
+            bounds = ([f"{{}} >= ?"] if low is not None else []) + ([f"{{}} <= ?"] if high is not None else [])
+            values = [bound for bound in (low, high) if bound is not None]
+            ranges.append((name, bounds, values))
+        
+        # A narrow metric range is best read through its index and sorted; a
+        # wide one by walking runs newest first and filtering. SQLite keeps no
+        # value histograms, so probe how many rows each range holds. The unary
+        # + keeps the planner off the metric indexes for wide ranges
+        selective = any(self._range_rows(name, bounds, values) < self.RANGE_PROBE_ROWS
+                        for name, bounds, values in ranges)
+        for name, bounds, values in ranges:
+            column = name if selective else f"+{name}"
+            clauses.extend(bound.format(column) for bound in bounds)
+            params.extend(values)
+        if cursor is not None:
+            created_at, run_id = self._decode_cursor(cursor)
+            clauses.append("(created_at, run_id) < (?, ?)")
+            params.extend([created_at, run_id])
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._execute(
+            f"SELECT * FROM runs {where} ORDER BY created_at DESC, run_id DESC LIMIT ?",
+            (*params, limit + 1)
+        )
+        runs = [dict(row) for row in rows[:limit]]
+        for run in runs:
+            run["deployed"] = bool(run["deployed"])
+            if run["threshold_met"] is not None:
+                run["threshold_met"] = bool(run["threshold_met"])
+        next_cursor = self._encode_cursor(runs[-1]) if len(rows) > limit else None
+        return runs, next_cursor
+
+    def _range_rows(self, name: str, bounds: list, values: list) -> int:
+        """Rows in a metric range, counted up to RANGE_PROBE_ROWS through the metric's index"""
+        if not bounds:
+            return self.RANGE_PROBE_ROWS
+        where = " AND ".join(bound.format(name) for bound in bounds)
+        return self._execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM runs WHERE {where} LIMIT ?)", (*values, self.RANGE_PROBE_ROWS)
+        )[0][0]
+
+    @staticmethod
+    def _encode_cursor(run: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps([run["created_at"], run["run_id"]]).encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple[str, str]:
+        try:
+            created_at, run_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
+        return str(created_at), str(run_id)
+
+    def count(self) -> int:
+        return self._execute("SELECT COUNT(*) FROM runs")[0][0]
+
+    def _backfill(self, conn: sqlite3.Connection):
+        """Index runs that were written before the catalogue existed"""
+        conn.execute("BEGIN")
+        try:
+            for run_dir in _iter_run_dirs():
+                try:
+                    with open(run_dir / "results.json", 'r') as f:
+                        results = json.load(f)
+                    dkil_path = run_dir / "dkil_lock.json"
+                    dkil_data = json.loads(dkil_path.read_text()) if dkil_path.exists() else None
+                    deployment_path = run_dir / "deployment.json"
+                    deployment = json.loads(deployment_path.read_text()) if deployment_path.exists() else None
+                except (OSError, ValueError):
+                    continue
+                self._upsert_run(conn, run_dir.name, results, dkil_data, _dir_bytes(run_dir))
+                if deployment is not None:
+                    conn.execute(
+                        "UPDATE runs SET deployed = 1, deployed_at = ?, model_name = ? WHERE run_id = ?",
+                        (deployment.get("deployed_at"), deployment.get("model_name"), run_dir.name)
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+run_catalogue = RunCatalogue(RUN_CATALOGUE_PATH)
+
+
+def _update_catalogue(method, *args):
+    """Apply a catalogue update; run directories stay the source of truth if it fails"""
+    try:
+        method(*args)
+    except sqlite3.Error:
+        pass
+
+
+# Artifact Retention
+class ArtifactRetention:
+    """
+    Size- and age-bounded retention of run directories.
+
+    Reads are noted in memory (``touch``) and written to the run catalogue
+    in one batch per pass. A pass removes undeployed runs created more than
+    ``max_age`` seconds ago, then undeployed runs in least-recently-read
+    order until the catalogued runs fit in ``max_bytes``. Runs with a
+    deployment.json, and runs that are queued or running, are never
+    removed. Passes run on a daemon thread at the lowest CPU priority and
+    pause between deletions, so request handling is not stalled. With
+    ``evict`` off a pass only records reads; the production server evicts
+    from one worker only.
+    """
+
+    def __init__(self, max_bytes: int, max_age: float, interval: float):
+        self.max_bytes = max(0, max_bytes)
+        self.max_age = max(0.0, max_age)
+        self.interval = max(1.0, interval)
+        self.evict = True
+        self._reads: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.usage_bytes = 0
+        self.runs = 0
+        self.passes = 0
+        self.evicted_runs = 0
+        self.reclaimed_bytes = 0
+        self.skipped_runs = 0
+        self.last_pass_at: Optional[str] = None
+        self.last_pass_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.max_age > 0
+
+    def touch(self, run_id: str):
+        """Note that a run was read; cheap enough for every request"""
+        self._reads[run_id] = datetime.now(timezone.utc).isoformat()
+
+    def start(self):
+        if self.enabled and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="artifact-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            # Only this thread is deprioritised; on Linux a thread id is a valid PRIO_PROCESS target
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.wait(self.interval):
+            try:
+                self.collect()
+            except (OSError, sqlite3.Error):
+                # Try again on the next pass
+                pass
+
+    def collect(self, pause: float = 0.01):
+        """Run one retention pass"""
+        started = time.monotonic()
+        reads, self._reads = self._reads, {}
+        if reads:
+            run_catalogue.record_reads(reads)
+        
+        if self.evict and self.max_age > 0:
+            cutoff = datetime.fromtimestamp(time.time() - self.max_age, timezone.utc).isoformat()
+            for candidate in self._candidates(older_than=cutoff):
+                self._evict_candidate(candidate, pause)
+        
+        self.runs, self.usage_bytes = run_catalogue.usage()
+        if self.evict and self.max_bytes > 0 and self.usage_bytes > self.max_bytes:
+            for candidate in self._candidates():
+                if self._evict_candidate(candidate, pause):
+                    self.usage_bytes -= candidate["bytes"] or 0
+                if self.usage_bytes <= self.max_bytes:
+                    break
+            self.runs, self.usage_bytes = run_catalogue.usage()
+        
+        self.passes += 1
+        self.last_pass_at = datetime.now(timezone.utc).isoformat()
+        self.last_pass_seconds = time.monotonic() - started
+
+    def _candidates(self, older_than: Optional[str] = None):
+        """
+        Every eviction candidate in least-recently-read order, a page at a time.
+
+        Paging continues past runs that cannot be removed (deployed on disk
+        but not yet in the catalogue, queued or running), so they never hide
+        the evictable runs behind them.
+        """
+        after = None
+        while not self._stop.is_set():
+            page = run_catalogue.eviction_candidates(older_than=older_than, after=after)
+            yield from page
+            if not page:
+                return
+            after = (page[-1]["read_at"], page[-1]["run_id"])
+
+    def _evict_candidate(self, candidate: dict, pause: float) -> bool:
+        """Remove one run; returns whether its catalogue entry was dropped"""
+        run_id = candidate["run_id"]
+        dropped = True
+        if self._evict(run_id):
+            self.evicted_runs += 1
+            self.reclaimed_bytes += candidate["bytes"] or 0
+        elif not _run_dir(run_id).exists():
+            # Removed by hand; just drop the stale entry
+            run_catalogue.forget(run_id)
+        else:
+            self.skipped_runs += 1
+            dropped = False
+        if pause:
+            time.sleep(pause)
+        return dropped
+
+    def _evict(self, run_id: str) -> bool:
+        run_artifacts_dir = _run_dir(run_id)
+        if not run_artifacts_dir.exists() or (run_artifacts_dir / "deployment.json").exists():
+            return False
+        status = read_run_status(run_id)
+        if status is not None and status["status"] in ("queued", "running"):
+            return False
+        # Rename first so readers see the whole run disappear at once
+        doomed = run_artifacts_dir.with_name(f".{run_id}.evicting")
+        try:
+            os.replace(run_artifacts_dir, doomed)
+        except OSError:
+            return False
+        run_catalogue.forget(run_id)
+        shutil.rmtree(doomed, ignore_errors=True)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "evict": self.evict,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+            "usage_bytes": self.usage_bytes,
+            "runs": self.runs,
+            "passes": self.passes,
+            "evicted_runs": self.evicted_runs,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "skipped_runs": self.skipped_runs,
+            "last_pass_at": self.last_pass_at,
+            "last_pass_seconds": self.last_pass_seconds,
+        }
+
+
+artifact_retention = ArtifactRetention(RETENTION_MAX_BYTES, RETENTION_MAX_AGE_SECONDS, RETENTION_INTERVAL_SECONDS)
+
+
+# Artifact Writer
+class ArtifactWriter:
+    """
+    Asynchronous, atomic writer for run artifacts.
+
+    Every file is written to a temp file and renamed into place, so readers
+    see the old or the new contents, never a partial file. ``durable``
+    writes are written with aiofiles and the caller waits until they are
+    fsynced and renamed; other writes go to a write-behind queue and the
+    caller does not wait at all.
+
+    Renames, write-behind writes and fsyncs run on one writer thread, which
+    takes everything queued since its last pass as a batch: the batch's
+    files are fsynced together and each directory is fsynced once. The
+    thread is independent of any event loop, so queued writes also finish
+    when the request's loop does not outlive the response.
+    """
+
+    def __init__(self, fsync: bool = True):
+        self.fsync = fsync
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[Path, Future] = {}
+        self.durable_writes = 0
+        self.behind_writes = 0
+        self.batches = 0
+        self.batched_files = 0
+        self.failed = 0
+
+    def _submit(self, item: tuple) -> Future:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+                self._thread.start()
+        self._queue.put(item)
+        return item[-1]
+
+    async def write(self, path: Path, data, durable: bool = True):
+        """
+        Write ``data`` (str or bytes) to ``path`` atomically.
+
+        Durable writes return once the file is in place (and fsynced when
+        ARTIFACT_FSYNC is on); others return immediately.
+        """
+        if not durable:
+            self.behind_writes += 1
+            future = self._submit(("write", path, data, Future()))
+            self._pending[path] = future
+            future.add_done_callback(lambda f, path=path: self._forget(path, f))
+            return
+        
+        self.durable_writes += 1
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            async with aiofiles.open(tmp_path, 'wb' if isinstance(data, bytes) else 'w') as f:
+                await f.write(data)
+            await asyncio.wrap_future(self._submit(("commit", tmp_path, path, Future())))
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    async def write_json(self, path: Path, data: dict, durable: bool = True):
+        await self.write(path, json.dumps(data, indent=2), durable)
+
+    async def flush(self, path: Path):
+        """Wait for a queued write-behind of ``path``, if there is one"""
+        future = self._pending.get(path)
+        if future is not None:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                pass
+
+    def _forget(self, path: Path, future: Future):
+        if self._pending.get(path) is future:
+            del self._pending[path]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is None for item in batch)
+            batch = [item for item in batch if item is not None]
+            if batch:
+                self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch: list):
+        """Write and rename one batch in submission order, with one fsync pass"""
+        done = []
+        directories = set()
+        for kind, *args, future in batch:
+            try:
+                if kind == "write":
+                    path, data = args
+                    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+                    with open(tmp_path, 'wb' if isinstance(data, bytes) else 'w') as f:
+                        f.write(data)
+                else:
+                    tmp_path, path = args
+                    if self.fsync:
+                        fd = os.open(tmp_path, os.O_RDONLY)
+                        try:
+                            os.fsync(fd)
+                        finally:
+                            os.close(fd)
+                        directories.add(path.parent)
+                os.replace(tmp_path, path)
+                done.append(future)
+            except Exception as e:
+                self.failed += 1
+                future.set_exception(e)
+        
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                # Not every platform or filesystem can fsync a directory
+                pass
+        self.batches += 1
+        self.batched_files += len(batch)
+        for future in done:
+            future.set_result(None)
+
+    def close(self):
+        """Finish everything queued and stop the writer thread"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "durable_writes": self.durable_writes,
+            "write_behind": self.behind_writes,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "files_per_batch": self.batched_files / self.batches if self.batches else 0.0,
+            "failed": self.failed,
+            "fsync": self.fsync,
+        }
+
+
+artifact_writer = ArtifactWriter(ARTIFACT_FSYNC)
+
+
+# Run Status
+def _write_json_atomic(path: Path, data: dict):
+    """Write JSON via a temp file and rename so readers never see a partial file"""
+    # Unique per call: status updates, analysis I/O threads and the cache all write here
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_run_status(run_id: str) -> Optional[dict]:
+    """Load a run's status.json, or None for runs without one"""
+    status_file = _run_dir(run_id) / "status.json"
+    if not status_file.exists():
+        return None
+    with open(status_file, 'r') as f:
+        return json.load(f)
+
+
+def update_run_status(run_id: str, **changes) -> dict:
+    """
+    Merge ``changes`` into a run's status.json.
+
+    Called from both the API process and analysis workers, which never
+    update the same run concurrently.
+    """
+    status = read_run_status(run_id) or {
+        "run_id": run_id,
+        "status": "queued",
+        "stage": None,
+        "stages": {stage: "pending" for stage in ANALYSIS_STAGES},
+        "progress": 0.0,
+        "submitted_at": datetime.now(timezone.utc).isoformat(),
+    }
+    status.update(changes)
+    _write_json_atomic(_run_dir(run_id) / "status.json", status)
+    return status
+
+
+def mark_stage(run_id: Optional[str], stage: str, rows: Optional[int] = None):
+    """Record that ``stage`` started; earlier stages are marked done"""
+    clock_stage(stage, rows)
+    if run_id is None:
+        return
+    status = read_run_status(run_id)
+    if status is None:
+        return
+    stages = status["stages"]
+    index = ANALYSIS_STAGES.index(stage)
+    for earlier in ANALYSIS_STAGES[:index]:
+        stages[earlier] = "done"
+    stages[stage] = "running"
+    update_run_status(run_id, status="running", stage=stage, stages=stages,
+                      progress=index / len(ANALYSIS_STAGES))
+
+
+# Response Encoding
+JSON_MEDIA_TYPE = "application/json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Accept media ranges and the response format each one selects
+RESPONSE_MEDIA_TYPES = {
+    "*/*": JSON_MEDIA_TYPE,
+    "application/*": JSON_MEDIA_TYPE,
+    "application/json": JSON_MEDIA_TYPE,
+    "application/vnd.apache.arrow.stream": ARROW_MEDIA_TYPE,
+    "application/msgpack": MSGPACK_MEDIA_TYPE,
+    "application/x-msgpack": MSGPACK_MEDIA_TYPE,
+    "application/vnd.msgpack": MSGPACK_MEDIA_TYPE,
+}
+# Optional library each binary format needs
+RESPONSE_FORMAT_MODULES = {ARROW_MEDIA_TYPE: "pyarrow", MSGPACK_MEDIA_TYPE: "msgpack"}
+
+# Response fields that hold per-row arrays
+ARRAY_FIELDS = ("predictions", "encoded_data")
+
+
+@functools.lru_cache(maxsize=None)
+def _optional_module(name: str):
+    """Import an optional dependency on first use, or None if it is not installed"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """
+    The response format for an Accept header.
+
+    The supported type with the highest q-value wins, the earliest listed
+    on ties. Binary formats whose library is not installed are skipped.
+    Raises 406 when nothing acceptable is left.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    
+    best, best_q = None, 0.0
+    for item in accept.split(","):
+        media_range, *params = item.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media_type = RESPONSE_MEDIA_TYPES.get(media_range.strip().lower())
+        if media_type is None or q <= best_q:
+            continue
+        module = RESPONSE_FORMAT_MODULES.get(media_type)
+        if module is not None and _optional_module(module) is None:
+            continue
+        best, best_q = media_type, q
+    
+    if best is None:
+        available = [JSON_MEDIA_TYPE] + [media_type for media_type, module in RESPONSE_FORMAT_MODULES.items()
+                                         if _optional_module(module) is not None]
+        raise HTTPException(status_code=406, detail=f"Supported response types: {', '.join(available)}")
+    return best
+
+
+async def response_media_type(accept: Optional[str] = Header(None)) -> str:
+    """Negotiated response format of an endpoint answering with ``encode_response``"""
+    return negotiate_media_type(accept)
+
+
+def encode_response(
+    content: dict,
+    media_type: str = JSON_MEDIA_TYPE,
+    status_code: int = 200,
+    headers: Optional[dict] = None
+) -> Response:
+    """
+    Serialise a response in the negotiated format, bypassing response-model validation.
+
+    ``predictions`` may be a float array and ``encoded_data`` a DataFrame;
+    neither is converted to Python lists first.
+    - JSON: orjson (when installed) writes arrays straight from their buffers
+    - Arrow IPC stream: one record batch with the encoded_data columns and
+      ``predictions``; the other fields are JSON in the schema metadata under "fields"
+    - MessagePack: ``predictions`` is little-endian float64 bytes and each
+      numeric encoded_data column a {"dtype", "data"} buffer
+    """
+    if media_type == JSON_MEDIA_TYPE:
+        body = _dumps_json(content)
+    else:
+        predictions = content.get("predictions")
+        if predictions is not None:
+            predictions = np.asarray(predictions, dtype=np.float64)
+        rows = content.get("encoded_data")
+        if rows is not None and not isinstance(rows, pd.DataFrame):
+            # Runs from before the columnar format store row records
+            rows = pd.DataFrame(rows)
+        fields = {key: value for key, value in content.items() if key not in ARRAY_FIELDS}
+        encode = _encode_arrow if media_type == ARROW_MEDIA_TYPE else _encode_msgpack
+        body = encode(fields, predictions, rows)
+    return Response(body, status_code=status_code, media_type=media_type, headers=headers)
+
+
+def _json_default(value):
+    if isinstance(value, pd.DataFrame):
+        return value.to_dict(orient='records')
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _dumps_json(content) -> bytes:
+    orjson = _optional_module("orjson")
+    if orjson is None:
+        return json.dumps(content, default=_json_default).encode()
+    # NaN is written as null
+    return orjson.dumps(content, default=_json_default,
+                        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def _encode_arrow(fields: dict, predictions: Optional[np.ndarray], rows: Optional[pd.DataFrame]) -> bytes:
+    pa = _optional_module("pyarrow")
+    if rows is not None:
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        if predictions is not None:
+            table = table.append_column("predictions", pa.array(predictions))
+    else:
+        table = pa.table({} if predictions is None else {"predictions": predictions})
+    table = table.replace_schema_metadata({"fields": _dumps_json(fields)})
+    
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_msgpack(fields: dict, predictions: Optional[np.ndarray], rows: Optional[pd.DataFrame]) -> bytes:
+    msgpack = _optional_module("msgpack")
+    content = dict(fields)
+    if predictions is not None:
+        content["predictions"] = predictions.astype('<f8', copy=False).tobytes()
+    if rows is not None:
+        content["encoded_data"] = {str(name): _msgpack_column(rows[name]) for name in rows.columns}
+    return msgpack.packb(content, default=_json_default, use_bin_type=True)
+
+
+def _msgpack_column(column: pd.Series):
+    """A numeric column as a typed little-endian buffer; other columns as a list"""
+    values = column.to_numpy()
+    if values.dtype.kind not in "biuf":
+        return column.tolist()
+    values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+    return {"dtype": values.dtype.str, "data": np.ascontiguousarray(values).tobytes()}
+
+
+# Endpoints
+
+@app.get("/")
+async def root():
+    """Root endpoint - API information"""
+    return {
+        "service": "RA Longevity MLOps API",
+        "version": "1.0.0",
+        "endpoints": {
+            "analyze": "POST /api/longevity/analyze",
+            "report": "GET /api/longevity/report/{run_id}",
+            "status": "GET /api/longevity/status/{run_id}",
+            "append": "POST /api/longevity/append/{run_id}",
+            "deploy": "POST /api/longevity/deploy",
+            "predict": "POST /api/longevity/predict/{run_id}",
+            "runs": "GET /api/longevity/runs",
+            "stats": "GET /api/longevity/stats",
+            "metrics": "GET /metrics"
+        }
+    }
+
+
+@app.get("/api/longevity/stats")
+async def get_stats(token: str = Depends(verify_token)):
+    """
+    Runtime statistics for the service
+    - Analysis worker pool queue depth and utilisation
+    - Job scheduler occupancy
+    - Admission control slots, reserved memory, waits and shed requests
+    - Analysis cache hit/miss counters and memory use
+    - Deployed model pool occupancy
+    - Parsed report cache hits and memory use
+    - Bundle cache hits
+    - Artifact writer queue and fsync batching
+    - Artifact retention usage, evictions and reclaimed bytes
+    - Module import time and startup warm-up progress
+    - Process id and production server worker index
+    """
+    return {
+        "workers": analysis_pool.stats(),
+        "jobs": job_scheduler.stats(),
+        "admission": admission.stats(),
+        "cache": analysis_cache.stats(),
+        "models": model_pool.stats(),
+        "reports": report_cache.stats(),
+        "bundles": bundle_cache.stats(),
+        "writer": artifact_writer.stats(),
+        "retention": artifact_retention.stats(),
+        "startup": startup_warm_up.stats(),
+        "server": {"pid": os.getpid(), "worker": SERVER_WORKER}
+    }
+
+
+@app.get("/metrics")
+async def get_metrics(token: str = Depends(verify_token)):
+    """
+    Prometheus metrics in the text exposition format
+    - Latency histogram, rows and bytes per analysis stage (parse, encode,
+      train, predict, metrics, save_model, artifacts, write, bundle)
+    - Latency histogram, request count by status and response bytes per route
+    """
+    return Response(stage_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# The body is parsed by the endpoint according to its Content-Type
+ANALYZE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": AnalyzeRequest.model_json_schema()},
+            **{content_type: {"schema": {"type": "string", "format": "binary"}}
+               for content_type in ARROW_STREAM_CONTENT_TYPES + PARQUET_CONTENT_TYPES}
+        }
+    }
+}
+
+
+@app.post("/api/longevity/analyze", response_model=AnalyzeResponse, openapi_extra=ANALYZE_REQUEST_BODY)
+async def analyze_data_json(
+    request: Request,
+    job: bool = False,
+    dedupe: bool = True,
+    mode: Literal["tabular", "time_series"] = "tabular",
+    entity_column: Optional[str] = None,
+    timestamp_column: Optional[str] = None,
+    value_column: Optional[str] = None,
+    encode_columns: Optional[str] = None,
+    feature_dtype: Literal["float64", "float32"] = "float64",
+    engine: Optional[Literal["random_forest", "hist_gradient_boosting", "linear"]] = None,
+    train_threads: Optional[int] = Query(None, ge=1),
+    train_seconds: Optional[float] = Query(None, gt=0),
+    train_rows: Optional[int] = Query(None, ge=1),
+    train_sample: Optional[Literal["reservoir", "stratified", "systematic"]] = Query(None),
+    columns: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None),
+    profile: bool = Depends(profile_requested),
+    media_type: str = Depends(response_media_type),
+    token: str = Depends(verify_token)
+):
+    """
+    Analyze tabular data
+    - Accepts JSON in request body, or an Arrow IPC stream
+      (application/vnd.apache.arrow.stream) or Parquet (application/vnd.apache.parquet) body
+    - Arrow and Parquet take their options as query parameters (encode_columns
+      comma-separated) and read only the columns the analysis uses; columns=a,b
+      keeps more in the run's encoded data, columns=* keeps all
+    - Applies RA feature encoding (RA, D, M, S, LR)
+    - Returns predictions, ldrop metrics, and RA score deltas
+    - With ?job=true, returns 202 with a queued run_id to poll instead
+    - mode "time_series" with entity_column/timestamp_column encodes one series per entity
+    - Resubmitting identical data and options returns the existing run (?dedupe=false retrains)
+    - An Idempotency-Key header replays the run first created with that key
+    - ?profile=true (or X-Profile: 1) profiles the run, for tokens in PROFILE_TOKENS
+    - Accept selects JSON, Arrow IPC (application/vnd.apache.arrow.stream) or
+      MessagePack (application/msgpack); the binary formats carry predictions as one buffer
+    - engine picks random_forest, hist_gradient_boosting or linear (default: by
+      training rows); train_threads, train_seconds and train_rows budget the fit,
+      and train_sample picks how a row budget samples the training rows
+    - Admitted while it fits the CPU-slot and memory budgets, after a bounded wait;
+      otherwise 429 with Retry-After
+    """
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    if content_type in ARROW_STREAM_CONTENT_TYPES:
+        body_format = "arrow"
+    elif content_type in PARQUET_CONTENT_TYPES:
+        body_format = "parquet"
+    elif content_type == "application/json" or content_type.endswith("+json"):
+        body_format = "json"
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Type: {content_type}")
+    # Admitted on the declared length before the body is read, so waiting
+    # requests leave their bodies in the socket buffers. A job reserves its
+    # memory now, without waiting, and takes a CPU slot when it starts
+    upload_bytes = _declared_length(request)
+    body = await _read_body(request) if upload_bytes is None else None
+    ticket = _admit_analysis(estimate_analysis_memory(upload_bytes or len(body), body_format), job)
+    
+    async with ticket:
+        if body is None:
+            body = await _read_body(request)
+        if body_format != "json":
+            options = AnalysisOptions(
+                mode=mode,
+                entity_column=entity_column,
+                timestamp_column=timestamp_column,
+                value_column=value_column,
+                encode_columns=_split_names(encode_columns),
+                feature_dtype=feature_dtype,
+                engine=engine,
+                train_threads=train_threads,
+                train_seconds=train_seconds,
+                train_rows=train_rows,
+                train_sample=train_sample
+            )
+            try:
+                started = time.perf_counter()
+                df, ingest = await run_analysis_io(read_table_upload, body, content_type, options, _split_names(columns))
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Failed to read {content_type} body: {str(e)}")
+            ingest["upload_bytes"] = len(body)
+            parse = {"seconds": time.perf_counter() - started, "rows": len(df), "bytes": len(body)}
+            stage_metrics.record_stage("parse", parse["seconds"], parse["rows"], parse["bytes"])
+            metadata = {"ingest": ingest, "stages": {"parse": parse}}
+        else:
+            try:
+                # Off the event loop: a large body takes seconds to validate and frame
+                df, options = await run_analysis_io(_parse_analyze_json, body)
+            except ValidationError as e:
+                raise RequestValidationError([{**error, "loc": ("body", *error["loc"])}
+                                              for error in e.errors(include_url=False)])
+            metadata = None
+        
+        return await _process_analysis(
+            df, options, job=job, metadata=metadata, idempotency_key=idempotency_key,
+            dedupe=dedupe, profile=profile, media_type=media_type, ticket=ticket
+        )
+
+
+def _parse_analyze_json(body: bytes) -> tuple[pd.DataFrame, AnalysisOptions]:
+    request_data = AnalyzeRequest.model_validate_json(body)
+    return pd.DataFrame(request_data.data), request_data.options()
+
+
+def _split_names(value: Optional[str]) -> Optional[list[str]]:
+    """Comma-separated column names from a query parameter"""
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+@app.post("/api/longevity/analyze/csv", response_model=AnalyzeResponse)
+async def analyze_data_csv(
+    file: UploadFile = File(...),
+    job: bool = False,
+    mode: Literal["tabular", "time_series"] = "tabular",
+    entity_column: Optional[str] = None,
+    timestamp_column: Optional[str] = None,
+    value_column: Optional[str] = None,
+    engine: Optional[Literal["random_forest", "hist_gradient_boosting", "linear"]] = None,
+    train_threads: Optional[int] = Query(None, ge=1),
+    train_seconds: Optional[float] = Query(None, gt=0),
+    train_rows: Optional[int] = Query(None, ge=1),
+    train_sample: Optional[Literal["reservoir", "stratified", "systematic"]] = Query(None),
+    dedupe: bool = True,
+    idempotency_key: Optional[str] = Header(None),
+    profile: bool = Depends(profile_requested),
+    media_type: str = Depends(response_media_type),
+    token: str = Depends(verify_token)
+):
+    """
+    Analyze CSV file upload
+    - Accepts CSV file (streamed in chunks, up to MAX_UPLOAD_BYTES)
+    - Applies RA feature encoding (RA, D, M, S, LR)
+    - Returns predictions, ldrop metrics, and RA score deltas
+    - With ?job=true, returns 202 with a queued run_id to poll instead
+    - Query parameters mode, entity_column, timestamp_column and value_column
+      select time-series (panel) encoding as for JSON requests
+    - engine, train_threads, train_seconds, train_rows and train_sample choose and budget the
+      model as for JSON requests
+    - dedupe, the Idempotency-Key header, profiling, Accept and admission behave as for JSON requests
+    """
+    options = AnalysisOptions(
+        mode=mode,
+        entity_column=entity_column,
+        timestamp_column=timestamp_column,
+        value_column=value_column,
+        engine=engine,
+        train_threads=train_threads,
+        train_seconds=train_seconds,
+        train_rows=train_rows,
+        train_sample=train_sample
+    )
+    
+    upload_bytes = _upload_size(file)
+    if upload_bytes > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload of {upload_bytes} bytes exceeds the {MAX_UPLOAD_BYTES} byte limit"
+        )
+    
+    # A job reserves its memory now and takes a CPU slot when it starts
+    async with _admit_analysis(estimate_analysis_memory(upload_bytes, "csv"), job) as ticket:
+        try:
+            # Parse straight from the spooled upload, off the event loop. A single
+            # series in upload order is RA-encoded chunk by chunk as it is parsed
+            panel = mode == "time_series" and (entity_column or timestamp_column)
+            encoder = None if panel else RAEncoder(value_column)
+            started = time.perf_counter()
+            df, ingest = await run_analysis_io(read_csv_chunked, file.file, CSV_CHUNK_ROWS, encoder)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to parse CSV: {str(e)}")
+        ingest["upload_bytes"] = upload_bytes
+        parse = {"seconds": time.perf_counter() - started, "rows": len(df), "bytes": upload_bytes}
+        stage_metrics.record_stage("parse", parse["seconds"], parse["rows"], parse["bytes"])
+        
+        return await _process_analysis(
+            df, options, job=job, metadata={"ingest": ingest, "stages": {"parse": parse}}, encoder=encoder,
+            idempotency_key=idempotency_key, dedupe=dedupe, profile=profile, media_type=media_type, ticket=ticket
+        )
+
+
+class AnalysisInputError(ValueError):
+    """Raised by the analysis pipeline when the uploaded data cannot be modelled"""
+
+
+# Model Engines
+# Estimator class of each engine, imported when a model is fitted
+ENGINE_ESTIMATORS = {
+    "random_forest": ("sklearn.ensemble", "RandomForestRegressor"),
+    "hist_gradient_boosting": ("sklearn.ensemble", "HistGradientBoostingRegressor"),
+    "linear": ("sklearn.linear_model", "LinearRegression"),
+}
+# Estimators (trees or boosting iterations) added per step of a time-budgeted fit
+ENGINE_BUDGET_STEP = {"random_forest": 2, "hist_gradient_boosting": 10}
+
+
+# Seed of the training sample, so a resubmitted analysis is fitted on the same rows
+TRAIN_SAMPLE_SEED = 42
+# Target quantile bins that stratify a single series (panels stratify by entity)
+TRAIN_SAMPLE_TARGET_BINS = 10
+
+
+def reservoir_sample(n: int, k: int, rng: np.random.Generator, chunk_rows: int = MODEL_CHUNK_ROWS) -> np.ndarray:
+    """
+    Sorted positions of a uniform sample of ``k`` of ``n`` rows.
+
+    One pass over the rows in chunks: every row gets a random key and the
+    ``k`` smallest keys are kept, which is a reservoir sample in O(k +
+    chunk_rows) memory. Rows keyed above the largest kept key are dropped
+    as they are drawn, and the kept rows are only re-ranked when they
+    outgrow 2 * k.
+    """
+    threshold = np.inf
+    keys, positions = [np.empty(0)], [np.empty(0, dtype=np.intp)]
+    buffered = 0
+    for start in range(0, n, chunk_rows):
+        stop = min(n, start + chunk_rows)
+        chunk_keys = rng.random(stop - start)
+        admitted = chunk_keys < threshold
+        keys.append(chunk_keys[admitted])
+        positions.append(np.flatnonzero(admitted) + start)
+        buffered += len(keys[-1])
+        if buffered > 2 * k or stop == n:
+            all_keys, all_positions = np.concatenate(keys), np.concatenate(positions)
+            keep = np.argpartition(all_keys, k - 1)[:k] if len(all_keys) > k else slice(None)
+            keys, positions = [all_keys[keep]], [all_positions[keep]]
+            buffered = len(keys[0])
+            threshold = keys[0].max() if buffered == k else np.inf
+    return np.sort(positions[0])
+
+
+def stratified_sample(
+    strata: np.ndarray,
+    k: int,
+    rng: np.random.Generator,
+    chunk_rows: int = MODEL_CHUNK_ROWS
+) -> np.ndarray:
+    """
+    Sorted positions of a sample of ``k`` rows allocated to the strata in proportion to their size.
+
+    ``strata`` holds a non-negative stratum code per row. Quotas come from
+    the stratum counts (largest remainder); each stratum is then reservoir
+    sampled in one pass over the rows in chunks: every row gets a random
+    key and each stratum keeps its quota of smallest keys. Once a stratum
+    is full, rows keyed above its largest kept key are dropped as they are
+    drawn, and the kept rows are only re-ranked when they outgrow 2 * k.
+    """
+    n = len(strata)
+    counts = np.bincount(strata)
+    exact = counts * (k / n)
+    quotas = np.floor(exact).astype(np.intp)
+    short = k - int(quotas.sum())
+    if short > 0:
+        quotas[np.argsort(quotas - exact, kind="stable")[:short]] += 1
+    
+    thresholds = np.full(len(quotas), np.inf)
+    keys, positions = [np.empty(0)], [np.empty(0, dtype=np.intp)]
+    buffered = 0
+    
+    def compact():
+        nonlocal keys, positions, buffered
+        all_keys, all_positions = np.concatenate(keys), np.concatenate(positions)
+        codes = strata[all_positions]
+        # One float sort by stratum, then key: keys are below 1, so 2 * code + key
+        # never reaches the next stratum even when rounded
+        order = np.argsort(codes * 2.0 + all_keys)
+        codes = codes[order]
+        rank = np.arange(len(order)) - np.searchsorted(codes, codes, side="left")
+        kept = rank < quotas[codes]
+        keep = order[kept]
+        keys, positions = [all_keys[keep]], [all_positions[keep]]
+        buffered = len(keep)
+        # A stratum holding its quota only admits keys below its largest kept
+        # key, the last of its rows in key order
+        kept_codes = codes[kept]
+        sizes = np.bincount(kept_codes, minlength=len(quotas))
+        last = np.cumsum(sizes) - 1
+        full = (sizes >= quotas) & (sizes > 0)
+        thresholds[:] = np.inf
+        thresholds[full] = keys[0][last[full]]
+    
+    for start in range(0, n, chunk_rows):
+        stop = min(n, start + chunk_rows)
+        chunk_keys = rng.random(stop - start)
+        admitted = chunk_keys < thresholds[strata[start:stop]]
+        keys.append(chunk_keys[admitted])
+        positions.append(np.flatnonzero(admitted) + start)
+        buffered += len(keys[-1])
+        if buffered > 2 * k:
+            compact()
+    compact()
+    return np.sort(positions[0])
+
+
+def training_sample(
+    df_encoded: pd.DataFrame,
+    target: pd.Series,
+    k: int,
+    options: AnalysisOptions
+) -> tuple[np.ndarray, dict]:
+    """
+    Positions of the ``k`` rows a row budget trains on, and how they were chosen.
+
+    The method is the request's ``train_sample``, else MODEL_TRAIN_SAMPLE.
+    Stratified samples keep each entity's share of a panel, or each target
+    decile's share of a single series.
+    """
+    n = len(df_encoded)
+    method = options.train_sample or MODEL_TRAIN_SAMPLE
+    rng = np.random.default_rng(TRAIN_SAMPLE_SEED)
+    sample = {"method": method, "rows": n, "sample_rows": k, "fraction": k / n}
+    if method == "systematic":
+        positions = np.linspace(0, n - 1, k).astype(np.intp)
+    elif method == "stratified":
+        if _is_panel(options) and options.entity_column in df_encoded.columns:
+            strata = pd.factorize(df_encoded[options.entity_column], use_na_sentinel=False)[0]
+            sample["strata"] = f"entity:{options.entity_column}"
+        else:
+            values = target.to_numpy(dtype=np.float64, na_value=np.nan)
+            edges = np.nanquantile(values, np.linspace(0, 1, TRAIN_SAMPLE_TARGET_BINS + 1)[1:-1])
+            strata = np.searchsorted(edges, values, side="right")
+            sample["strata"] = "target_decile"
+        sample["strata_count"] = int(strata.max()) + 1
+        positions = stratified_sample(strata, k, rng)
+        sample["seed"] = TRAIN_SAMPLE_SEED
+    else:
+        positions = reservoir_sample(n, k, rng)
+        sample["seed"] = TRAIN_SAMPLE_SEED
+    return positions, sample
+
+
+def feature_matrix(df: pd.DataFrame, features: list[str], rows=slice(None)) -> np.ndarray:
+    """
+    float32 matrix of ``features`` for ``rows`` (a slice or positions), NaN as 0.
+
+    Built column by column from the selected rows only, so a chunk or a
+    training sample never copies the whole frame.
+    """
+    columns = [df[name].iloc[rows] for name in features]
+    X = np.empty((len(columns[0]), len(features)), dtype=np.float32)
+    for j, column in enumerate(columns):
+        X[:, j] = column.to_numpy(dtype=np.float32, na_value=np.nan)
+    X[np.isnan(X)] = 0
+    return X
+
+
+def predict_chunked(
+    model,
+    df: pd.DataFrame,
+    features: list[str],
+    chunk_rows: int = MODEL_CHUNK_ROWS,
+    ldrop: Optional[LdropAccumulator] = None
+) -> np.ndarray:
+    """
+    Predictions for every row of ``df``, computed MODEL_CHUNK_ROWS rows at a time.
+
+    Each chunk is also fed to ``ldrop``, if given, while it is still in cache.
+    """
+    predictions = np.empty(len(df), dtype=np.float64)
+    for start in range(0, len(df), chunk_rows):
+        stop = min(len(df), start + chunk_rows)
+        predictions[start:stop] = model.predict(feature_matrix(df, features, slice(start, stop)))
+        if ldrop is not None:
+            ldrop.update(predictions[start:stop])
+    return predictions
+
+
+def _train_row_budget(rows: int, options: AnalysisOptions) -> int:
+    budget = options.train_rows or MODEL_TRAIN_ROWS
+    return min(rows, budget) if budget > 0 else rows
+
+
+def default_model_threads() -> int:
+    """Threads per fit when neither the request nor MODEL_THREADS sets them: the analysis workers share the cores"""
+    return max(1, available_cores() // analysis_pool.max_workers)
+
+
+def select_engine(rows: int, options: AnalysisOptions) -> str:
+    """
+    The engine an analysis of ``rows`` rows is fitted with.
+
+    The request's ``engine``, else MODEL_ENGINE; "auto" fits a random forest
+    on up to MODEL_AUTO_FOREST_MAX_ROWS training rows and histogram gradient
+    boosting, which bins features and scales to millions of rows, beyond.
+    """
+    engine = options.engine or MODEL_ENGINE
+    if engine != "auto":
+        return engine
+    if _train_row_budget(rows, options) <= MODEL_AUTO_FOREST_MAX_ROWS:
+        return "random_forest"
+    return "hist_gradient_boosting"
+
+
+def engine_of(model) -> str:
+    """The engine a fitted model was built by"""
+    name = type(model).__name__
+    return next(engine for engine, (_, cls) in ENGINE_ESTIMATORS.items() if cls == name)
+
+
+def fit_model(engine: str, X: np.ndarray, y: np.ndarray, threads: int, seconds: Optional[float]) -> tuple:
+    """
+    Fit ``engine`` on X, y within a thread and wall-clock budget.
+
+    Trees are built on ``threads`` threads (n_jobs for the forest, OpenMP for
+    boosting and BLAS for the linear model). With ``seconds``, the forest and
+    boosting grow estimators in steps until their full size or the budget
+    is reached; at least one step is always fitted. Returns the model and
+    a summary of the fit.
+    """
+    from threadpoolctl import threadpool_limits
+    
+    module, name = ENGINE_ESTIMATORS[engine]
+    params = dict(MODEL_PARAMS[engine])
+    if engine == "random_forest":
+        params["n_jobs"] = threads
+    model = getattr(importlib.import_module(module), name)(**params)
+    
+    size_param = {"random_forest": "n_estimators", "hist_gradient_boosting": "max_iter"}.get(engine)
+    target = params.get(size_param)
+    started = time.perf_counter()
+    with threadpool_limits(limits=threads):
+        if seconds is None or size_param is None:
+            model.fit(X, y)
+        else:
+            # Forests draw each tree's seed in order, so a forest grown in steps
+            # equals one fitted at once
+            size = 0
+            model.set_params(warm_start=True)
+            while size < target:
+                size = min(target, size + ENGINE_BUDGET_STEP[engine] * (threads if engine == "random_forest" else 1))
+                model.set_params(**{size_param: size})
+                model.fit(X, y)
+                if time.perf_counter() - started >= seconds:
+                    break
+            model.set_params(warm_start=False)
+    fit_seconds = time.perf_counter() - started
+    
+    estimators = None
+    if engine == "random_forest":
+        estimators = len(model.estimators_)
+    elif engine == "hist_gradient_boosting":
+        estimators = model.n_iter_
+    return model, {
+        "engine": engine,
+        "params": MODEL_PARAMS[engine],
+        "threads": threads,
+        "fit_seconds": fit_seconds,
+        "estimators": estimators,
+        "budget_seconds": seconds,
+        "budget_exhausted": size_param is not None and model.get_params()[size_param] < target,
+    }
+
+
+def _fit_predict(
+    df_encoded: pd.DataFrame,
+    run_id: Optional[str] = None,
+    extra_features: tuple = (),
+    model=None,
+    options: Optional[AnalysisOptions] = None,
+    ldrop: Optional[LdropAccumulator] = None
+) -> tuple[np.ndarray, Any, list[str], dict]:
+    """
+    Train the model on the RA features and predict every row.
+
+    The engine and training budgets come from ``options`` (see
+    select_engine and fit_model); under a row budget the model is fitted on
+    a sample (see training_sample). Every row is then predicted in chunks.
+    A ``model`` already fitted on the same data (from the analysis cache)
+    is used as is. Returns the predictions, the model, its feature columns
+    and the fit summary recorded in the run's metadata; the L-drop metrics
+    of the predictions accumulate in ``ldrop`` as they are made.
+    """
+    options = options or AnalysisOptions()
+    feature_cols = list(RA_FEATURES) + list(extra_features)
+    available_features = [col for col in feature_cols if col in df_encoded.columns]
+    
+    if not available_features:
+        raise AnalysisInputError("No valid features found for modeling")
+    
+    # Create synthetic target if not present (for demo)
+    if 'target' not in df_encoded.columns:
+        y = df_encoded[available_features[0]]  # Synthetic target, scaled below
+    else:
+        y = df_encoded['target']
+    
+    # Train model
+    n = len(df_encoded)
+    train_rows = _train_row_budget(n, options)
+    mark_stage(run_id, "train", train_rows)
+    sample = None
+    if model is None:
+        rows = slice(None)
+        if train_rows < n:
+            rows, sample = training_sample(df_encoded, y, train_rows, options)
+        # Trees work in float32; a plain array also keeps predict free of feature-name checks
+        X = feature_matrix(df_encoded, available_features, rows)
+        y_train = y.iloc[rows]
+        if 'target' not in df_encoded.columns:
+            y_train = y_train * 0.8 + 0.1
+        y_train = y_train.to_numpy(dtype=np.float64)
+        threads = min(options.train_threads or MODEL_THREADS or default_model_threads(), available_cores())
+        model, info = fit_model(
+            select_engine(n, options), X, y_train, threads, options.train_seconds or MODEL_TRAIN_SECONDS or None
+        )
+        del X
+    else:
+        info = {"engine": engine_of(model), "params": MODEL_PARAMS[engine_of(model)], "cached": True}
+    info.update(rows=n, train_rows=train_rows, sample=sample, auto=options.engine is None and MODEL_ENGINE == "auto")
+    mark_stage(run_id, "predict", n)
+    # Kept as an array: the response encoders write it as one buffer
+    return predict_chunked(model, df_encoded, available_features, ldrop=ldrop), model, available_features, info
+
+
+def _save_model(
+    run_id: Optional[str],
+    model,
+    features: list[str],
+    options: AnalysisOptions,
+    encoder_state: Optional[dict],
+    fit: dict
+):
+    """
+    Persist a run's fitted model for serving as model.joblib plus a model.json manifest.
+
+    The model is dumped uncompressed so its arrays can be memory-mapped when
+    loaded. The manifest records the engine, the feature columns and how to
+    encode new rows for them.
+    """
+    if run_id is None:
+        return
+    clock_stage("save_model")
+    run_artifacts_dir = _run_dir(run_id)
+    _write_json_atomic(run_artifacts_dir / "model.json", {
+        "features": features,
+        "options": options.model_dump(),
+        "encoder_state": encoder_state,
+        "engine": fit["engine"],
+        "model_params": fit["params"],
+        "trained_at": datetime.now(timezone.utc).isoformat()
+    })
+    import joblib
+    
+    tmp_path = run_artifacts_dir / f".model.joblib.{os.getpid()}.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, run_artifacts_dir / "model.joblib")
+
+
+def _computed_results(
+    df_encoded: pd.DataFrame,
+    predictions: np.ndarray,
+    encoder: RAEncoder,
+    ldrop: Optional[LdropAccumulator] = None
+) -> dict:
+    """Results of an analysis; the L-drop metrics come from ``ldrop`` when it was fed while predicting"""
+    return {
+        "df_encoded": df_encoded,
+        "predictions": predictions,
+        "ldrop_metrics": ldrop.metrics() if ldrop is not None else calculate_ldrop_metrics(df_encoded, predictions),
+        "ra_score_deltas": calculate_ra_score_deltas(df_encoded),
+        "encoder_state": encoder.state_dict() if encoder.rows else None,
+    }
+
+
+def _compute_analysis(
+    df: pd.DataFrame,
+    options: Optional[AnalysisOptions] = None,
+    run_id: Optional[str] = None,
+    encoder: Optional[RAEncoder] = None,
+    model_blob: Optional[bytes] = None
+) -> dict:
+    """
+    CPU-bound analysis stages: RA encoding, model fit, predict and metrics.
+
+    Runs inside an AnalysisWorkerPool process, so it must stay a picklable
+    module-level function and must not touch the event loop. Stage progress
+    is reported through the run's status.json when ``run_id`` is given.
+    ``encoder`` carries state from chunked ingestion, if the data was
+    already encoded while it was parsed. ``model_blob`` is a cached pickled
+    model for the same content key; training is skipped when it is given,
+    otherwise the new model is returned pickled as ``model_bytes``. The
+    fitted model is also saved with the run for /predict.
+    """
+    options = options or AnalysisOptions()
+    _check_option_columns(df, options)
+    
+    # Encode RA features
+    mark_stage(run_id, "encode", len(df))
+    cached_model = pickle.loads(model_blob) if model_blob is not None else None
+    if _is_panel(options):
+        computed, model, features = _compute_panel_analysis(df, options, run_id, cached_model)
+    else:
+        encoder = encoder if encoder is not None else RAEncoder(options.value_column)
+        df_encoded = encode_ra_features(df, encoder=encoder)
+        df_encoded, wide_features = _add_wide_features(df_encoded, df, options)
+        
+        ldrop = LdropAccumulator()
+        predictions, model, features, fit = _fit_predict(
+            df_encoded, run_id, wide_features, cached_model, options, ldrop
+        )
+        
+        # Calculate metrics
+        mark_stage(run_id, "metrics", len(df_encoded))
+        computed = _computed_results(df_encoded, predictions, encoder, ldrop)
+        computed["model"] = fit
+    
+    _save_model(run_id, model, features, options, computed["encoder_state"], computed["model"])
+    if cached_model is None:
+        computed["model_bytes"] = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+    return _store_columns(run_id, computed)
+
+
+def _is_panel(options: AnalysisOptions) -> bool:
+    return options.mode == "time_series" and bool(options.entity_column or options.timestamp_column)
+
+
+def _check_option_columns(df: pd.DataFrame, options: AnalysisOptions):
+    for column in (options.entity_column, options.timestamp_column, options.value_column):
+        if column is not None and column not in df.columns:
+            raise AnalysisInputError(f"Column '{column}' not found in data")
+
+
+def _add_wide_features(
+    df_encoded: pd.DataFrame,
+    source: pd.DataFrame,
+    options: AnalysisOptions,
+    exclude: tuple = (),
+    group_starts: Optional[np.ndarray] = None
+) -> tuple[pd.DataFrame, tuple]:
+    """
+    Append the requested wide RA_<col> features; returns the frame and their names.
+
+    The encoding keeps no state: appends rebuild these features over every
+    row from the encode_columns and feature_dtype saved in model.json.
+    """
+    if not options.encode_columns:
+        return df_encoded, ()
+    
+    if options.encode_columns == ["*"]:
+        columns = [col for col in source.select_dtypes(include=['number']).columns
+                   if col not in exclude and col not in RA_FEATURES and col != 'target']
+    else:
+        columns = options.encode_columns
+        missing = [col for col in columns if col not in source.columns]
+        if missing:
+            raise AnalysisInputError(f"Columns not found for encoding: {missing}")
+    
+    wide = encode_ra_matrix(source, columns, dtype=np.dtype(options.feature_dtype), group_starts=group_starts)
+    return pd.concat([df_encoded, wide], axis=1, copy=False), tuple(wide.columns)
+
+
+def _compute_panel_analysis(
+    df: pd.DataFrame,
+    options: AnalysisOptions,
+    run_id: Optional[str],
+    model=None
+) -> tuple[dict, Any, list[str]]:
+    """time_series mode: per-entity series encoded in one grouped pass"""
+    df_sorted, order, group_starts, entity_labels = encode_ra_panel(
+        df, options.entity_column, options.timestamp_column, options.value_column
+    )
+    df_sorted, wide_features = _add_wide_features(
+        df_sorted, df_sorted, options, exclude=(options.entity_column, options.timestamp_column),
+        group_starts=group_starts
+    )
+    ldrop = LdropAccumulator()
+    predictions, model, features, fit = _fit_predict(df_sorted, run_id, wide_features, model, options, ldrop)
+    
+    mark_stage(run_id, "metrics", len(df_sorted))
+    ldrop_by_entity, deltas_by_entity = calculate_entity_metrics(
+        df_sorted, predictions, group_starts, entity_labels
+    )
+    
+    # Return rows and predictions in the order they were submitted
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    df_encoded = df_sorted.take(inverse).reset_index(drop=True)
+    computed = _computed_results(df_encoded, predictions[inverse], RAEncoder(), ldrop)
+    computed["ldrop_metrics_by_entity"] = ldrop_by_entity
+    computed["ra_score_deltas_by_entity"] = deltas_by_entity
+    computed["model"] = fit
+    return computed, model, features
+
+
+def _compute_append(run_id: str, new_df: pd.DataFrame) -> dict:
+    """
+    Extend a finished run with new time-series rows.
+
+    Only the new rows are encoded, continuing from the run's saved encoder
+    state. The history is moved onto the updated min/max scale with an
+    affine rescale instead of being re-encoded. Wide RA_<col> features
+    (``encode_columns``) keep no state to continue from, so they are
+    recomputed over every row. The model is then refit on the combined rows
+    with the options the run was analysed with.
+    """
+    mark_stage(run_id, "encode", len(new_df))
+    run_artifacts_dir = _run_dir(run_id)
+    with open(run_artifacts_dir / "encoder_state.json", 'r') as f:
+        encoder = RAEncoder.from_state(json.load(f))
+    try:
+        with open(run_artifacts_dir / "model.json", 'r') as f:
+            trained = json.load(f)
+    except FileNotFoundError:
+        trained = {"options": {}, "features": list(RA_FEATURES)}
+    options = AnalysisOptions(**{**trained["options"], "value_column": encoder.source_column})
+    if options.encode_columns and options.encode_columns != ["*"]:
+        missing = [col for col in options.encode_columns if col not in new_df.columns]
+        if missing:
+            raise AnalysisInputError(f"Appended rows must include the encoded columns {missing}")
+    
+    results = _load_results_manifest(run_id)
+    if "data" in results:
+        history, _ = read_columns(run_id, results["data"])
+    else:
+        history = pd.DataFrame(results["encoded_data"])
+    old_min, old_max = encoder.min, encoder.max
+    
+    new_features = encoder.encode(new_df[encoder.source_column].to_numpy(dtype=np.float64))
+    new_df = new_df.copy()
+    for i, name in enumerate(RA_FEATURES):
+        new_df[name] = new_features[:, i]
+    
+    if old_min is not None and (encoder.min, encoder.max) != (old_min, old_max):
+        history_features = history[list(RA_FEATURES)].to_numpy(dtype=np.float64)
+        rescaled = encoder.rescale(history_features, old_min, old_max)
+        for i, name in enumerate(RA_FEATURES):
+            history[name] = rescaled[:, i]
     
-    metrics = {
-        "mean_prediction": float(pd.Series(predictions).mean()),
-        "std_prediction": float(pd.Series(predictions).std()),
-        "min_prediction": float(pd.Series(predictions).min()),
-        "max_prediction": float(pd.Series(predictions).max()),
-        "ldrop_threshold": 0.5,  # Configurable threshold
-        "samples_below_threshold": int((pd.Series(predictions) < 0.5).sum())
-    }
+    wide_names = [name for name in trained["features"] if name not in RA_FEATURES]
+    df_encoded = pd.concat([history.drop(columns=wide_names, errors="ignore"), new_df], ignore_index=True)
+    df_encoded, wide_features = _add_wide_features(df_encoded, df_encoded, options)
+    ldrop = LdropAccumulator()
+    predictions, model, features, fit = _fit_predict(df_encoded, run_id, wide_features, options=options, ldrop=ldrop)
     
-    return metrics
+    mark_stage(run_id, "metrics", len(df_encoded))
+    computed = _computed_results(df_encoded, predictions, encoder, ldrop)
+    computed["model"] = fit
+    _save_model(run_id, model, features, options, computed["encoder_state"], fit)
+    return _store_columns(run_id, computed)
 
 
-def calculate_ra_score_deltas(df_encoded: pd.DataFrame) -> dict:
-    """Calculate RA score deltas"""
-    deltas = {}
+def encode_new_rows(df: pd.DataFrame, options: AnalysisOptions, encoder_state: Optional[dict]) -> pd.DataFrame:
+    """
+    RA-encode rows submitted for prediction the way a run's training data was encoded.
+
+    A single series continues from the run's encoder state and is
+    normalised with the training min/max; the saved state is not advanced.
+    Panel and wide features are encoded over the submitted rows.
+    """
+    _check_option_columns(df, options)
+    if _is_panel(options):
+        df_sorted, order, group_starts, _ = encode_ra_panel(
+            df, options.entity_column, options.timestamp_column, options.value_column
+        )
+        df_sorted, _ = _add_wide_features(
+            df_sorted, df_sorted, options, exclude=(options.entity_column, options.timestamp_column),
+            group_starts=group_starts
+        )
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return df_sorted.take(inverse).reset_index(drop=True)
     
-    if 'RA' in df_encoded.columns:
-        deltas['ra_mean'] = float(df_encoded['RA'].mean())
-        deltas['ra_std'] = float(df_encoded['RA'].std())
-        deltas['ra_delta_mean'] = float(df_encoded['D'].mean()) if 'D' in df_encoded.columns else 0.0
-        deltas['ra_momentum'] = float(df_encoded['M'].mean()) if 'M' in df_encoded.columns else 0.0
-        deltas['ra_stability'] = float(df_encoded['S'].mean()) if 'S' in df_encoded.columns else 0.0
+    if encoder_state is not None and not any(name in df.columns for name in RA_FEATURES):
+        source = encoder_state["source_column"]
+        if source not in df.columns:
+            raise AnalysisInputError(f"Rows must include the source column '{source}'")
+        raw = RAEncoder.from_state(encoder_state).partial_encode(df[source].to_numpy(dtype=np.float64))
+        features = RAEncoder.from_state(encoder_state).normalize(raw)
+        df_encoded = df.assign(**{name: features[:, i] for i, name in enumerate(RA_FEATURES)})
+    else:
+        df_encoded = encode_ra_features(df, encoder=RAEncoder(options.value_column))
     
-    return deltas
+    df_encoded, _ = _add_wide_features(df_encoded, df, options)
+    return df_encoded
 
 
-def validate_run_id(run_id: str) -> str:
+async def _write_artifacts(run_id: str, computed: dict, metadata: Optional[dict] = None) -> dict:
     """
-    Validate and sanitize run_id to prevent path traversal attacks.
+    Write results.json, report.html and dkil_lock.json for a run
+
+    results.json holds the metadata, metrics and the manifest of the
+    columnar encoded data and predictions. Those are normally written by
+    the analysis worker already (``computed["data"]``); otherwise they
+    are written here from ``computed["df_encoded"]``.
+
+    results.json, encoder_state.json and dkil_lock.json are durable before
+    this returns; report.html is left to the write-behind queue.
+    """
+    started = time.perf_counter()
+    predictions = np.asarray(computed["predictions"], dtype=np.float64)
+    ldrop_metrics = computed["ldrop_metrics"]
+    ra_score_deltas = computed["ra_score_deltas"]
     
-    Security: This function provides defense-in-depth against path injection:
-    1. Strict UUID format validation (8-4-4-4-12 hex pattern)
+    # Save artifacts
+    mark_stage(run_id, "artifacts")
+    run_artifacts_dir = _run_dir(run_id)
+    run_artifacts_dir.mkdir(parents=True, exist_ok=True)
     
-    Only allows UUID format (alphanumeric and hyphens).
+    data = computed.get("data")
+    if data is None:
+        data = await run_analysis_io(write_columns, run_artifacts_dir, computed["df_encoded"], predictions)
     
-    Note: CodeQL may flag uses of validated_run_id as path injection,
-    but these are false positives as the validation ensures only safe UUIDs pass.
+    # Save metadata, metrics and the columnar data manifest as JSON
+    results = {
+        "run_id": run_id,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "ldrop_metrics": ldrop_metrics,
+        "ra_score_deltas": ra_score_deltas,
+        "metadata": metadata or {},
+        "data": data
+    }
+    if computed.get("ldrop_metrics_by_entity") is not None:
+        results["ldrop_metrics_by_entity"] = computed["ldrop_metrics_by_entity"]
+        results["ra_score_deltas_by_entity"] = computed["ra_score_deltas_by_entity"]
     
-    Args:
-        run_id: User-provided run identifier
+    # Generate HTML report
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>RA Longevity Analysis Report - {run_id}</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; margin: 20px; }}
+            h1 {{ color: #333; }}
+            .metric {{ background: #f5f5f5; padding: 10px; margin: 10px 0; border-radius: 5px; }}
+            table {{ border-collapse: collapse; width: 100%; margin: 20px 0; }}
+            th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
+            th {{ background-color: #4CAF50; color: white; }}
+        </style>
+    </head>
+    <body>
+        <h1>RA Longevity Analysis Report</h1>
+        <div class="metric"><strong>Run ID:</strong> {run_id}</div>
+        <div class="metric"><strong>Timestamp:</strong> {results['timestamp']}</div>
+        
+        <h2>L-Drop Metrics</h2>
+        <table>
+            <tr><th>Metric</th><th>Value</th></tr>
+            {''.join(f'<tr><td>{k}</td><td>{v}</td></tr>' for k, v in ldrop_metrics.items())}
+        </table>
+        
+        <h2>RA Score Deltas</h2>
+        <table>
+            <tr><th>Metric</th><th>Value</th></tr>
+            {''.join(f'<tr><td>{k}</td><td>{v:.4f}</td></tr>' for k, v in ra_score_deltas.items())}
+        </table>
+        
+        <h2>Predictions Summary</h2>
+        <div class="metric">
+            <p>Total Predictions: {len(predictions)}</p>
+            <p>First 10 predictions: {predictions[:10].tolist()}</p>
+        </div>
+    </body>
+    </html>
+    """
     
-    Returns:
-        Validated run_id string (guaranteed to be safe UUID format)
+    await artifact_writer.write(run_artifacts_dir / "report.html", html_content, durable=False)
     
-    Raises:
-        HTTPException: If run_id doesn't match UUID format
-    """
-    # Check if run_id matches UUID format (only allows hex digits and hyphens)
-    uuid_pattern = re.compile(r'^[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}$', re.IGNORECASE)
-    if not uuid_pattern.match(run_id):
-        raise HTTPException(status_code=400, detail="Invalid run_id format. Must be a valid UUID.")
+    # Create DKIL lock file (always create for all runs)
+    # In production, you might want conditional creation based on thresholds
+    # A model fitted on a sample of the rows is recorded as approximate
+    sample = (metadata or {}).get("model", {}).get("sample")
+    dkil_data = {
+        "run_id": run_id,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "integrity_check": True,
+        "threshold_met": ldrop_metrics['samples_below_threshold'] < len(predictions) * 0.3,
+        "ldrop_threshold": ldrop_metrics['ldrop_threshold'],
+        "samples_below_threshold": ldrop_metrics['samples_below_threshold'],
+        "approximate": sample is not None,
+        "training_sample": sample
+    }
     
-    return run_id
+    # The report and deploy endpoints read these as soon as the run is done;
+    # written together, they share one fsync batch
+    durable = [
+        artifact_writer.write_json(run_artifacts_dir / "results.json", results),
+        artifact_writer.write_json(run_artifacts_dir / "dkil_lock.json", dkil_data)
+    ]
+    # Save encoder state so the run can be extended by appends
+    if computed.get("encoder_state") is not None:
+        durable.append(artifact_writer.write_json(run_artifacts_dir / "encoder_state.json", computed["encoder_state"]))
+    await asyncio.gather(*durable)
+    await run_analysis_io(_remove_stale_data, run_artifacts_dir, data["path"])
+    size = await run_analysis_io(_dir_bytes, run_artifacts_dir)
+    await run_analysis_io(_update_catalogue, run_catalogue.record_run, run_id, results, dkil_data, size)
+    # results.json is part of this stage, so its time is only in the metrics
+    stage_metrics.record_stage("write", time.perf_counter() - started, len(predictions), size)
+    
+    # bundle.zip is built when it is downloaded (see download_bundle)
+    return {**results, "predictions": predictions}
 
 
-def check_dkil(run_id: str, threshold: float = 0.5) -> tuple[bool, dict]:
+def _create_run(run_id: str, content_key: Optional[str] = None):
+    """Create a run's artifacts directory with a queued status"""
+    _run_dir(run_id).mkdir(parents=True, exist_ok=True)
+    update_run_status(run_id, content_key=content_key)
+
+
+def _compute_timed(compute, *args) -> dict:
+    """Worker-side: run ``compute(*args)`` and attach its per-stage timings as ``stages``"""
+    with timed_stages() as clock:
+        computed = compute(*args)
+    computed["stages"] = clock.stages
+    return computed
+
+
+def _compute_profiled(run_id: str, compute, *args) -> dict:
     """
-    Check DKIL (Data Knowledge Integrity Lock) status
-    Returns: (passed, details)
+    Worker-side: ``_compute_timed`` under cProfile and tracemalloc.
+
+    The profile is saved into the run's profile/ directory even if the
+    analysis fails.
     """
-    # Validate run_id to prevent path traversal
-    validated_run_id = validate_run_id(run_id)
+    import cProfile
+    import tracemalloc
     
-    artifacts_path = ARTIFACTS_DIR / validated_run_id
-    dkil_file = artifacts_path / "dkil_lock.json"
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    tracemalloc.start()
+    try:
+        profiler.enable()
+        try:
+            return _compute_timed(compute, *args)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        _save_profile(run_id, profiler, snapshot, peak_bytes, elapsed)
+
+
+def _save_profile(run_id: str, profiler, snapshot, peak_bytes: int, elapsed: float):
+    """
+    Write profile/cpu.prof (pstats format, for snakeviz or ``pstats``) and a
+    profile/profile.json summary of the slowest functions and the largest
+    allocation sites
+    """
+    import pstats
+    import tracemalloc
     
-    if not dkil_file.exists():
-        return False, {"error": "DKIL lock file not found"}
+    profile_dir = _run_dir(run_id) / "profile"
+    profile_dir.mkdir(exist_ok=True)
+    stats = pstats.Stats(profiler)
+    tmp_path = profile_dir / f".cpu.prof.{os.getpid()}.tmp"
+    stats.dump_stats(tmp_path)
+    os.replace(tmp_path, profile_dir / "cpu.prof")
     
-    with open(dkil_file, 'r') as f:
-        dkil_data = json.load(f)
+    slowest = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_ENTRIES]
+    allocations = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    )).statistics("lineno")[:PROFILE_TOP_ENTRIES]
+    _write_json_atomic(profile_dir / "profile.json", {
+        "run_id": run_id,
+        "profiled_at": datetime.now(timezone.utc).isoformat(),
+        "wall_seconds": elapsed,
+        "cpu": {
+            "total_calls": stats.total_calls,
+            "functions": [
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "primitive_calls": primitive_calls,
+                    "total_seconds": total_time,
+                    "cumulative_seconds": cumulative_time
+                }
+                for (filename, line, name), (primitive_calls, calls, total_time, cumulative_time, _) in slowest
+            ]
+        },
+        "memory": {
+            "peak_bytes": peak_bytes,
+            "allocations": [
+                {
+                    "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_bytes": stat.size,
+                    "count": stat.count
+                }
+                for stat in allocations
+            ]
+        }
+    })
+
+
+async def _run_pipeline(run_id: str, metadata: Optional[dict], compute, *args, profile: bool = False) -> dict:
+    """
+    Run ``compute(*args)`` and write the artifacts of a run, recording its status
+
+    The run's stage breakdown (any stages already in ``metadata``, such as
+    CSV parsing, plus the compute stages) is stored in its metadata as
+    ``stages`` and recorded in ``stage_metrics``. With ``profile`` the
+    compute stages run under the profiler (see ``_compute_profiled``).
+    """
+    try:
+        update_run_status(run_id, status="running", started_at=datetime.now(timezone.utc).isoformat())
+        
+        # Encode, train and predict in the CPU worker pool so the event loop stays free
+        if profile:
+            computed = await analysis_pool.run(_compute_profiled, run_id, compute, *args)
+        else:
+            computed = await analysis_pool.run(_compute_timed, compute, *args)
+        stages = computed.pop("stages")
+        stage_metrics.record_stages(stages)
+        metadata = {**(metadata or {})}
+        metadata["stages"] = {**metadata.get("stages", {}), **stages}
+        metadata["model"] = computed.pop("model")
+        
+        # Artifact writes go through the asynchronous artifact writer
+        model_blob = computed.pop("model_bytes", None)
+        results = await _write_artifacts(run_id, computed, metadata)
+    except BaseException as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        update_run_status(run_id, status="failed", error=detail,
+                          finished_at=datetime.now(timezone.utc).isoformat())
+        _update_catalogue(run_catalogue.record_failure, run_id)
+        raise
     
-    # Check if integrity checks passed (threshold_met is informational)
-    passed = dkil_data.get('integrity_check', False)
+    update_run_status(
+        run_id,
+        status="done",
+        stage=None,
+        stages={stage: "done" for stage in ANALYSIS_STAGES},
+        progress=1.0,
+        finished_at=datetime.now(timezone.utc).isoformat()
+    )
     
-    return passed, dkil_data
+    content_key = (metadata or {}).get("content_key")
+    if model_blob is not None and content_key is not None:
+        try:
+            await run_analysis_io(analysis_cache.store_model, content_key, model_blob)
+        except OSError:
+            # The run itself is complete; a full cache disk only costs a later retrain
+            pass
+    return results
 
 
-# Endpoints
-
-@app.get("/")
-async def root():
-    """Root endpoint - API information"""
-    return {
-        "service": "RA Longevity MLOps API",
-        "version": "1.0.0",
-        "endpoints": {
-            "analyze": "POST /api/longevity/analyze",
-            "report": "GET /api/longevity/report/{run_id}",
-            "deploy": "POST /api/longevity/deploy"
-        }
-    }
+async def _run_analysis(
+    run_id: str,
+    df: pd.DataFrame,
+    options: AnalysisOptions,
+    metadata: Optional[dict] = None,
+    encoder: Optional[RAEncoder] = None,
+    model_blob: Optional[bytes] = None,
+    profile: bool = False
+) -> dict:
+    """Run the full analysis pipeline for an allocated run"""
+    return await _run_pipeline(run_id, metadata, _compute_analysis, df, options, run_id, encoder, model_blob,
+                               profile=profile)
 
 
-@app.post("/api/longevity/analyze", response_model=AnalyzeResponse)
-async def analyze_data_json(
-    request_data: AnalyzeRequest,
-    token: str = Depends(verify_token)
+async def _run_analysis_job(
+    run_id: str,
+    df: pd.DataFrame,
+    options: AnalysisOptions,
+    metadata: Optional[dict] = None,
+    encoder: Optional[RAEncoder] = None,
+    model_blob: Optional[bytes] = None,
+    profile: bool = False,
+    ticket: Optional[AdmissionTicket] = None
 ):
     """
-    Analyze JSON tabular data
-    - Accepts JSON in request body
-    - Applies RA feature encoding (RA, D, M, S, LR)
-    - Returns predictions, ldrop metrics, and RA score deltas
+    Background job wrapper; failures are recorded in status.json.
+
+    ``ticket`` holds the memory reserved when the job was submitted; the
+    job takes its CPU slot once the scheduler starts it. Its request
+    already got a 202, so it waits for the slot however long it takes
+    rather than being shed, and stays "queued" meanwhile. The submitter
+    releases the ticket when the job's task ends.
     """
-    return await _process_analysis(pd.DataFrame(request_data.data), request_data.mode)
+    try:
+        if ticket is not None:
+            await ticket.take_slot()
+        await _run_analysis(run_id, df, options, metadata, encoder, model_blob, profile)
+    except Exception:
+        pass
 
 
-@app.post("/api/longevity/analyze/csv", response_model=AnalyzeResponse)
-async def analyze_data_csv(
-    file: UploadFile = File(...),
-    token: str = Depends(verify_token)
+def _job_response(run_id: str, status: str, **extra) -> JSONResponse:
+    """Job-mode response pointing at a run's status and report"""
+    return JSONResponse(
+        status_code=200 if status == "done" else 202,
+        content={
+            "run_id": run_id,
+            "status": status,
+            "status_url": f"/api/longevity/status/{run_id}",
+            "report_url": f"/api/longevity/report/{run_id}",
+            **extra
+        }
+    )
+
+
+def _analyze_response(results: dict, media_type: str = JSON_MEDIA_TYPE, **metadata) -> Response:
+    """An AnalyzeResponse, encoded directly so the predictions array is never validated item by item"""
+    return encode_response({
+        "run_id": results['run_id'],
+        "predictions": results['predictions'],
+        "ldrop_metrics": results['ldrop_metrics'],
+        "ra_score_deltas": results['ra_score_deltas'],
+        "timestamp": results['timestamp'],
+        "metadata": {**results['metadata'], **metadata},
+        "ldrop_metrics_by_entity": results.get('ldrop_metrics_by_entity'),
+        "ra_score_deltas_by_entity": results.get('ra_score_deltas_by_entity')
+    }, media_type)
+
+
+async def _replay_run(
+    run_id: str,
+    content_key: str,
+    job: bool,
+    media_type: str = JSON_MEDIA_TYPE,
+    ticket: Optional[AdmissionTicket] = None
 ):
     """
-    Analyze CSV file upload
-    - Accepts CSV file
-    - Applies RA feature encoding (RA, D, M, S, LR)
-    - Returns predictions, ldrop metrics, and RA score deltas
+    Response for an existing run of the same content, or None if it cannot be reused.
+
+    A synchronous request matching a run that is still queued or running
+    waits for it (up to DEDUPE_WAIT_SECONDS) instead of training again,
+    releasing its admission ``ticket`` meanwhile. Failed runs, and runs
+    whose content changed through an append, are not reused.
     """
+    if not _run_dir(run_id).exists():
+        return None
+    
+    status = read_run_status(run_id)
+    if not job and ticket is not None and status is not None and status["status"] in ("queued", "running"):
+        # Waiting computes nothing; the caller readmits if it has to train after all
+        ticket.release()
+    delay = 0.05
+    deadline = time.monotonic() + DEDUPE_WAIT_SECONDS
+    while (not job and status is not None and status["status"] in ("queued", "running")
+           and time.monotonic() < deadline):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+        status = read_run_status(run_id)
+    
+    if status is None or status.get("content_key") != content_key or status["status"] == "failed":
+        return None
+    if job or status["status"] != "done":
+        return _job_response(run_id, status["status"], deduplicated=True)
+    
     try:
-        contents = await file.read()
-        from io import StringIO
-        df = pd.read_csv(StringIO(contents.decode('utf-8')))
-        return await _process_analysis(df, "tabular")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to parse CSV: {str(e)}")
+        results = await run_analysis_io(_load_results, run_id, False, True)
+    except FileNotFoundError:
+        return None
+    return _analyze_response(results, media_type, cache="run_hit")
+
+
+async def _process_analysis(
+    df: pd.DataFrame,
+    options: Optional[AnalysisOptions] = None,
+    job: bool = False,
+    metadata: Optional[dict] = None,
+    encoder: Optional[RAEncoder] = None,
+    idempotency_key: Optional[str] = None,
+    dedupe: bool = True,
+    profile: bool = False,
+    media_type: str = JSON_MEDIA_TYPE,
+    ticket: Optional[AdmissionTicket] = None
+):
+    """
+    Internal function to process analysis
+
+    With ``job=True`` the analysis is handed to the job scheduler and a
+    202 response with the queued run_id is returned immediately.
 
+    Identical content (same data, options and model parameters) is
+    deduplicated: the existing run is returned, or, if its artifacts are
+    gone, a new run reuses the cached fitted model. ``dedupe=False``
+    always trains a new model. A repeated ``idempotency_key`` replays
+    the run it was first used for.
 
-async def _process_analysis(df: pd.DataFrame, mode: str = "tabular") -> AnalyzeResponse:
-    """Internal function to process analysis"""
+    With ``profile=True`` the run is profiled; a profile is only useful for
+    a fresh run, so deduplication is skipped. Finished analyses are encoded
+    as ``media_type`` (see ``negotiate_media_type``).
+
+    ``ticket`` is the request's admission. A synchronous request releases
+    it while waiting on a duplicate run and readmits if it then has to
+    train. A job's ticket holds only its memory and is handed to the job,
+    which takes a CPU slot when it starts.
+    """
+    options = options or AnalysisOptions()
+    dedupe = dedupe and not profile
     try:
-        # Generate unique run ID
-        run_id = str(uuid.uuid4())
+        # Features already added by chunked CSV encoding are not part of the input
+        exclude = RA_FEATURES if encoder is not None and encoder.rows else ()
+        content_key = await run_analysis_io(analysis_content_key, df, options, exclude)
         
-        # Encode RA features
-        df_encoded = encode_ra_features(df)
+        if idempotency_key is not None:
+            entry = analysis_cache.lookup_idempotency(idempotency_key)
+            if entry is not None:
+                if entry["content_key"] != content_key:
+                    analysis_cache.idempotency_conflicts += 1
+                    raise HTTPException(
+                        status_code=422,
+                        detail="Idempotency-Key was already used with a different request"
+                    )
+                replay = await _replay_run(entry["run_id"], content_key, job, media_type, ticket)
+                if replay is not None:
+                    analysis_cache.idempotent_replays += 1
+                    return replay
         
-        # Train simple model for predictions (placeholder)
-        feature_cols = ['RA', 'D', 'M', 'S', 'LR']
-        available_features = [col for col in feature_cols if col in df_encoded.columns]
+        model_blob = None
+        if dedupe:
+            cached_run_id = analysis_cache.lookup_run(content_key)
+            if cached_run_id is not None:
+                replay = await _replay_run(cached_run_id, content_key, job, media_type, ticket)
+                if replay is not None:
+                    analysis_cache.run_hits += 1
+                    return replay
+            analysis_cache.run_misses += 1
+            model_blob = await run_analysis_io(analysis_cache.lookup_model, content_key)
         
-        if not available_features:
-            raise HTTPException(status_code=400, detail="No valid features found for modeling")
+        if ticket is not None and ticket.released:
+            # Released while waiting on a duplicate that could not be reused;
+            # readmitted before the run exists, so a 429 leaves nothing queued
+            await ticket.readmit()
         
-        X = df_encoded[available_features].fillna(0)
-        
-        # Create synthetic target if not present (for demo)
-        if 'target' not in df_encoded.columns:
-            y = df_encoded[available_features[0]] * 0.8 + 0.1  # Synthetic target
-        else:
-            y = df_encoded['target']
+        metadata = {
+            **(metadata or {}),
+            "content_key": content_key,
+            "cache": "model_hit" if model_blob is not None else "miss"
+        }
+        if profile:
+            metadata["profiled"] = True
         
-        # Train model
-        model = RandomForestRegressor(n_estimators=10, random_state=42)
-        model.fit(X, y)
-        predictions = model.predict(X).tolist()
+        # Generate unique run ID
+        run_id = str(uuid.uuid4())
         
-        # Calculate metrics
-        ldrop_metrics = calculate_ldrop_metrics(df_encoded, predictions)
-        ra_score_deltas = calculate_ra_score_deltas(df_encoded)
+        if job:
+            # The job task cannot start before the next await, so the run
+            # directory is in place before the job touches it
+            task = job_scheduler.submit(
+                _run_analysis_job(run_id, df, options, metadata, encoder, model_blob, profile, ticket)
+            )
+            if ticket is not None:
+                # The job owns the reservation from here; released even if
+                # the task is cancelled before the job starts
+                task.add_done_callback(lambda _: ticket.release())
+                ticket.hand_off()
+        _create_run(run_id, content_key)
+        analysis_cache.remember_run(content_key, run_id)
+        if idempotency_key is not None:
+            analysis_cache.remember_idempotency(idempotency_key, run_id, content_key)
         
-        # Save artifacts
-        run_artifacts_dir = ARTIFACTS_DIR / run_id
-        run_artifacts_dir.mkdir(exist_ok=True)
+        if job:
+            return _job_response(run_id, "queued")
         
-        # Save results as JSON
-        results = {
-            "run_id": run_id,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "predictions": predictions,
-            "ldrop_metrics": ldrop_metrics,
-            "ra_score_deltas": ra_score_deltas,
-            "encoded_data": df_encoded.to_dict(orient='records')
+        results = await _run_analysis(run_id, df, options, metadata, encoder, model_blob, profile)
+        return _analyze_response(results, media_type)
+    
+    except HTTPException:
+        raise
+    except AnalysisInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+
+@app.get("/api/longevity/runs")
+async def list_runs(
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    status: Optional[Literal["done", "failed"]] = None,
+    deployed: Optional[bool] = None,
+    threshold_met: Optional[bool] = None,
+    metric: list[str] = Query([]),
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    token: str = Depends(verify_token)
+):
+    """
+    List and search runs from the run catalogue, newest first
+    - created_after/created_before filter on creation time (ISO 8601)
+    - status, deployed and threshold_met filter on run state
+    - metric=name:low:high filters on a metric range; either bound may be empty
+      (rows, mean_prediction, std_prediction, min_prediction, max_prediction,
+      samples_below_threshold, ra_mean, ra_std)
+    - Pages hold up to limit (at most RUNS_PAGE_MAX) runs; pass next_cursor back as cursor
+    """
+    metric_ranges = {}
+    for spec in metric:
+        parts = spec.split(":")
+        try:
+            if len(parts) != 3:
+                raise ValueError
+            metric_ranges[parts[0]] = tuple(float(bound) if bound else None for bound in parts[1:])
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid metric filter '{spec}', expected name:low:high")
+    
+    def utc(moment: Optional[datetime]) -> Optional[str]:
+        if moment is None:
+            return None
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.astimezone(timezone.utc).isoformat()
+    
+    try:
+        runs, next_cursor = await asyncio.to_thread(
+            run_catalogue.list_runs, utc(created_after), utc(created_before), status, deployed,
+            threshold_met, metric_ranges, min(limit, RUNS_PAGE_MAX), cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"runs": runs, "next_cursor": next_cursor}
+
+
+@app.get("/api/longevity/status/{run_id}")
+async def get_status(
+    run_id: str,
+    token: str = Depends(verify_token)
+):
+    """
+    Job status for a run
+    - Reports queued/running/done/failed with per-stage progress
+    """
+    validated_run_id = validate_run_id(run_id)
+    run_artifacts_dir = _run_dir(validated_run_id)
+    
+    if not run_artifacts_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Run ID {run_id} not found")
+    
+    status = read_run_status(validated_run_id)
+    if status is None:
+        # Runs created before status tracking are complete once results exist
+        done = (run_artifacts_dir / "results.json").exists()
+        status = {
+            "run_id": validated_run_id,
+            "status": "done" if done else "failed",
+            "stage": None,
+            "stages": {stage: "done" if done else "pending" for stage in ANALYSIS_STAGES},
+            "progress": 1.0 if done else 0.0
         }
-        
-        with open(run_artifacts_dir / "results.json", 'w') as f:
-            json.dump(results, f, indent=2)
-        
-        # Generate HTML report
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>RA Longevity Analysis Report - {run_id}</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                h1 {{ color: #333; }}
-                .metric {{ background: #f5f5f5; padding: 10px; margin: 10px 0; border-radius: 5px; }}
-                table {{ border-collapse: collapse; width: 100%; margin: 20px 0; }}
-                th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                th {{ background-color: #4CAF50; color: white; }}
-            </style>
-        </head>
-        <body>
-            <h1>RA Longevity Analysis Report</h1>
-            <div class="metric"><strong>Run ID:</strong> {run_id}</div>
-            <div class="metric"><strong>Timestamp:</strong> {results['timestamp']}</div>
-            
-            <h2>L-Drop Metrics</h2>
-            <table>
-                <tr><th>Metric</th><th>Value</th></tr>
-                {''.join(f'<tr><td>{k}</td><td>{v}</td></tr>' for k, v in ldrop_metrics.items())}
-            </table>
-            
-            <h2>RA Score Deltas</h2>
-            <table>
-                <tr><th>Metric</th><th>Value</th></tr>
-                {''.join(f'<tr><td>{k}</td><td>{v:.4f}</td></tr>' for k, v in ra_score_deltas.items())}
-            </table>
-            
-            <h2>Predictions Summary</h2>
-            <div class="metric">
-                <p>Total Predictions: {len(predictions)}</p>
-                <p>First 10 predictions: {predictions[:10]}</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        with open(run_artifacts_dir / "report.html", 'w') as f:
-            f.write(html_content)
-        
-        # Create DKIL lock file (always create for all runs)
-        # In production, you might want conditional creation based on thresholds
-        dkil_data = {
-            "run_id": run_id,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "integrity_check": True,
-            "threshold_met": ldrop_metrics['samples_below_threshold'] < len(predictions) * 0.3,
-            "ldrop_threshold": ldrop_metrics['ldrop_threshold'],
-            "samples_below_threshold": ldrop_metrics['samples_below_threshold']
+    return status
+
+
+@app.post("/api/longevity/append/{run_id}", response_model=AnalyzeResponse)
+async def append_data(
+    run_id: str,
+    request_data: AppendRequest,
+    media_type: str = Depends(response_media_type),
+    token: str = Depends(verify_token)
+):
+    """
+    Append time-series rows to a finished run
+    - Encodes only the new rows, continuing the run's saved encoder state
+    - Rescales the existing features to the updated RA range without re-encoding them
+    - Refits the model and rewrites the run's artifacts under the same run_id
+    - Accept negotiates the response format, and admission applies, as for analyze
+    """
+    validated_run_id = validate_run_id(run_id)
+    run_artifacts_dir = _run_dir(validated_run_id)
+    
+    if not run_artifacts_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Run ID {run_id} not found")
+    
+    status = read_run_status(validated_run_id)
+    if status is not None and status["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Run is {status['status']}; only finished runs can be extended")
+    encoder_file = run_artifacts_dir / "encoder_state.json"
+    if not encoder_file.exists():
+        raise HTTPException(status_code=409, detail="Run has no encoder state to append to")
+    if not request_data.data:
+        raise HTTPException(status_code=400, detail="No rows to append")
+    
+    with open(encoder_file, 'r') as f:
+        source_column = json.load(f)["source_column"]
+    new_df = pd.DataFrame(request_data.data)
+    if source_column not in new_df.columns:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Appended rows must include the source column '{source_column}'"
+        )
+    
+    # Claim the run before the first await so concurrent appends get a 409.
+    # Its content no longer matches the original input, so drop it from the dedupe index
+    if status is not None and status.get("content_key"):
+        analysis_cache.forget_run(status["content_key"])
+    update_run_status(
+        validated_run_id,
+        status="queued",
+        stage=None,
+        stages={stage: "pending" for stage in ANALYSIS_STAGES},
+        progress=0.0,
+        content_key=None
+    )
+    
+    try:
+        manifest = await run_analysis_io(_load_results_manifest, validated_run_id)
+        metadata = manifest.get("metadata", {})
+        metadata.pop("content_key", None)
+        metadata.pop("cache", None)
+        metadata.pop("stages", None)
+        append_info = metadata.get("append", {"appends": 0, "appended_rows": 0})
+        metadata["append"] = {
+            "appends": append_info["appends"] + 1,
+            "appended_rows": append_info["appended_rows"] + len(new_df),
+            "last_appended_at": datetime.now(timezone.utc).isoformat()
         }
         
-        with open(run_artifacts_dir / "dkil_lock.json", 'w') as f:
-            json.dump(dkil_data, f, indent=2)
-        
-        # Create bundle.zip
-        zip_path = run_artifacts_dir / "bundle.zip"
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in run_artifacts_dir.glob('*'):
-                if file_path.name != 'bundle.zip':
-                    zipf.write(file_path, file_path.name)
-        
-        return AnalyzeResponse(
-            run_id=run_id,
-            predictions=predictions,
-            ldrop_metrics=ldrop_metrics,
-            ra_score_deltas=ra_score_deltas,
-            timestamp=results['timestamp']
-        )
+        history_rows = manifest["data"]["rows"] if "data" in manifest else len(manifest.get("encoded_data", ()))
+        memory = estimate_analysis_memory(rows=history_rows + len(new_df), columns=len(new_df.columns))
+        async with admission.admit(memory):
+            results = await _run_pipeline(validated_run_id, metadata, _compute_append, validated_run_id, new_df)
+        return _analyze_response(results, media_type)
     
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+        # The run's previous artifacts are still intact, so it stays servable
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        update_run_status(
+            validated_run_id,
+            status="done",
+            stages={stage: "done" for stage in ANALYSIS_STAGES},
+            progress=1.0,
+            append_error=detail
+        )
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, AnalysisInputError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=500, detail=f"Append failed: {str(e)}")
 
 
 @app.get("/api/longevity/report/{run_id}")
 async def get_report(
     run_id: str,
     format: str = "json",
+    fields: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
     token: str = Depends(verify_token)
 ):
     """
     Retrieve JSON and HTML report from artifacts
     - Checks DKIL before serving if enabled
     - Returns JSON by default, HTML if format=html
+    - fields=ldrop_metrics,ra_score_deltas returns only those top-level fields
+    - offset/limit page through predictions and encoded_data
+    - JSON reports carry an ETag; a matching If-None-Match returns 304
+    - Accept selects JSON, Arrow IPC or MessagePack for the report (not for format=html)
+    - format=profile returns a profiled run's CPU and allocation summary and
+      format=pstats its raw cProfile data (PROFILE_TOKENS only)
     """
     try:
         # Validate run_id to prevent path traversal
         validated_run_id = validate_run_id(run_id)
         
-        run_artifacts_dir = ARTIFACTS_DIR / validated_run_id
+        run_artifacts_dir = _run_dir(validated_run_id)
         
         if not run_artifacts_dir.exists():
             raise HTTPException(status_code=404, detail=f"Run ID {run_id} not found")
         
+        artifact_retention.touch(validated_run_id)
+        
+        # Job-mode runs only have a report once they are done
+        status = read_run_status(validated_run_id)
+        if status is not None and status["status"] in ("queued", "running"):
+            return JSONResponse(status_code=202, content=status)
+        
+        # Profiles are kept for failed runs too, and are not gated by DKIL
+        if format.lower() in ("profile", "pstats"):
+            if token not in PROFILE_TOKENS:
+                raise HTTPException(status_code=403, detail="This token may not read profiles")
+            profile_dir = run_artifacts_dir / "profile"
+            if format.lower() == "pstats":
+                if not (profile_dir / "cpu.prof").exists():
+                    raise HTTPException(status_code=404, detail="Run was not profiled")
+                return FileResponse(profile_dir / "cpu.prof", media_type="application/octet-stream",
+                                    filename=f"{validated_run_id}.prof")
+            try:
+                return await asyncio.to_thread(_load_profile, validated_run_id)
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="Run was not profiled")
+        
+        if status is not None and status["status"] == "failed":
+            raise HTTPException(status_code=409, detail=f"Run failed: {status.get('error', 'Unknown error')}")
+        
         # Check DKIL if lock file exists
         dkil_file = run_artifacts_dir / "dkil_lock.json"
         if dkil_file.exists():
@@ -412,18 +5480,37 @@ async def get_report(
         # Return appropriate format
         if format.lower() == "html":
             html_file = run_artifacts_dir / "report.html"
+            await artifact_writer.flush(html_file)
             if not html_file.exists():
                 raise HTTPException(status_code=404, detail="HTML report not found")
             return FileResponse(html_file, media_type="text/html")
         else:
+            media_type = negotiate_media_type(accept)
             json_file = run_artifacts_dir / "results.json"
-            if not json_file.exists():
-                raise HTTPException(status_code=404, detail="JSON report not found")
+            selected = None if fields is None else {name.strip() for name in fields.split(",") if name.strip()}
+            
+            # Parsed results.json files are cached until the file changes
+            cached = report_cache.lookup(json_file)
+            if cached is None:
+                try:
+                    cached = await asyncio.to_thread(report_cache.load, json_file)
+                except FileNotFoundError:
+                    raise HTTPException(status_code=404, detail="JSON report not found")
+            results, version = cached
             
-            with open(json_file, 'r') as f:
-                data = json.load(f)
+            if selected is not None:
+                unknown = selected - ((set(results) - {"data"}) | {"predictions", "encoded_data"})
+                if unknown:
+                    raise HTTPException(status_code=400, detail=f"Unknown report fields: {sorted(unknown)}")
             
-            return JSONResponse(content=data)
+            etag = _report_etag(version, selected, offset, limit, media_type)
+            headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+            if if_none_match is not None and _etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+            
+            data = await asyncio.to_thread(_report_payload, validated_run_id, results, selected, offset, limit, True)
+            
+            return await asyncio.to_thread(encode_response, data, media_type, 200, headers)
     
     except HTTPException:
         raise
@@ -431,6 +5518,25 @@ async def get_report(
         raise HTTPException(status_code=500, detail=f"Failed to retrieve report: {str(e)}")
 
 
+def _report_etag(
+    version: str,
+    fields: Optional[set],
+    offset: int,
+    limit: Optional[int],
+    media_type: str = JSON_MEDIA_TYPE
+) -> str:
+    """Strong ETag for a report: the results.json version plus the projection, page and encoding"""
+    key = json.dumps([version, sorted(fields) if fields is not None else None, offset, limit, media_type])
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+
 @app.post("/api/longevity/deploy")
 async def deploy_model(
     deploy_request: DeployRequest,
@@ -448,7 +5554,7 @@ async def deploy_model(
         # Validate run_id to prevent path traversal
         validated_run_id = validate_run_id(run_id)
         
-        run_artifacts_dir = ARTIFACTS_DIR / validated_run_id
+        run_artifacts_dir = _run_dir(validated_run_id)
         
         if not run_artifacts_dir.exists():
             raise HTTPException(status_code=404, detail=f"Run ID {run_id} not found")
@@ -491,14 +5597,8 @@ async def deploy_model(
         }
         
         # Save deployment record
-        deployment_file = run_artifacts_dir / "deployment.json"
-        with open(deployment_file, 'w') as f:
-            json.dump(deployment_record, f, indent=2)
-        
-        # Update bundle.zip with deployment info
-        zip_path = run_artifacts_dir / "bundle.zip"
-        with zipfile.ZipFile(zip_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(deployment_file, deployment_file.name)
+        await artifact_writer.write_json(run_artifacts_dir / "deployment.json", deployment_record)
+        await asyncio.to_thread(_update_catalogue, run_catalogue.record_deployment, validated_run_id, deployment_record)
         
         return {
             "status": "success",
@@ -515,15 +5615,311 @@ async def deploy_model(
         raise HTTPException(status_code=500, detail=f"Deployment failed: {str(e)}")
 
 
-# Mount artifacts directory as static files
-app.mount("/artifacts", StaticFiles(directory=str(ARTIFACTS_DIR)), name="artifacts")
+@app.post("/api/longevity/predict/{run_id}", response_model=PredictResponse)
+async def predict(
+    run_id: str,
+    request_data: PredictRequest,
+    token: str = Depends(verify_token)
+):
+    """
+    Predict with a deployed run's model
+    - Only runs deployed through /api/longevity/deploy serve predictions
+    - New rows get the run's RA encoding; rows that already carry the
+      model's feature columns are used as they are
+    - Models stay loaded in a bounded LRU pool (MODEL_POOL_BYTES)
+    - Concurrent requests for one model are micro-batched into a single
+      predict call (PREDICT_BATCH_WAIT_MS / PREDICT_BATCH_MAX_ROWS)
+    """
+    validated_run_id = validate_run_id(run_id)
+    run_artifacts_dir = _run_dir(validated_run_id)
+    
+    if not run_artifacts_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Run ID {run_id} not found")
+    if not (run_artifacts_dir / "deployment.json").exists():
+        raise HTTPException(status_code=409, detail="Run is not deployed")
+    if not request_data.data:
+        raise HTTPException(status_code=400, detail="No rows to predict")
+    
+    deployed = model_pool.lookup(validated_run_id)
+    if deployed is None:
+        try:
+            deployed = await asyncio.to_thread(model_pool.load, validated_run_id)
+        except FileNotFoundError:
+            raise HTTPException(status_code=409, detail="Run has no persisted model")
+    
+    try:
+        predictions = await deployed.batcher.predict(pd.DataFrame(request_data.data))
+    except AnalysisInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    
+    return PredictResponse(run_id=validated_run_id, predictions=predictions)
+
+
+@app.get("/artifacts/{run_id}/bundle.zip")
+async def download_bundle(
+    run_id: str,
+    compression: Optional[Literal["deflate", "stored"]] = None,
+    level: Optional[int] = Query(None, ge=0, le=9)
+):
+    """
+    Download a run's artifacts as a zip, built on request
+    - Streamed to the client as it is compressed
+    - compression=stored skips compression; level sets the deflate level
+    - Served from the bundle cache when BUNDLE_CACHE_BYTES is set
+    """
+    validated_run_id = validate_run_id(run_id)
+    run_artifacts_dir = _run_dir(validated_run_id)
+    
+    if not run_artifacts_dir.exists():
+        raise HTTPException(status_code=404, detail=f"Run ID {run_id} not found")
+    status = read_run_status(validated_run_id)
+    if status is not None and status["status"] in ("queued", "running"):
+        return JSONResponse(status_code=202, content=status)
+    
+    artifact_retention.touch(validated_run_id)
+    compression = compression or BUNDLE_COMPRESSION
+    level = BUNDLE_COMPRESSLEVEL if level is None else level
+    files = await asyncio.to_thread(_bundle_files, run_artifacts_dir)
+    headers = {"Content-Disposition": f'attachment; filename="{validated_run_id}.zip"'}
+    
+    if bundle_cache.enabled:
+        key = bundle_key(files, compression, level)
+        cached = bundle_cache.lookup(validated_run_id, key)
+        if cached is not None:
+            return FileResponse(cached, media_type="application/zip", headers=headers)
+        chunks = bundle_cache.stream_and_store(
+            validated_run_id, key, _timed_chunks("bundle", stream_bundle(files, compression, level))
+        )
+    else:
+        chunks = _timed_chunks("bundle", stream_bundle(files, compression, level))
+    return StreamingResponse(chunks, media_type="application/zip", headers=headers)
+
+
+@app.get("/artifacts/{run_id}/{file_path:path}")
+async def get_artifact(run_id: str, file_path: str):
+    """
+    Serve a file from a run's artifacts directory
+    - Maps the public /artifacts/{run_id}/... URL onto the sharded layout
+    """
+    validated_run_id = validate_run_id(run_id)
+    run_artifacts_dir = _run_dir(validated_run_id).resolve()
+    path = (run_artifacts_dir / file_path).resolve()
+    
+    # Stay inside the run directory and never serve in-progress temp files.
+    # Profiles are only served to PROFILE_TOKENS, through the report endpoint
+    parts = Path(file_path).parts
+    if (not path.is_relative_to(run_artifacts_dir) or any(part.startswith('.') for part in parts)
+            or parts[:1] == ("profile",)):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if path.name == "report.html":
+        await artifact_writer.flush(_run_dir(validated_run_id) / "report.html")
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Not Found")
+    artifact_retention.touch(validated_run_id)
+    return FileResponse(path)
+
+
+# Production Server
+# Index of this server worker under PreforkServer; None when run any other way
+SERVER_WORKER: Optional[int] = None
+
+
+class PreforkServer:
+    """
+    Production server: one parent process forking uvicorn workers.
+
+    The parent imports the analysis stack, binds the listening socket and
+    loads the deployed models before it forks, so every worker shares that
+    memory copy-on-write and accepts on the same socket. The parent then
+    only supervises:
+    - a worker that exits unexpectedly is forked again
+    - SIGHUP reloads the deployed models and replaces every worker; the
+      old ones stop accepting and finish their in-flight requests
+    - SIGTERM or SIGINT drains every worker and exits
+    A draining worker that is still busy after ``graceful_timeout`` seconds
+    is killed.
+    """
+
+    def __init__(self, host: str, port: int, workers: int, graceful_timeout: float):
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.graceful_timeout = max(0.0, graceful_timeout)
+        self._socket = None
+        self._children: Dict[int, int] = {}
+        self._started: Dict[int, float] = {}
+        self._deadlines: Dict[int, float] = {}
+        self._respawn: Dict[int, float] = {}
+        self._signals: deque = deque()
+        self._stopping = False
+
+    def run(self):
+        import signal
+        import socket
+        
+        self._socket = socket.create_server((self.host, self.port), backlog=2048)
+        self.preload()
+        for index in range(self.workers):
+            self._spawn(index)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        
+        while self._children or self._respawn:
+            while self._signals:
+                if self._signals.popleft() == signal.SIGHUP:
+                    self.reload()
+                else:
+                    self.stop()
+            self._reap()
+            now = time.monotonic()
+            for index, at in list(self._respawn.items()):
+                if at <= now:
+                    del self._respawn[index]
+                    self._spawn(index)
+            for pid, deadline in list(self._deadlines.items()):
+                if deadline <= now:
+                    self._kill(pid, signal.SIGKILL)
+            time.sleep(0.1)
+        self._socket.close()
+
+    def preload(self):
+        """Import the analysis stack and load deployed models in the parent; blocking"""
+        for name in WARMUP_PRELOAD:
+            importlib.import_module(name)
+        model_pool.preload()
+        # SQLite connections must not cross a fork; workers reconnect on first use
+        run_catalogue.close()
+        # Objects that exist now are never collected, so the collector does not
+        # write to (and so copy) the pages the workers share
+        gc.collect()
+        gc.freeze()
+
+    def reload(self):
+        """Load newly deployed models and replace every worker with a fresh fork"""
+        self.preload()
+        for pid, index in list(self._children.items()):
+            if pid not in self._deadlines:
+                self._spawn(index)
+                self._drain(pid)
+
+    def stop(self):
+        """Drain every worker; run returns once they have exited"""
+        self._stopping = True
+        self._respawn.clear()
+        for pid in list(self._children):
+            if pid not in self._deadlines:
+                self._drain(pid)
+
+    def _drain(self, pid: int):
+        import signal
+        
+        # uvicorn stops accepting on SIGTERM and waits for in-flight requests
+        self._deadlines[pid] = time.monotonic() + self.graceful_timeout + 5
+        self._kill(pid, signal.SIGTERM)
+
+    def _kill(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while self._children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            index = self._children.pop(pid, None)
+            started = self._started.pop(pid, 0.0)
+            drained = self._deadlines.pop(pid, None) is not None
+            if index is not None and not drained and not self._stopping:
+                # Back off a worker that dies straight after starting
+                delay = 1.0 if time.monotonic() - started < 1.0 else 0.0
+                self._respawn[index] = time.monotonic() + delay
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = index
+            self._started[pid] = time.monotonic()
+            return
+        code = 1
+        try:
+            self._serve(index)
+            code = 0
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+
+    def _serve(self, index: int):
+        """Worker process: serve the app on the inherited socket until drained"""
+        global SERVER_WORKER
+        import signal
+        import uvicorn
+        
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        SERVER_WORKER = index
+        artifact_retention.evict = index == 0
+        config = uvicorn.Config(app, lifespan="on", timeout_graceful_shutdown=self.graceful_timeout)
+        uvicorn.Server(config).run(sockets=[self._socket])
+
+
+def serve(workers: int = SERVER_WORKERS):
+    """
+    Run the production server (python main.py serve).
+
+    ``workers`` defaults to one per available core. Unless ANALYSIS_WORKERS,
+    ANALYSIS_QUEUE_SIZE and MAX_CONCURRENT_JOBS are set, each worker's
+    analysis pool and job scheduler get an equal share of the cores; unless
+    ADMISSION_CPU_SLOTS and ADMISSION_MEMORY_BYTES are set, its admission
+    controller gets the pool's capacity and an equal share of the memory;
+    unless MODEL_THREADS is set, each fit gets an equal share of the cores
+    across every analysis worker of every server worker.
+    """
+    cores = available_cores()
+    workers = workers or cores
+    if "ANALYSIS_WORKERS" not in os.environ:
+        analysis_pool.max_workers = max(1, cores // workers)
+    if "ANALYSIS_QUEUE_SIZE" not in os.environ:
+        analysis_pool.queue_size = analysis_pool.max_workers * 4
+    if "MAX_CONCURRENT_JOBS" not in os.environ:
+        job_scheduler.max_concurrent = analysis_pool.max_workers
+    if "ADMISSION_CPU_SLOTS" not in os.environ:
+        admission.cpu_slots = analysis_pool.max_workers + analysis_pool.queue_size
+    if "ADMISSION_MEMORY_BYTES" not in os.environ:
+        admission.memory_bytes = available_memory() // 2 // workers
+    if "MODEL_THREADS" not in os.environ:
+        global MODEL_THREADS
+        MODEL_THREADS = max(1, cores // (workers * analysis_pool.max_workers))
+        # Analysis workers start from a fresh interpreter and read it from the environment
+        os.environ["MODEL_THREADS"] = str(MODEL_THREADS)
+    PreforkServer(SERVER_HOST, SERVER_PORT, workers, SERVER_GRACEFUL_TIMEOUT).run()
+
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 
 if __name__ == "__main__":
-    # Run the server
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
-    )
+    if sys.argv[1:2] == ["serve"]:
+        # Imported as "main" so the workers and the analysis pool share one copy of the module
+        from main import serve
+        
+        serve()
+    else:
+        import uvicorn
+        
+        # Development server with auto-reload
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True
+        )
@@ -14,7 +14,7 @@ import os
 # Add parent directory to path to import main
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from main import app, ARTIFACTS_DIR
+from main import app, ARTIFACTS_DIR, _run_dir
 
 # Test client
 client = TestClient(app)
@@ -27,6 +27,15 @@ AUTH_HEADERS = {"Authorization": f"Bearer {TEST_TOKEN}"}
 NONEXISTENT_RUN_ID = "00000000-0000-0000-0000-000000000000"
 
 
+@pytest.fixture(autouse=True)
+def isolated_analysis_cache(tmp_path, monkeypatch):
+    """Give every test an empty analysis cache so identical payloads are analysed afresh"""
+    import main
+    cache = main.AnalysisCache(tmp_path / "cache", 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+    monkeypatch.setattr(main, "analysis_cache", cache)
+    return cache
+
+
 def create_test_analysis():
     """Helper function to create a test analysis and return run_id"""
     test_data = {
@@ -344,11 +353,60 @@ def test_ra_score_deltas_calculation():
     assert "ra_stability" in deltas
 
 
+def test_streaming_metrics_match_single_shot_when_chunked_or_merged():
+    """Chunked and merged metric accumulators agree with single-shot reductions"""
+    from main import (
+        LdropAccumulator, QuantileSketch, SKETCH_RELATIVE_ACCURACY, calculate_ldrop_metrics,
+        calculate_ra_score_deltas, encode_ra_features
+    )
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(7)
+    predictions = rng.normal(0.5, 0.3, 10_001)
+    single = calculate_ldrop_metrics(None, predictions, chunk_rows=len(predictions))
+    chunked = calculate_ldrop_metrics(None, predictions, chunk_rows=333)
+    merged = LdropAccumulator()
+    for part in np.array_split(predictions, 4):
+        worker = LdropAccumulator()
+        worker.update(part)
+        merged.merge(worker)
+
+    series = pd.Series(predictions)
+    for metrics in (single, chunked, merged.metrics()):
+        assert metrics["mean_prediction"] == pytest.approx(series.mean(), rel=1e-12)
+        assert metrics["std_prediction"] == pytest.approx(series.std(), rel=1e-12)
+        assert metrics["min_prediction"] == series.min()
+        assert metrics["max_prediction"] == series.max()
+        assert metrics["samples_below_threshold"] == int((series < 0.5).sum())
+        # Sketch buckets are exact counts, so quantiles do not depend on chunking
+        for name in ("p50_prediction", "p95_prediction", "p99_prediction"):
+            assert metrics[name] == single[name]
+    for q in (0.5, 0.95, 0.99):
+        exact = np.quantile(predictions, q, method="lower")
+        assert abs(single[f"p{round(q * 100)}_prediction"] - exact) <= SKETCH_RELATIVE_ACCURACY * abs(exact)
+
+    sketch = QuantileSketch.from_state(merged.sketch.state_dict())
+    assert sketch.quantile(0.95) == single["p95_prediction"]
+    assert np.isnan(calculate_ldrop_metrics(None, [0.3])["std_prediction"])
+
+    df_encoded = encode_ra_features(pd.DataFrame({"value": rng.normal(size=5_000).cumsum()}))
+    deltas = calculate_ra_score_deltas(df_encoded, chunk_rows=97)
+    assert deltas["ra_mean"] == pytest.approx(df_encoded["RA"].mean(), rel=1e-12)
+    assert deltas["ra_std"] == pytest.approx(df_encoded["RA"].std(), rel=1e-12)
+    assert deltas["ra_stability"] == pytest.approx(df_encoded["S"].mean(), rel=1e-12)
+
+
 def test_artifacts_created():
     """Test that artifacts are created after analysis"""
+    import main
+    
     run_id = create_test_analysis()
     
-    run_dir = ARTIFACTS_DIR / run_id
+    run_dir = _run_dir(run_id)
+    
+    # report.html is written behind the response; wait for the writer queue
+    main.artifact_writer.close()
     
     # Check that artifacts directory exists
     assert run_dir.exists()
@@ -356,7 +414,8 @@ def test_artifacts_created():
     # Check that required files exist
     assert (run_dir / "results.json").exists()
     assert (run_dir / "report.html").exists()
-    assert (run_dir / "bundle.zip").exists()
+    # bundle.zip is built on download, not at analysis time
+    assert not (run_dir / "bundle.zip").exists()
     
     # Check if DKIL lock was created (depends on threshold)
     # This may or may not exist depending on the data
@@ -376,6 +435,1487 @@ def test_dkil_check():
         assert "error" in dkil_data or "integrity_check" in dkil_data
 
 
+
+def test_worker_pool_stats():
+    """Test that analyses run in the worker pool and its stats are exposed"""
+    create_test_analysis()
+    
+    response = client.get("/api/longevity/stats", headers=AUTH_HEADERS)
+    assert response.status_code == 200
+    workers = response.json()["workers"]
+    
+    assert workers["completed"] >= 1
+    assert workers["queued"] == 0
+    assert 0 <= workers["utilization"] <= 1
+    assert "avg_utilization" in workers
+
+
+def test_worker_pool_rejects_when_queue_full():
+    """Test that the worker pool sheds submissions beyond its queue size"""
+    import asyncio
+    from fastapi import HTTPException
+    from main import AnalysisWorkerPool
+    
+    pool = AnalysisWorkerPool(max_workers=1, queue_size=0)
+    pool._in_flight = 1  # Simulate a job already occupying the only slot
+    
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(pool.run(sum, [1, 2]))
+    
+    assert exc_info.value.status_code == 503
+    assert pool.stats()["rejected"] == 1
+
+
+def test_worker_pool_replaces_broken_executor():
+    """Test that a crashed worker shuts the broken pool down and later jobs get a fresh one"""
+    import asyncio
+    from concurrent.futures.process import BrokenProcessPool
+    from main import AnalysisWorkerPool
+    
+    pool = AnalysisWorkerPool(max_workers=1, queue_size=0)
+    try:
+        asyncio.run(pool.run(sum, [1, 2]))
+        broken = pool._executor
+        shutdowns = []
+        broken_shutdown = broken.shutdown
+        broken.shutdown = lambda **kwargs: (shutdowns.append(kwargs), broken_shutdown(**kwargs))
+        with pytest.raises(BrokenProcessPool):
+            asyncio.run(pool.run(os._exit, 1))
+        
+        assert pool._executor is None
+        assert shutdowns == [{"wait": False, "cancel_futures": True}]
+        assert asyncio.run(pool.run(sum, [1, 2])) == 3
+        assert pool.stats()["failed"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_analyze_job_mode():
+    """Test job mode returns a queued run_id that can be polled to completion"""
+    import time
+    
+    test_data = {
+        "data": [{"value": v, "metric": v * 2} for v in range(10, 60, 5)],
+        "mode": "tabular"
+    }
+    
+    # Keep one event loop alive so the background job can finish
+    with TestClient(app) as job_client:
+        response = job_client.post(
+            "/api/longevity/analyze?job=true",
+            headers=AUTH_HEADERS,
+            json=test_data
+        )
+        assert response.status_code == 202
+        data = response.json()
+        assert data["status"] == "queued"
+        run_id = data["run_id"]
+        
+        status = None
+        for _ in range(300):
+            status = job_client.get(f"/api/longevity/status/{run_id}", headers=AUTH_HEADERS).json()
+            if status["status"] in ("done", "failed"):
+                break
+            time.sleep(0.05)
+        
+        assert status["status"] == "done"
+        assert status["progress"] == 1.0
+        assert all(state == "done" for state in status["stages"].values())
+        
+        report = job_client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS)
+        assert report.status_code == 200
+        assert len(report.json()["predictions"]) == 10
+
+
+def test_report_pending_job_returns_202():
+    """Test that the report endpoint reports status while a job is not done"""
+    import uuid
+    from main import update_run_status, _run_dir
+    
+    run_id = str(uuid.uuid4())
+    _run_dir(run_id).mkdir(parents=True)
+    update_run_status(run_id, status="running", stage="train")
+    
+    response = client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS)
+    assert response.status_code == 202
+    assert response.json()["stage"] == "train"
+    
+    update_run_status(run_id, status="failed", error="boom")
+    response = client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS)
+    assert response.status_code == 409
+
+
+def test_job_scheduler_rejects_when_full():
+    """Test that the job scheduler bounds running plus pending jobs"""
+    import asyncio
+    from fastapi import HTTPException
+    from main import AnalysisJobScheduler
+    
+    async def scenario():
+        scheduler = AnalysisJobScheduler(max_concurrent=1, max_pending=1)
+        release = asyncio.Event()
+        
+        scheduler.submit(release.wait())
+        scheduler.submit(release.wait())
+        with pytest.raises(HTTPException) as exc_info:
+            scheduler.submit(release.wait())
+        assert exc_info.value.status_code == 503
+        
+        await asyncio.sleep(0)
+        stats = scheduler.stats()
+        assert stats["running"] == 1
+        assert stats["pending"] == 1
+        
+        release.set()
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["running"] == 0
+    
+    asyncio.run(scenario())
+
+
+def test_admission_controller_queues_in_order_and_sheds_with_retry_after():
+    """Test CPU-slot and memory budgets, FIFO waiting and 429 shedding"""
+    import asyncio
+    from fastapi import HTTPException
+    from main import AdmissionController
+
+    async def scenario():
+        admission = AdmissionController(cpu_slots=2, memory_bytes=100, max_wait=0.2)
+        big = admission.admit(80)
+        await big.__aenter__()
+
+        # Over the memory budget: waits, and a later small request may not overtake it
+        order = []
+
+        async def waiter(name, memory):
+            async with admission.admit(memory):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        queued = [asyncio.create_task(waiter("second", 60)), asyncio.create_task(waiter("third", 10))]
+        await asyncio.sleep(0.01)
+        assert admission.stats()["waiting"] == 2
+        big.release()
+        await asyncio.gather(*queued)
+        assert order == ["second", "third"]
+
+        # Nothing frees up within max_wait: shed with Retry-After
+        async with admission.admit(10), admission.admit(10):
+            with pytest.raises(HTTPException) as exc_info:
+                async with admission.admit(10):
+                    pass
+        assert exc_info.value.status_code == 429
+        assert int(exc_info.value.headers["Retry-After"]) >= 1
+
+        # Larger than the whole budget: admitted alone
+        async with admission.admit(1000):
+            pass
+
+        stats = admission.stats()
+        assert stats["running"] == 0
+        assert stats["reserved_memory_bytes"] == 0
+        assert stats["waiting"] == 0
+        assert stats["shed"] == 1
+        assert stats["admitted"] == 6
+
+    asyncio.run(scenario())
+
+
+def test_admission_lets_reserved_jobs_take_slots_ahead_of_memory_waiters():
+    """Test that a job holding its memory is not queued behind requests waiting for that memory"""
+    import asyncio
+    from main import AdmissionController
+
+    async def scenario():
+        admission = AdmissionController(cpu_slots=1, memory_bytes=100, max_wait=1)
+        job = admission.admit(100, slot=False, max_wait=0)
+        await job.__aenter__()
+        request = asyncio.create_task(admission.admit(50).__aenter__())
+        await asyncio.sleep(0.01)
+        assert admission.stats()["waiting"] == 1
+
+        await asyncio.wait_for(job.take_slot(), 0.5)
+        assert admission.stats()["running"] == 1 and admission.stats()["reserved"] == 0
+        job.release()
+        (await request).release()
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["running"] == 0 and stats["reserved_memory_bytes"] == 0 and stats["shed"] == 0
+
+
+def test_analyze_is_shed_while_cheap_endpoints_stay_available(monkeypatch):
+    """Test that a full admission budget sheds analyses with 429 but not cheap endpoints"""
+    import asyncio
+    import main
+
+    run_id = create_test_analysis()
+    assert main.admission.stats()["running"] == 0
+
+    admission = main.AdmissionController(cpu_slots=1, memory_bytes=1024 ** 3, max_wait=0.05)
+    monkeypatch.setattr(main, "admission", admission)
+    held = admission.admit(0)
+    asyncio.run(held.__aenter__())
+
+    test_data = {"data": [{"value": v} for v in range(10, 30)], "dedupe": False}
+    response = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json=test_data)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    assert client.get("/").status_code == 200
+    assert client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS).status_code == 200
+    stats = client.get("/api/longevity/stats", headers=AUTH_HEADERS).json()["admission"]
+    assert stats["shed"] == 1
+    assert stats["running"] == 1
+
+    held.release()
+    response = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json=test_data)
+    assert response.status_code == 200
+    assert admission.stats()["running"] == 0
+
+
+def test_jobs_reserve_memory_when_queued_and_take_a_slot_when_started(monkeypatch):
+    """Test that ?job=true returns 202 with every slot busy, holding its memory until the job finishes"""
+    import asyncio
+    import time
+    import main
+
+    admission = main.AdmissionController(cpu_slots=1, memory_bytes=1024 ** 3, max_wait=0.05)
+    monkeypatch.setattr(main, "admission", admission)
+    held = admission.admit(0)
+    asyncio.run(held.__aenter__())
+
+    test_data = {"data": [{"value": v} for v in range(10, 30)], "dedupe": False}
+    # Keep one event loop alive so the background job can finish
+    with TestClient(app) as job_client:
+        response = job_client.post("/api/longevity/analyze?job=true", headers=AUTH_HEADERS, json=test_data)
+        assert response.status_code == 202
+        run_id = response.json()["run_id"]
+        time.sleep(0.2)
+        status = job_client.get(f"/api/longevity/status/{run_id}", headers=AUTH_HEADERS).json()
+        assert status["status"] == "queued"
+        stats = admission.stats()
+        # The queued job counts its memory but no CPU slot
+        assert stats["reserved"] == 1 and stats["reserved_memory_bytes"] > 0
+        assert stats["running"] == 1 and stats["waiting"] == 1 and stats["shed"] == 0
+
+        held.release()
+        for _ in range(300):
+            status = job_client.get(f"/api/longevity/status/{run_id}", headers=AUTH_HEADERS).json()
+            if status["status"] in ("done", "failed"):
+                break
+            time.sleep(0.05)
+        assert status["status"] == "done"
+    stats = admission.stats()
+    assert stats["running"] == 0 and stats["reserved"] == 0 and stats["reserved_memory_bytes"] == 0
+    assert stats["admitted"] == 2
+
+
+def test_job_submissions_are_shed_once_the_memory_budget_is_full(monkeypatch):
+    """Test that ?job=true is rejected with 429 instead of queueing past the memory budget"""
+    import asyncio
+    import main
+
+    admission = main.AdmissionController(cpu_slots=4, memory_bytes=1024 ** 2, max_wait=5)
+    monkeypatch.setattr(main, "admission", admission)
+    held = admission.admit(1024 ** 2, slot=False)
+    asyncio.run(held.__aenter__())
+    submitted = main.job_scheduler.stats()["submitted"]
+
+    test_data = {"data": [{"value": v} for v in range(10, 30)], "dedupe": False}
+    response = client.post("/api/longevity/analyze?job=true", headers=AUTH_HEADERS, json=test_data)
+    # Shed at once rather than after max_wait
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert main.job_scheduler.stats()["submitted"] == submitted
+    stats = admission.stats()
+    assert stats["shed"] == 1 and stats["waiting"] == 0 and stats["reserved"] == 1
+
+    held.release()
+    assert admission.stats()["reserved_memory_bytes"] == 0
+
+
+def test_waiting_on_a_duplicate_run_releases_admission(monkeypatch):
+    """Test that a request polling an in-progress duplicate holds no slot, and readmits to train"""
+    import asyncio
+    import uuid
+    import pandas as pd
+    import main
+
+    df = pd.DataFrame({"value": [float(v) for v in range(40, 60)]})
+    options = main.AnalysisOptions()
+    content_key = main.analysis_content_key(df, options)
+    duplicate = str(uuid.uuid4())
+    main._create_run(duplicate, content_key)
+    main.analysis_cache.remember_run(content_key, duplicate)
+
+    async def scenario():
+        admission = main.AdmissionController(cpu_slots=1, memory_bytes=1024 ** 3, max_wait=0.05)
+        ticket = admission.admit(0)
+        await ticket.__aenter__()
+        request = asyncio.create_task(main._process_analysis(df, options, ticket=ticket))
+        await asyncio.sleep(0.3)
+        # The only slot is free for other analyses while the request waits
+        assert admission.stats()["running"] == 0
+        async with admission.admit(0):
+            pass
+
+        main.update_run_status(duplicate, status="failed")
+        response = await request
+        ticket.release()
+        return response, admission.stats()
+
+    response, stats = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert json.loads(response.body)["run_id"] != duplicate
+    assert stats["admitted"] == 3 and stats["running"] == 0
+
+
+
+def test_csv_chunked_ingestion():
+    """Test that chunked CSV parsing matches a one-shot parse"""
+    import io
+    import pandas as pd
+    from main import read_csv_chunked
+    
+    csv_bytes = b"value,metric,label\n10,20,a\n15,25,b\n20,,c\n25,35,d\n30,40,e"
+    
+    df, ingest = read_csv_chunked(io.BytesIO(csv_bytes), chunk_rows=2)
+    expected = pd.read_csv(io.BytesIO(csv_bytes))
+    
+    assert ingest["rows"] == 5
+    assert ingest["chunks"] == 3
+    assert ingest["typed"]
+    assert ingest["peak_memory_bytes"] > 0
+    assert df["value"].dtype == "float64"
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+    
+    # Encoding chunk by chunk during the parse matches encoding afterwards
+    from main import RAEncoder, encode_ra_features
+    encoded, ingest = read_csv_chunked(io.BytesIO(csv_bytes), chunk_rows=2, encoder=RAEncoder())
+    assert ingest["encoded_in_chunks"]
+    pd.testing.assert_frame_equal(encoded, encode_ra_features(expected), check_dtype=False)
+
+
+def test_csv_upload_metadata_and_size_limit(monkeypatch):
+    """Test CSV ingest metadata in the response and the upload size limit"""
+    import main
+    
+    csv_content = "value,metric\n10,20\n15,25\n20,30\n25,35\n30,40"
+    files = {"file": ("test_data.csv", csv_content, "text/csv")}
+    
+    response = client.post("/api/longevity/analyze/csv", headers=AUTH_HEADERS, files=files)
+    assert response.status_code == 200
+    ingest = response.json()["metadata"]["ingest"]
+    assert ingest["rows"] == 5
+    assert ingest["upload_bytes"] == len(csv_content)
+    assert ingest["peak_memory_bytes"] > 0
+    
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 10)
+    response = client.post("/api/longevity/analyze/csv", headers=AUTH_HEADERS, files=files)
+    assert response.status_code == 413
+
+
+
+def test_ra_encoder_chunked_matches_one_shot():
+    """Test that the incremental encoder gives the same features in chunks"""
+    import numpy as np
+    from main import RAEncoder
+    
+    values = np.sin(np.arange(100) / 7.0) * 50 + np.arange(100)
+    values[[10, 11, 40]] = np.nan
+    
+    one_shot = RAEncoder().encode(values)
+    
+    encoder = RAEncoder()
+    raw = np.vstack([encoder.partial_encode(values[i:i + 6]) for i in range(0, 100, 6)])
+    chunked = encoder.normalize(raw)
+    
+    np.testing.assert_array_equal(chunked, one_shot)
+    
+    # State survives a JSON round trip
+    restored = RAEncoder.from_state(json.loads(json.dumps(RAEncoder().state_dict())))
+    assert restored.rows == 0
+
+
+def test_ra_encoder_matches_pandas_reference():
+    """Test the encoder against the pandas rolling/ewm definitions"""
+    import numpy as np
+    import pandas as pd
+    from main import encode_ra_features
+    
+    df = pd.DataFrame({'value': [10, 14, 9, 25, 30, 28, 31, 45]})
+    encoded = encode_ra_features(df)
+    
+    ra = (df['value'] - df['value'].min()) / (df['value'].max() - df['value'].min() + 1e-10)
+    d = ra.diff().fillna(0)
+    np.testing.assert_allclose(encoded['RA'], ra)
+    np.testing.assert_allclose(encoded['D'], d, atol=1e-12)
+    np.testing.assert_allclose(encoded['M'], d.rolling(window=3, min_periods=1).mean(), atol=1e-12)
+    np.testing.assert_allclose(encoded['S'], ra.rolling(window=3, min_periods=1).std().fillna(0), atol=1e-12)
+    np.testing.assert_allclose(encoded['LR'], ra.ewm(span=3).mean(), atol=1e-12)
+
+
+def test_append_extends_run_like_one_shot():
+    """Test that appending rows gives the features of encoding all rows at once"""
+    import numpy as np
+    import pandas as pd
+    from main import encode_ra_features, encode_ra_matrix, RA_FEATURES
+    
+    rows = [{"value": v} for v in [10, 14, 9, 25, 30, 28, 31, 45]]
+    
+    response = client.post(
+        "/api/longevity/analyze",
+        headers=AUTH_HEADERS,
+        json={"data": rows[:5], "mode": "time_series"}
+    )
+    run_id = response.json()["run_id"]
+    
+    response = client.post(
+        f"/api/longevity/append/{run_id}",
+        headers=AUTH_HEADERS,
+        json={"data": rows[5:]}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["run_id"] == run_id
+    assert len(data["predictions"]) == 8
+    assert data["metadata"]["append"]["appended_rows"] == 3
+    
+    report = client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS).json()
+    appended = pd.DataFrame(report["encoded_data"])
+    expected = encode_ra_features(pd.DataFrame(rows))
+    for name in RA_FEATURES:
+        np.testing.assert_allclose(appended[name], expected[name], atol=1e-12)
+    
+    # Rows without the source column are rejected and the run stays servable
+    response = client.post(
+        f"/api/longevity/append/{run_id}",
+        headers=AUTH_HEADERS,
+        json={"data": [{"other": 1}]}
+    )
+    assert response.status_code == 400
+    assert client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS).status_code == 200
+    
+    # A wide run keeps its options and RA_<col> features, recomputed over every row
+    wide_rows = [{**row, "other": float(row["value"] * 3 % 7)} for row in rows]
+    response = client.post(
+        "/api/longevity/analyze?dedupe=false",
+        headers=AUTH_HEADERS,
+        json={"data": wide_rows[:5], "mode": "time_series", "encode_columns": ["value", "other"],
+              "feature_dtype": "float32"}
+    )
+    wide_id = response.json()["run_id"]
+    features = json.loads((_run_dir(wide_id) / "model.json").read_text())["features"]
+    assert len(features) == 15
+    
+    response = client.post(f"/api/longevity/append/{wide_id}", headers=AUTH_HEADERS, json={"data": wide_rows[5:]})
+    assert response.status_code == 200
+    model = json.loads((_run_dir(wide_id) / "model.json").read_text())
+    assert model["features"] == features
+    assert model["options"]["mode"] == "time_series"
+    assert model["options"]["encode_columns"] == ["value", "other"]
+    assert model["options"]["feature_dtype"] == "float32"
+    
+    report = client.get(f"/api/longevity/report/{wide_id}", headers=AUTH_HEADERS).json()
+    appended = pd.DataFrame(report["encoded_data"])
+    expected = encode_ra_matrix(pd.DataFrame(wide_rows), ["value", "other"], dtype=np.dtype("float32"))
+    np.testing.assert_allclose(appended[list(expected.columns)], expected, atol=1e-6)
+    
+    # Appended rows must carry the encoded columns
+    response = client.post(f"/api/longevity/append/{wide_id}", headers=AUTH_HEADERS, json={"data": [{"value": 50}]})
+    assert response.status_code == 400
+
+
+
+def test_panel_encoding_matches_per_entity_encoding():
+    """Test grouped time-series encoding against encoding each entity alone"""
+    import numpy as np
+    import pandas as pd
+    from main import encode_ra_panel, encode_ra_features, RA_FEATURES
+    
+    df = pd.DataFrame({
+        'sensor': ['b', 'a', 'b', 'a', 'b', 'a', 'b', 'c'],
+        'ts': [4, 3, 1, 1, 2, 2, 3, 1],
+        'value': [40.0, 9.0, 10.0, 1.0, 25.0, np.nan, 30.0, 5.0]
+    })
+    
+    encoded, order, group_starts, entities = encode_ra_panel(df, 'sensor', 'ts')
+    assert entities == ['b', 'a', 'c']
+    
+    for entity, start in zip(entities, group_starts):
+        series = df[df['sensor'] == entity].sort_values('ts')[['value']].reset_index(drop=True)
+        expected = encode_ra_features(series)
+        actual = encoded.iloc[start:start + len(series)]
+        for name in RA_FEATURES:
+            np.testing.assert_allclose(actual[name], expected[name], atol=1e-12)
+
+
+def test_analyze_time_series_per_entity_metrics():
+    """Test time_series mode reports metrics per entity and keeps row order"""
+    rows = [
+        {"sensor": "s1", "ts": 2, "value": 15},
+        {"sensor": "s2", "ts": 1, "value": 100},
+        {"sensor": "s1", "ts": 1, "value": 10},
+        {"sensor": "s2", "ts": 2, "value": 80},
+        {"sensor": "s1", "ts": 3, "value": 20},
+    ]
+    
+    response = client.post(
+        "/api/longevity/analyze",
+        headers=AUTH_HEADERS,
+        json={"data": rows, "mode": "time_series", "entity_column": "sensor", "timestamp_column": "ts"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    
+    assert len(data["predictions"]) == 5
+    assert set(data["ldrop_metrics_by_entity"]) == {"s1", "s2"}
+    assert data["ldrop_metrics_by_entity"]["s1"]["samples"] == 3
+    assert "ra_mean" in data["ra_score_deltas_by_entity"]["s2"]
+    assert "mean_prediction" in data["ldrop_metrics"]
+    
+    # Encoded rows come back in submission order
+    report = client.get(f"/api/longevity/report/{data['run_id']}", headers=AUTH_HEADERS).json()
+    assert [row["value"] for row in report["encoded_data"]] == [15, 100, 10, 80, 20]
+    
+    response = client.post(
+        "/api/longevity/analyze",
+        headers=AUTH_HEADERS,
+        json={"data": rows, "mode": "time_series", "entity_column": "missing"}
+    )
+    assert response.status_code == 400
+    
+    # Entities whose labels collide (1 and "1") would overwrite each other's metrics
+    mixed = [{"sensor": 1, "ts": 1, "value": 10}, {"sensor": "1", "ts": 1, "value": 20},
+             {"sensor": 1, "ts": 2, "value": 12}, {"sensor": "1", "ts": 2, "value": 25}]
+    response = client.post(
+        "/api/longevity/analyze",
+        headers=AUTH_HEADERS,
+        json={"data": mixed, "mode": "time_series", "entity_column": "sensor", "timestamp_column": "ts"}
+    )
+    assert response.status_code == 400
+    assert "'1'" in response.json()["detail"]
+
+
+
+def test_wide_encoding_matches_per_column_encoding():
+    """Test the 2-D kernel against encoding each column on its own"""
+    import numpy as np
+    import pandas as pd
+    from main import encode_ra_matrix, encode_ra_features, RA_FEATURES
+    
+    df = pd.DataFrame({
+        'value': [10.0, 15.0, 20.0, 18.0, 30.0],
+        'metric': [20.0, np.nan, 30.0, 35.0, 33.0],
+        'label': ['a', 'b', 'c', 'd', 'e']
+    })
+    
+    wide = encode_ra_matrix(df)
+    assert list(wide.columns) == [f"{name}_{col}" for name in RA_FEATURES for col in ('value', 'metric')]
+    
+    for col in ('value', 'metric'):
+        expected = encode_ra_features(df[[col]])
+        for name in RA_FEATURES:
+            np.testing.assert_allclose(wide[f"{name}_{col}"], expected[name], atol=1e-12)
+    
+    wide32 = encode_ra_matrix(df, ['value'], dtype=np.float32)
+    assert (wide32.dtypes == np.float32).all()
+    np.testing.assert_allclose(wide32['RA_value'], wide['RA_value'], atol=1e-6)
+
+
+def test_analyze_encode_all_columns():
+    """Test that encode_columns adds wide features for every numeric column"""
+    test_data = {
+        "data": [{"value": v, "metric": 100 - v} for v in range(10, 35, 5)],
+        "mode": "tabular",
+        "encode_columns": ["*"],
+        "feature_dtype": "float32"
+    }
+    
+    response = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json=test_data)
+    assert response.status_code == 200
+    
+    report = client.get(f"/api/longevity/report/{response.json()['run_id']}", headers=AUTH_HEADERS).json()
+    row = report["encoded_data"][0]
+    for name in ("RA_value", "D_value", "M_value", "S_value", "LR_value", "RA_metric", "LR_metric"):
+        assert name in row
+
+
+def test_resubmitted_analysis_is_deduplicated(isolated_analysis_cache):
+    """Test that identical content returns the existing run without retraining"""
+    rows = [{"value": v, "metric": 2 * v} for v in (10, 15, 20, 25, 30)]
+    first = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()
+    assert first["metadata"]["cache"] == "miss"
+    
+    # Same table with reordered keys and float values hashes to the same content
+    reordered = [{"metric": float(row["metric"]), "value": float(row["value"])} for row in rows]
+    second = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": reordered}).json()
+    assert second["run_id"] == first["run_id"]
+    assert second["metadata"]["cache"] == "run_hit"
+    assert second["predictions"] == first["predictions"]
+    
+    response = client.post("/api/longevity/analyze?job=true", headers=AUTH_HEADERS, json={"data": rows})
+    assert response.status_code == 200
+    assert response.json()["run_id"] == first["run_id"]
+    assert response.json()["deduplicated"] is True
+    
+    # Different options are different content
+    other = client.post("/api/longevity/analyze", headers=AUTH_HEADERS,
+                        json={"data": rows, "value_column": "metric"}).json()
+    assert other["run_id"] != first["run_id"]
+    
+    forced = client.post("/api/longevity/analyze?dedupe=false", headers=AUTH_HEADERS, json={"data": rows}).json()
+    assert forced["run_id"] != first["run_id"]
+    assert forced["metadata"]["cache"] == "miss"
+    
+    stats = isolated_analysis_cache.stats()
+    assert stats["runs"]["hits"] == 2
+    assert stats["runs"]["misses"] == 2
+
+
+def test_cached_model_reused_when_run_is_gone(isolated_analysis_cache):
+    """Test that a new run for known content reuses the fitted model"""
+    import shutil
+    
+    rows = [{"value": v} for v in (3, 1, 4, 1, 5, 9, 2, 6)]
+    first = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()
+    shutil.rmtree(_run_dir(first["run_id"]))
+    
+    second = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()
+    assert second["run_id"] != first["run_id"]
+    assert second["metadata"]["cache"] == "model_hit"
+    assert second["predictions"] == first["predictions"]
+    assert isolated_analysis_cache.stats()["models"]["hits"] == 1
+    
+    # The disk copy serves a fresh process with an empty memory cache
+    from main import AnalysisCache
+    restarted = AnalysisCache(isolated_analysis_cache.cache_dir, 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+    assert restarted.lookup_run(first["metadata"]["content_key"]) == second["run_id"]
+    assert restarted.lookup_model(first["metadata"]["content_key"]) is not None
+    assert restarted.stats()["models"]["disk_hits"] == 1
+
+
+def test_idempotency_key_replays_run():
+    """Test Idempotency-Key replays and conflicts"""
+    rows = [{"value": v} for v in (10, 20, 30, 40)]
+    headers = {**AUTH_HEADERS, "Idempotency-Key": "retry-123"}
+    
+    first = client.post("/api/longevity/analyze?dedupe=false", headers=headers, json={"data": rows})
+    second = client.post("/api/longevity/analyze?dedupe=false", headers=headers, json={"data": rows})
+    assert second.status_code == 200
+    assert second.json()["run_id"] == first.json()["run_id"]
+    
+    conflict = client.post("/api/longevity/analyze", headers=headers, json={"data": rows[:3]})
+    assert conflict.status_code == 422
+
+
+def test_append_removes_run_from_dedupe_index():
+    """Test that an extended run is not returned for its original content"""
+    rows = [{"value": v} for v in (10, 14, 9, 25, 30)]
+    run_id = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()["run_id"]
+    client.post(f"/api/longevity/append/{run_id}", headers=AUTH_HEADERS, json={"data": [{"value": 40}]})
+    
+    again = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()
+    assert again["run_id"] != run_id
+    assert len(again["predictions"]) == 5
+
+
+def test_predict_with_deployed_model():
+    """Test serving predictions from a deployed run's persisted model"""
+    import main
+    
+    rows = [{"value": v, "metric": 3 * v} for v in (10, 14, 9, 25, 30, 28, 31)]
+    analysis = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()
+    run_id = analysis["run_id"]
+    assert (_run_dir(run_id) / "model.joblib").exists()
+    
+    new_rows = {"data": [{"value": 12, "metric": 36}, {"value": 40, "metric": 120}]}
+    response = client.post(f"/api/longevity/predict/{run_id}", headers=AUTH_HEADERS, json=new_rows)
+    assert response.status_code == 409
+    
+    client.post("/api/longevity/deploy", headers=AUTH_HEADERS, json={
+        "run_id": run_id, "human_key": "human_key_12345", "logic_key": "logic_key_67890"
+    })
+    response = client.post(f"/api/longevity/predict/{run_id}", headers=AUTH_HEADERS, json=new_rows)
+    assert response.status_code == 200
+    assert len(response.json()["predictions"]) == 2
+    
+    # Rows already carrying the model features reproduce the training predictions
+    encoded = client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS).json()["encoded_data"]
+    response = client.post(f"/api/longevity/predict/{run_id}", headers=AUTH_HEADERS, json={"data": encoded})
+    assert response.json()["predictions"] == analysis["predictions"]
+    
+    stats = main.model_pool.stats()
+    assert stats["misses"] >= 1 and stats["hits"] >= 1
+    
+    response = client.post(f"/api/longevity/predict/{run_id}", headers=AUTH_HEADERS, json={"data": [{"other": 1}]})
+    assert response.status_code == 400
+
+
+def test_new_rows_continue_training_encoding():
+    """Test that prediction rows are encoded with the training scale and state"""
+    import numpy as np
+    import pandas as pd
+    from main import RAEncoder, encode_new_rows, AnalysisOptions, RA_FEATURES
+    
+    history = np.array([10.0, 14.0, 9.0, 25.0, 30.0])
+    encoder = RAEncoder("value")
+    encoder.encode(history)
+    
+    new = pd.DataFrame({"value": [12.0, 40.0]})
+    encoded = encode_new_rows(new, AnalysisOptions(), encoder.state_dict())
+    
+    full = RAEncoder("value")
+    raw = full.partial_encode(np.concatenate([history, new["value"]]))[len(history):]
+    expected = RAEncoder.from_state(encoder.state_dict()).normalize(raw)
+    np.testing.assert_allclose(encoded[list(RA_FEATURES)], expected)
+    assert encoder.rows == len(history)
+
+
+def test_prediction_batcher_coalesces_concurrent_requests(monkeypatch):
+    """Test that concurrent predictions share one predict call and get their own results"""
+    import asyncio
+    import numpy as np
+    import pandas as pd
+    from sklearn.ensemble import RandomForestRegressor
+    from main import DeployedModel, AnalysisOptions, AnalysisInputError, BatchStats
+    import main
+    
+    X = np.random.RandomState(0).rand(50, 2)
+    model = RandomForestRegressor(n_estimators=5, random_state=0).fit(X, X.sum(axis=1))
+    manifest = {"features": ["a", "b"], "options": AnalysisOptions().model_dump()}
+    deployed = DeployedModel(NONEXISTENT_RUN_ID, model, manifest)
+    deployed.batcher.max_wait = 0.05
+    
+    calls = []
+    original_predict = model.predict
+    model.predict = lambda X: calls.append(len(X)) or original_predict(X)
+    
+    frames = [pd.DataFrame({"a": X[i:i + 3, 0], "b": X[i:i + 3, 1]}) for i in range(0, 12, 3)]
+    bad = pd.DataFrame({"other": [1.0]})
+    
+    async def run_all():
+        return await asyncio.gather(
+            *(deployed.batcher.predict(df) for df in frames),
+            deployed.batcher.predict(bad),
+            return_exceptions=True
+        )
+    
+    stats = BatchStats(64)
+    monkeypatch.setattr(main, "batch_stats", stats)
+    results = asyncio.run(run_all())
+    
+    assert calls == [12]
+    for df, result in zip(frames, results):
+        np.testing.assert_allclose(result, original_predict(df.to_numpy()))
+    assert isinstance(results[-1], AnalysisInputError)
+    
+    summary = stats.stats()
+    assert summary["batches"] == 1
+    assert summary["requests"] == 5
+    assert summary["batch_rows"]["le_16"] == 1
+
+
+def test_results_stored_as_columns():
+    """Test that encoded data and predictions are written as columnar files and rebuilt for the report"""
+    import numpy as np
+    from main import read_columns
+    
+    rows = [{"value": v, "metric": 3 * v, "label": f"r{v}"} for v in (10, 14, 9, 25, 30)]
+    analysis = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()
+    run_id = analysis["run_id"]
+    
+    with open(_run_dir(run_id) / "results.json") as f:
+        manifest = json.load(f)
+    assert "encoded_data" not in manifest and "predictions" not in manifest
+    data = manifest["data"]
+    assert data["rows"] == 5
+    files = {column["name"]: column["file"] for column in data["columns"]}
+    assert files["RA"].endswith(".npy") and files["label"].endswith(".json")
+    
+    df, predictions = read_columns(run_id, data, columns=["RA"], offset=1, limit=2)
+    assert list(df.columns) == ["RA"] and len(df) == 2
+    assert isinstance(np.load(_run_dir(run_id) / data["path"] / files["RA"], mmap_mode="r"), np.memmap)
+    np.testing.assert_allclose(predictions, analysis["predictions"][1:3])
+    
+    report = client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS).json()
+    assert report["predictions"] == analysis["predictions"]
+    assert [row["label"] for row in report["encoded_data"]] == [row["label"] for row in rows]
+    
+    # An append switches to a new generation and removes the old one
+    client.post(f"/api/longevity/append/{run_id}", headers=AUTH_HEADERS,
+                json={"data": [{"value": 40, "metric": 120, "label": "r40"}]})
+    generations = list((_run_dir(run_id) / "data").iterdir())
+    assert len(generations) == 1 and f"data/{generations[0].name}" != data["path"]
+    report = client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS).json()
+    assert len(report["encoded_data"]) == 6
+
+
+def test_report_conditional_and_projected_reads():
+    """Test ETag revalidation, field projection, paging and the parsed report cache"""
+    import main
+    
+    rows = [{"value": v} for v in (10, 14, 9, 25, 30, 28)]
+    run_id = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": rows}).json()["run_id"]
+    url = f"/api/longevity/report/{run_id}"
+    
+    full = client.get(url, headers=AUTH_HEADERS)
+    etag = full.headers["ETag"]
+    hits = main.report_cache.stats()["hits"]
+    
+    cached = client.get(url, headers={**AUTH_HEADERS, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert main.report_cache.stats()["hits"] > hits
+    
+    projected = client.get(f"{url}?fields=ldrop_metrics,ra_score_deltas", headers=AUTH_HEADERS)
+    assert set(projected.json()) == {"ldrop_metrics", "ra_score_deltas"}
+    assert projected.headers["ETag"] != etag
+    
+    page = client.get(f"{url}?fields=predictions,encoded_data&offset=2&limit=3", headers=AUTH_HEADERS).json()
+    assert page["predictions"] == full.json()["predictions"][2:5]
+    assert page["encoded_data"] == full.json()["encoded_data"][2:5]
+    assert page["page"] == {"offset": 2, "limit": 3, "rows": 6}
+    
+    assert client.get(f"{url}?fields=nope", headers=AUTH_HEADERS).status_code == 400
+    
+    # Rewriting results.json (here by an append) changes the ETag
+    client.post(f"/api/longevity/append/{run_id}", headers=AUTH_HEADERS, json={"data": [{"value": 40}]})
+    fresh = client.get(url, headers={**AUTH_HEADERS, "If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert len(fresh.json()["predictions"]) == 7
+
+
+
+def test_parsed_file_cache_holds_one_entry_per_path(tmp_path):
+    """Test that rewritten files replace their entry and evicted paths leave nothing behind"""
+    import os
+    import main
+    
+    cache = main.ParsedFileCache(4096)
+    path = tmp_path / "results.json"
+    for i in range(20):
+        path.write_text(json.dumps({"version": i}))
+        os.utime(path, ns=(i, i))
+        assert cache.load(path)[0] == {"version": i}
+    assert len(cache._files) == 1
+    assert cache.lookup(path)[0] == {"version": 19}
+    
+    for i in range(500):
+        other = tmp_path / f"f{i}.json"
+        other.write_text(json.dumps({"i": i, "pad": "x" * 100}))
+        cache.load(other)
+    assert len(cache._files) < 50
+    assert cache.lookup(tmp_path / "f0.json") is None
+
+
+def test_bundle_streamed_on_request(tmp_path, monkeypatch):
+    """Test that bundle.zip is built on download, reflects deployments and is cached when enabled"""
+    import io
+    import zipfile
+    import main
+    
+    run_id = create_test_analysis()
+    response = client.get(f"/artifacts/{run_id}/bundle.zip")
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as bundle:
+        names = bundle.namelist()
+        assert bundle.testzip() is None
+        assert all(info.compress_type == zipfile.ZIP_DEFLATED for info in bundle.infolist())
+    assert "results.json" in names and "report.html" in names
+    assert any(name.startswith("data/") and name.endswith(".npy") for name in names)
+    assert "status.json" not in names and "deployment.json" not in names
+    
+    stored = client.get(f"/artifacts/{run_id}/bundle.zip?compression=stored")
+    with zipfile.ZipFile(io.BytesIO(stored.content)) as bundle:
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in bundle.infolist())
+    
+    fastest = client.get(f"/artifacts/{run_id}/bundle.zip?level=1")
+    smallest = client.get(f"/artifacts/{run_id}/bundle.zip?level=9")
+    assert len(smallest.content) < len(fastest.content) < len(stored.content)
+    for response in (fastest, smallest):
+        with zipfile.ZipFile(io.BytesIO(response.content)) as bundle:
+            assert bundle.testzip() is None
+    
+    cache = main.BundleCache(tmp_path / "bundles", 64 * 1024 ** 2)
+    monkeypatch.setattr(main, "bundle_cache", cache)
+    client.post("/api/longevity/deploy", headers=AUTH_HEADERS, json={
+        "run_id": run_id, "human_key": "human_key_12345", "logic_key": "logic_key_67890"
+    })
+    first = client.get(f"/artifacts/{run_id}/bundle.zip")
+    second = client.get(f"/artifacts/{run_id}/bundle.zip")
+    assert first.content == second.content
+    assert (cache.hits, cache.misses) == (1, 1)
+    with zipfile.ZipFile(io.BytesIO(second.content)) as bundle:
+        assert "deployment.json" in bundle.namelist()
+
+
+def test_artifact_writer_batches_durable_writes(tmp_path):
+    """Test atomic durable writes sharing fsync batches and write-behind flushing"""
+    import asyncio
+    from main import ArtifactWriter
+    
+    writer = ArtifactWriter(fsync=True)
+    
+    async def write_all():
+        await asyncio.gather(*(writer.write_json(tmp_path / f"f{i}.json", {"i": i}) for i in range(20)))
+        await writer.write(tmp_path / "page.html", "<html></html>", durable=False)
+        await writer.flush(tmp_path / "page.html")
+    
+    asyncio.run(write_all())
+    writer.close()
+    
+    assert all(json.loads((tmp_path / f"f{i}.json").read_text()) == {"i": i} for i in range(20))
+    assert (tmp_path / "page.html").read_text() == "<html></html>"
+    assert not list(tmp_path.glob(".*.tmp"))
+    stats = writer.stats()
+    assert stats["durable_writes"] == 20 and stats["write_behind"] == 1
+    assert stats["batches"] < 21 and stats["pending"] == 0
+
+
+def test_atomic_json_writes_from_concurrent_threads(tmp_path):
+    """Test that threads rewriting one JSON file never share a temp file"""
+    from concurrent.futures import ThreadPoolExecutor
+    from main import _write_json_atomic
+    
+    path = tmp_path / "status.json"
+    payloads = [{"writer": i, "rows": list(range(2000))} for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for future in [pool.submit(_write_json_atomic, path, payload) for payload in payloads * 25]:
+            future.result()
+    
+    assert json.loads(path.read_text()) in payloads
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_run_catalogue_lists_and_filters_runs(tmp_path, monkeypatch):
+    """Test that finished and deployed runs are indexed and searchable with keyset paging"""
+    import main
+    
+    from datetime import datetime, timezone
+    
+    # A new catalogue is backfilled with the runs of earlier tests; only list this test's runs
+    catalogue = main.RunCatalogue(tmp_path / "catalogue.db")
+    monkeypatch.setattr(main, "run_catalogue", catalogue)
+    backfilled = catalogue.count()
+    since = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    
+    low = client.post("/api/longevity/analyze", headers=AUTH_HEADERS,
+                      json={"data": [{"value": v} for v in (1, 2, 3, 4)], "value_column": "value"}).json()
+    high = client.post("/api/longevity/analyze", headers=AUTH_HEADERS,
+                       json={"data": [{"value": v} for v in (5, 9, 2, 7, 1)]}).json()
+    client.post("/api/longevity/deploy", headers=AUTH_HEADERS, json={
+        "run_id": high["run_id"], "human_key": "human_key_12345", "logic_key": "logic_key_67890"
+    })
+    
+    # Run directories are sharded by the first two hex digits
+    assert _run_dir(low["run_id"]).parent == ARTIFACTS_DIR / low["run_id"][:2]
+    
+    listing = client.get(f"/api/longevity/runs?created_after={since}", headers=AUTH_HEADERS).json()
+    assert [run["run_id"] for run in listing["runs"]] == [high["run_id"], low["run_id"]]
+    assert listing["next_cursor"] is None
+    
+    deployed = client.get(f"/api/longevity/runs?created_after={since}&deployed=true", headers=AUTH_HEADERS).json()["runs"]
+    assert [run["run_id"] for run in deployed] == [high["run_id"]]
+    assert deployed[0]["deployed_at"] is not None
+    
+    by_rows = client.get(f"/api/longevity/runs?created_after={since}&metric=rows:5:", headers=AUTH_HEADERS).json()["runs"]
+    assert [run["run_id"] for run in by_rows] == [high["run_id"]]
+    
+    first_page = client.get(f"/api/longevity/runs?created_after={since}&limit=1", headers=AUTH_HEADERS).json()
+    assert len(first_page["runs"]) == 1
+    second_page = client.get(f"/api/longevity/runs?created_after={since}&limit=1&cursor={first_page['next_cursor']}",
+                             headers=AUTH_HEADERS).json()
+    assert [run["run_id"] for run in second_page["runs"]] == [low["run_id"]]
+    
+    assert catalogue.count() == backfilled + 2
+    assert client.get("/api/longevity/runs?metric=nope:1:2", headers=AUTH_HEADERS).status_code == 400
+    assert client.get("/api/longevity/runs?created_after=2999-01-01T00:00:00Z",
+                      headers=AUTH_HEADERS).json()["runs"] == []
+    
+    # The public artifact URLs do not change with the sharded layout
+    assert client.get(f"/artifacts/{low['run_id']}/results.json").status_code == 200
+    assert client.get(f"/artifacts/{low['run_id']}/..%2Fcatalogue.db").status_code == 404
+
+
+def test_retention_evicts_least_recently_read_undeployed_runs(tmp_path, monkeypatch):
+    """Test the byte budget and age bound of artifact retention"""
+    import main
+    
+    # A new catalogue is backfilled with earlier runs; keep only this test's
+    catalogue = main.RunCatalogue(tmp_path / "catalogue.db")
+    monkeypatch.setattr(main, "run_catalogue", catalogue)
+    catalogue._execute("DELETE FROM runs")
+    retention = main.ArtifactRetention(0, 0, 60)
+    monkeypatch.setattr(main, "artifact_retention", retention)
+    
+    run_ids = [
+        client.post("/api/longevity/analyze?dedupe=false", headers=AUTH_HEADERS,
+                    json={"data": [{"value": v + i} for v in (1, 5, 2, 8)]}).json()["run_id"]
+        for i in range(4)
+    ]
+    deployed, read, unread, newest = run_ids
+    client.post("/api/longevity/deploy", headers=AUTH_HEADERS, json={
+        "run_id": deployed, "human_key": "human_key_12345", "logic_key": "logic_key_67890"
+    })
+    client.get(f"/api/longevity/report/{read}", headers=AUTH_HEADERS)
+    
+    runs, usage = catalogue.usage()
+    assert runs == 4 and usage > 0
+    
+    # Over budget by about one run: the oldest unread run goes first, never the deployed one
+    retention.max_bytes = usage - usage // 8
+    retention.collect(pause=0)
+    assert not _run_dir(unread).exists()
+    assert all(_run_dir(run_id).exists() for run_id in (deployed, read, newest))
+    stats = retention.stats()
+    assert stats["evicted_runs"] == 1 and stats["reclaimed_bytes"] > 0
+    assert stats["usage_bytes"] <= retention.max_bytes
+    assert client.get(f"/api/longevity/report/{unread}", headers=AUTH_HEADERS).status_code == 404
+    
+    # Age bound: every undeployed run old enough goes
+    aged = main.ArtifactRetention(0, 1e-6, 60)
+    aged.collect(pause=0)
+    assert _run_dir(deployed).exists()
+    assert not any(_run_dir(run_id).exists() for run_id in (read, newest))
+    assert catalogue.usage()[0] == 1
+
+
+def test_retention_pages_past_runs_it_cannot_remove(tmp_path, monkeypatch):
+    """Test that blocked least-recently-read runs do not stop the byte budget being met"""
+    import main
+    
+    catalogue = main.RunCatalogue(tmp_path / "catalogue.db")
+    monkeypatch.setattr(main, "run_catalogue", catalogue)
+    catalogue._execute("DELETE FROM runs")
+    retention = main.ArtifactRetention(0, 0, 60)
+    monkeypatch.setattr(main, "artifact_retention", retention)
+    
+    running, deploying, evictable, newest = [
+        client.post("/api/longevity/analyze?dedupe=false", headers=AUTH_HEADERS,
+                    json={"data": [{"value": v + i} for v in (1, 5, 2, 8)]}).json()["run_id"]
+        for i in range(4)
+    ]
+    main.update_run_status(running, status="running")
+    # Deployed on disk before the catalogue heard of it
+    (_run_dir(deploying) / "deployment.json").write_text("{}")
+    
+    # One byte over: the two oldest runs cover it but cannot go, so the next one must
+    retention.max_bytes = catalogue.usage()[1] - 1
+    retention.collect(pause=0)
+    assert not _run_dir(evictable).exists()
+    assert all(_run_dir(run_id).exists() for run_id in (running, deploying, newest))
+    assert retention.stats()["skipped_runs"] == 2
+    assert retention.stats()["usage_bytes"] <= retention.max_bytes
+    
+    # Keyset pages cover every candidate exactly once
+    first = catalogue.eviction_candidates(limit=1)
+    rest = catalogue.eviction_candidates(after=(first[0]["read_at"], first[0]["run_id"]))
+    assert [c["run_id"] for c in first + rest] == [running, deploying, newest]
+    
+    # A half-removed run left in its shard is not taken for a run
+    leftover = _run_dir(newest).with_name(f".{newest}.evicting")
+    leftover.mkdir()
+    try:
+        assert leftover not in set(main._iter_run_dirs())
+    finally:
+        leftover.rmdir()
+
+
 if __name__ == "__main__":
     # Run tests with pytest
     pytest.main([__file__, "-v"])
+
+
+def test_stage_timings_in_metadata_and_metrics_endpoint():
+    """Test that runs record their stage breakdown and /metrics exposes Prometheus histograms"""
+    csv_content = "value,metric\n10,20\n15,25\n20,30\n25,35\n30,40\n"
+    response = client.post(
+        "/api/longevity/analyze/csv",
+        headers=AUTH_HEADERS,
+        files={"file": ("data.csv", csv_content, "text/csv")}
+    )
+    assert response.status_code == 200
+    run_id = response.json()["run_id"]
+    stages = response.json()["metadata"]["stages"]
+    
+    assert {"parse", "encode", "train", "predict", "metrics", "artifacts"} <= set(stages)
+    assert all(entry["seconds"] >= 0 for entry in stages.values())
+    assert stages["train"]["rows"] == 5
+    assert stages["parse"]["bytes"] == len(csv_content)
+    report = client.get(f"/api/longevity/report/{run_id}", headers=AUTH_HEADERS).json()
+    assert report["metadata"]["stages"] == stages
+    client.get(f"/artifacts/{run_id}/bundle.zip")
+    
+    assert client.get("/metrics").status_code == 401
+    metrics = client.get("/metrics", headers=AUTH_HEADERS)
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    lines = metrics.text.splitlines()
+    assert "# TYPE ra_longevity_stage_duration_seconds histogram" in lines
+    for stage in ("parse", "train", "write", "bundle"):
+        assert any(line.startswith(f'ra_longevity_stage_duration_seconds_count{{stage="{stage}"}}')
+                   for line in lines)
+    # Requests are labelled by route template, not by run_id
+    assert any('route="/api/longevity/report/{run_id}"' in line and 'status="200"' in line
+               and line.startswith("ra_longevity_requests_total") for line in lines)
+    assert not any(run_id in line for line in lines)
+    
+    # Histogram buckets are cumulative and end with +Inf equal to the count
+    buckets = [line for line in lines
+               if line.startswith('ra_longevity_stage_duration_seconds_bucket{stage="train"')]
+    counts = [float(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and 'le="+Inf"' in buckets[-1]
+
+
+def test_profiled_analysis_saves_and_serves_profile(monkeypatch):
+    """Test that ?profile=true profiles the run for authorised tokens and the report serves it"""
+    import io
+    import pstats
+    import zipfile
+    import main
+    
+    test_data = {"data": [{"value": v} for v in range(10, 60, 5)]}
+    forbidden = client.post("/api/longevity/analyze?profile=true", headers=AUTH_HEADERS, json=test_data)
+    assert forbidden.status_code == 403
+    
+    monkeypatch.setattr(main, "PROFILE_TOKENS", {TEST_TOKEN})
+    plain = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json=test_data).json()
+    assert "profiled" not in plain["metadata"]
+    assert not (_run_dir(plain["run_id"]) / "profile").exists()
+    
+    # Identical content is analysed afresh rather than deduplicated
+    response = client.post("/api/longevity/analyze", headers={**AUTH_HEADERS, "X-Profile": "1"}, json=test_data)
+    assert response.status_code == 200
+    run_id = response.json()["run_id"]
+    assert run_id != plain["run_id"]
+    assert response.json()["metadata"]["profiled"] is True
+    
+    profile = client.get(f"/api/longevity/report/{run_id}?format=profile", headers=AUTH_HEADERS)
+    assert profile.status_code == 200
+    summary = profile.json()
+    assert summary["run_id"] == run_id
+    assert any("_compute_analysis" in entry["function"] for entry in summary["cpu"]["functions"])
+    assert summary["memory"]["peak_bytes"] > 0 and summary["memory"]["allocations"]
+    
+    raw = client.get(f"/api/longevity/report/{run_id}?format=pstats", headers=AUTH_HEADERS)
+    assert raw.status_code == 200
+    prof_path = _run_dir(run_id) / "profile" / "cpu.prof"
+    assert raw.content == prof_path.read_bytes()
+    assert pstats.Stats(str(prof_path)).total_calls > 0
+    
+    # Profiles are not public artifacts and are left out of bundles
+    assert client.get(f"/artifacts/{run_id}/profile/profile.json").status_code == 404
+    bundle = client.get(f"/artifacts/{run_id}/bundle.zip")
+    with zipfile.ZipFile(io.BytesIO(bundle.content)) as archive:
+        assert not any(name.startswith("profile/") for name in archive.namelist())
+    assert client.get(f"/api/longevity/report/{plain['run_id']}?format=profile",
+                      headers=AUTH_HEADERS).status_code == 404
+    monkeypatch.setattr(main, "PROFILE_TOKENS", set())
+    assert client.get(f"/api/longevity/report/{run_id}?format=profile", headers=AUTH_HEADERS).status_code == 403
+
+
+def test_analyze_and_report_negotiate_binary_formats():
+    """Test Accept negotiation: Arrow IPC and MessagePack carry the same predictions as JSON"""
+    pa = pytest.importorskip("pyarrow")
+    msgpack = pytest.importorskip("msgpack")
+    import numpy as np
+    
+    test_data = {"data": [{"value": v, "metric": v * 2} for v in range(10, 60, 5)]}
+    response = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json=test_data)
+    assert response.headers["content-type"] == "application/json"
+    analysis = response.json()
+    run_id = analysis["run_id"]
+    
+    arrow = client.post("/api/longevity/analyze",
+                        headers={**AUTH_HEADERS, "Accept": "application/vnd.apache.arrow.stream"}, json=test_data)
+    assert arrow.status_code == 200
+    assert arrow.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(arrow.content).read_all()
+    np.testing.assert_array_equal(table["predictions"].to_numpy(), analysis["predictions"])
+    fields = json.loads(table.schema.metadata[b"fields"])
+    assert fields["run_id"] == run_id and fields["metadata"]["cache"] == "run_hit"
+    
+    # q-values pick the preferred supported type
+    packed = client.post("/api/longevity/analyze", json=test_data, headers={
+        **AUTH_HEADERS, "Accept": "text/csv, application/json;q=0.5, application/msgpack"
+    })
+    assert packed.headers["content-type"] == "application/msgpack"
+    content = msgpack.unpackb(packed.content)
+    np.testing.assert_array_equal(np.frombuffer(content["predictions"], "<f8"), analysis["predictions"])
+    assert content["ldrop_metrics"] == analysis["ldrop_metrics"]
+    
+    refused = client.post("/api/longevity/analyze", headers={**AUTH_HEADERS, "Accept": "text/csv"}, json=test_data)
+    assert refused.status_code == 406
+    
+    # Reports: the encoded data columns and predictions in one record batch
+    report = client.get(f"/api/longevity/report/{run_id}?offset=2&limit=3", headers=AUTH_HEADERS).json()
+    arrow_report = client.get(f"/api/longevity/report/{run_id}?offset=2&limit=3",
+                              headers={**AUTH_HEADERS, "Accept": "application/vnd.apache.arrow.stream"})
+    assert arrow_report.headers["vary"] == "Accept"
+    assert arrow_report.headers["etag"] != client.get(
+        f"/api/longevity/report/{run_id}?offset=2&limit=3", headers=AUTH_HEADERS).headers["etag"]
+    table = pa.ipc.open_stream(arrow_report.content).read_all()
+    assert table.to_pydict()["predictions"] == report["predictions"]
+    assert table.column("RA").to_pylist() == [row["RA"] for row in report["encoded_data"]]
+    assert json.loads(table.schema.metadata[b"fields"])["page"] == report["page"]
+    
+    packed_report = msgpack.unpackb(client.get(f"/api/longevity/report/{run_id}",
+                                               headers={**AUTH_HEADERS, "Accept": "application/msgpack"}).content)
+    column = packed_report["encoded_data"]["metric"]
+    np.testing.assert_array_equal(np.frombuffer(column["data"], column["dtype"]), [v * 2 for v in range(10, 60, 5)])
+    
+    # format=html ignores Accept
+    html = client.get(f"/api/longevity/report/{run_id}?format=html", headers={**AUTH_HEADERS, "Accept": "text/html"})
+    assert html.status_code == 200
+
+
+def test_analyze_arrow_and_parquet_uploads_read_only_needed_columns(monkeypatch):
+    """Test Arrow IPC and Parquet bodies: projected reads that match the JSON analysis"""
+    import io
+    import main
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    
+    table = pa.table({
+        "label": ["x"] * 8,
+        "value": [float(v) for v in range(10, 50, 5)],
+        "metric": list(range(8)),
+        "unused": [1.5] * 8
+    })
+    expected = client.post("/api/longevity/analyze", headers=AUTH_HEADERS,
+                           json={"data": table.select(["value"]).to_pylist()}).json()
+    
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    arrow_headers = {**AUTH_HEADERS, "Content-Type": "application/vnd.apache.arrow.stream"}
+    response = client.post("/api/longevity/analyze?dedupe=false", headers=arrow_headers,
+                           content=sink.getvalue().to_pybytes())
+    assert response.status_code == 200
+    data = response.json()
+    assert data["predictions"] == expected["predictions"]
+    ingest = data["metadata"]["ingest"]
+    assert ingest["format"] == "arrow"
+    assert ingest["columns_read"] == ["value"] and ingest["columns_skipped"] == 3
+    assert "parse" in data["metadata"]["stages"]
+    sampled = client.post("/api/longevity/analyze?train_rows=4&train_sample=systematic", headers=arrow_headers,
+                          content=sink.getvalue().to_pybytes())
+    assert sampled.json()["metadata"]["model"]["sample"]["method"] == "systematic"
+    
+    # Options come from the query string; columns= keeps extra columns in the run
+    parquet = io.BytesIO()
+    pq.write_table(table, parquet)
+    parquet_headers = {**AUTH_HEADERS, "Content-Type": "application/vnd.apache.parquet"}
+    response = client.post("/api/longevity/analyze?value_column=metric&encode_columns=unused&columns=label",
+                           headers=parquet_headers, content=parquet.getvalue())
+    assert response.status_code == 200
+    ingest = response.json()["metadata"]["ingest"]
+    assert ingest["format"] == "parquet"
+    assert ingest["columns_read"] == ["label", "metric", "unused"]
+    report = client.get(f"/api/longevity/report/{response.json()['run_id']}?limit=1", headers=AUTH_HEADERS).json()
+    assert {"label", "metric", "RA_unused"} <= set(report["encoded_data"][0]) and "value" not in report["encoded_data"][0]
+    
+    missing = client.post("/api/longevity/analyze?value_column=absent", headers=parquet_headers,
+                          content=parquet.getvalue())
+    assert missing.status_code == 400
+    assert client.post("/api/longevity/analyze", headers=parquet_headers, content=b"not parquet").status_code == 400
+    unsupported = client.post("/api/longevity/analyze", headers={**AUTH_HEADERS, "Content-Type": "text/plain"},
+                              content=b"value\n1\n")
+    assert unsupported.status_code == 415
+    
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 100)
+    assert client.post("/api/longevity/analyze", headers=parquet_headers, content=parquet.getvalue()).status_code == 413
+
+
+def test_cold_start_defers_heavy_imports(tmp_path):
+    """Importing main and answering GET / must not load pandas, scikit-learn or joblib"""
+    import subprocess
+    
+    script = (
+        "import sys, json\n"
+        "import main\n"
+        "from fastapi.testclient import TestClient\n"
+        "assert TestClient(main.app).get('/').status_code == 200\n"
+        "print(json.dumps({'loaded': [m for m in ('pandas', 'sklearn', 'joblib', 'uvicorn') if m in sys.modules],\n"
+        "                  'artifacts_dir': main.ARTIFACTS_DIR.exists()}))\n"
+    )
+    env = {**os.environ, "ARTIFACTS_DIR": str(tmp_path / "artifacts"), "CACHE_DIR": str(tmp_path / "cache")}
+    result = subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).parent, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    cold = json.loads(result.stdout.splitlines()[-1])
+    assert cold == {"loaded": [], "artifacts_dir": False}
+    
+    # The warm-up hook loads them and exercises a full in-process analysis
+    import main
+    assert main.warm_up() > 0
+    assert client.get("/api/longevity/stats", headers=AUTH_HEADERS).json()["startup"]["import_seconds"] > 0
+
+
+def test_model_pool_preloads_newest_deployed_models_within_budget(tmp_path, monkeypatch):
+    """Test that deployed models are loaded ahead of /predict, newest first, up to the pool budget"""
+    import main
+    
+    # Backfilled with the runs of earlier tests, some of them deployed
+    monkeypatch.setattr(main, "run_catalogue", main.RunCatalogue(tmp_path / "catalogue.db"))
+    run_ids = []
+    for values in ((1, 2, 3, 4), (5, 9, 2, 7, 1)):
+        run_id = client.post("/api/longevity/analyze", headers=AUTH_HEADERS,
+                             json={"data": [{"value": v} for v in values]}).json()["run_id"]
+        client.post("/api/longevity/deploy", headers=AUTH_HEADERS, json={
+            "run_id": run_id, "human_key": "human_key_12345", "logic_key": "logic_key_67890"
+        })
+        run_ids.append(run_id)
+    undeployed = create_test_analysis()
+    
+    pool = main.ModelPool(1024 ** 3)
+    assert set(run_ids) <= set(pool.preload())
+    assert pool.lookup(run_ids[0]) is not None and pool.lookup(undeployed) is None
+    
+    newest = (main._run_dir(run_ids[1]) / "model.joblib").stat().st_size
+    assert main.ModelPool(newest).preload() == [run_ids[1]]
+    
+    # A refit model replaces the run's entry rather than adding one
+    entries = len(pool._models)
+    model_file = main._run_dir(run_ids[0]) / "model.joblib"
+    os.utime(model_file, ns=(model_file.stat().st_atime_ns, model_file.stat().st_mtime_ns + 1))
+    assert pool.lookup(run_ids[0]) is None
+    pool.load(run_ids[0])
+    assert pool.lookup(run_ids[0]) is not None and len(pool._models) == entries
+
+
+def test_production_server_forks_workers_and_drains(tmp_path):
+    """Test that `main.py serve` runs several workers on one port, replaces them on SIGHUP and exits on SIGTERM"""
+    import signal
+    import socket
+    import subprocess
+    import time
+    import httpx
+    
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {**os.environ, "ARTIFACTS_DIR": str(tmp_path / "artifacts"), "CACHE_DIR": str(tmp_path / "cache"),
+           "SERVER_WORKERS": "2", "HOST": "127.0.0.1", "PORT": str(port)}
+    server = subprocess.Popen([sys.executable, "main.py", "serve"], cwd=Path(__file__).parent, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/api/longevity/stats"
+    
+    def worker_pids(want: int) -> set:
+        pids = set()
+        deadline = time.monotonic() + 60
+        while len(pids) < want and time.monotonic() < deadline:
+            try:
+                pids.add(httpx.get(url, headers=AUTH_HEADERS, timeout=5).json()["server"]["pid"])
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        return pids
+    
+    try:
+        first = worker_pids(2)
+        assert len(first) == 2
+        server.send_signal(signal.SIGHUP)
+        deadline = time.monotonic() + 60
+        while not (worker_pids(1) - first) and time.monotonic() < deadline:
+            time.sleep(0.2)
+        assert worker_pids(1) - first
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=60) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+
+def test_model_engine_selection_budgets_and_metadata(monkeypatch):
+    """Test that the model engine is chosen per request or by size and recorded with its fit time"""
+    import main
+    
+    data = [{"value": float(v % 17), "metric": float(v % 5)} for v in range(60)]
+    auto = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": data}).json()
+    model = auto["metadata"]["model"]
+    assert model["engine"] == "random_forest" and model["auto"] is True
+    assert model["fit_seconds"] > 0 and model["estimators"] == 10 and model["rows"] == model["train_rows"] == 60
+    
+    for engine in ("hist_gradient_boosting", "linear"):
+        response = client.post("/api/longevity/analyze", headers=AUTH_HEADERS,
+                               json={"data": data, "engine": engine, "train_threads": 1})
+        assert response.status_code == 200
+        assert response.json()["metadata"]["model"]["engine"] == engine
+        run_id = response.json()["run_id"]
+        client.post("/api/longevity/deploy", headers=AUTH_HEADERS, json={
+            "run_id": run_id, "human_key": "human_key_12345", "logic_key": "logic_key_67890"
+        })
+        predicted = client.post(f"/api/longevity/predict/{run_id}", headers=AUTH_HEADERS, json={"data": data[:3]})
+        assert predicted.status_code == 200 and len(predicted.json()["predictions"]) == 3
+    
+    # Budgets: a row budget fits on a subset, an exhausted time budget stops after the first step
+    budgeted = client.post("/api/longevity/analyze", headers=AUTH_HEADERS,
+                           json={"data": data, "train_rows": 20, "train_seconds": 1e-9}).json()
+    model = budgeted["metadata"]["model"]
+    assert model["train_rows"] == 20 and len(budgeted["predictions"]) == 60
+    assert model["budget_exhausted"] is True and model["estimators"] < 10
+    
+    bad = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": data, "engine": "svm"})
+    assert bad.status_code == 422
+    
+    # Without an engine, large training sets go to histogram gradient boosting
+    options = main.AnalysisOptions()
+    assert main.select_engine(main.MODEL_AUTO_FOREST_MAX_ROWS, options) == "random_forest"
+    assert main.select_engine(main.MODEL_AUTO_FOREST_MAX_ROWS + 1, options) == "hist_gradient_boosting"
+    assert main.select_engine(10 ** 7, main.AnalysisOptions(train_rows=1000)) == "random_forest"
+    assert main.select_engine(10, main.AnalysisOptions(engine="linear")) == "linear"
+    
+    # Without a thread budget, concurrent fits share the cores instead of each taking all of them
+    monkeypatch.setattr(main, "available_cores", lambda: 8)
+    monkeypatch.setattr(main.analysis_pool, "max_workers", 4)
+    assert main.default_model_threads() == 2
+    monkeypatch.setattr(main.analysis_pool, "max_workers", 16)
+    assert main.default_model_threads() == 1
+
+
+def test_sampled_training_is_recorded_in_metadata_and_dkil_lock():
+    """Test that a row budget trains on a reservoir or stratified sample and records it for audit"""
+    import main
+    import numpy as np
+    
+    # Samplers: exact size, no repeats, deterministic, strata kept in proportion
+    rng = np.random.default_rng(0)
+    strata = rng.integers(0, 4, 10_000)
+    sample = main.stratified_sample(strata, 1000, np.random.default_rng(1), chunk_rows=512)
+    assert len(np.unique(sample)) == 1000
+    assert np.abs(np.bincount(strata[sample]) - np.bincount(strata) / 10).max() <= 1
+    assert np.array_equal(sample, main.stratified_sample(strata, 1000, np.random.default_rng(1), chunk_rows=4096))
+    reservoir = main.reservoir_sample(10_000, 500, np.random.default_rng(1), chunk_rows=300)
+    assert len(np.unique(reservoir)) == 500 and reservoir.min() >= 0 and reservoir.max() < 10_000
+    
+    data = [{"sensor": f"s{i % 3}", "ts": i, "value": float((i * 7) % 23)} for i in range(90)]
+    response = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={
+        "data": data, "mode": "time_series", "entity_column": "sensor", "timestamp_column": "ts",
+        "train_rows": 30, "train_sample": "stratified"
+    })
+    assert response.status_code == 200
+    result = response.json()
+    assert len(result["predictions"]) == 90
+    sample = result["metadata"]["model"]["sample"]
+    assert sample["method"] == "stratified" and sample["strata"] == "entity:sensor"
+    assert sample["rows"] == 90 and sample["sample_rows"] == 30 and sample["strata_count"] == 3
+    dkil = client.get(f"/artifacts/{result['run_id']}/dkil_lock.json").json()
+    assert dkil["approximate"] is True and dkil["training_sample"] == sample
+    
+    exact = client.post("/api/longevity/analyze", headers=AUTH_HEADERS, json={"data": data[:20]}).json()
+    assert exact["metadata"]["model"]["sample"] is None
+    dkil = client.get(f"/artifacts/{exact['run_id']}/dkil_lock.json").json()
+    assert dkil["approximate"] is False and dkil["training_sample"] is None
+    
+    # Uploads pick the sampling method as a query parameter
+    csv_content = "value\n" + "\n".join(str((i * 7) % 23) for i in range(90))
+    uploaded = client.post(
+        "/api/longevity/analyze/csv?train_rows=30&train_sample=systematic",
+        headers=AUTH_HEADERS,
+        files={"file": ("data.csv", csv_content, "text/csv")}
+    )
+    assert uploaded.status_code == 200
+    assert uploaded.json()["metadata"]["model"]["sample"]["method"] == "systematic"
+    assert client.post("/api/longevity/analyze/csv?train_sample=nope", headers=AUTH_HEADERS,
+                       files={"file": ("data.csv", csv_content, "text/csv")}).status_code == 422